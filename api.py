@@ -1,106 +1,275 @@
+import logging
 import requests
 import time
-from typing import Optional, List
-from logger_setup import logger
-from config import COMMON_HEADERS, COOKIES
-from bilibili_models import BilibiliHistoryItem
+from typing import Callable, Iterator, Optional, List, Tuple
+import http_client
+from logger_setup import logger, log_body
+from config import BILIBILI_API_BASE, COMMON_HEADERS, COOKIES, RATE_LIMIT_RETRIES, SUBTITLE_CACHE_ENABLED
+from metrics import metrics
+from rate_limiter import limiter
+from bilibili_models import BilibiliHistoryItem, loads, parse_history_page
+from subtitle_cache import get_cache, MISS
+from sync_state import SyncState
+from text_stream import CHUNK_SIZE, iter_subtitle_segments, iter_subtitle_text
 from datetime import datetime, timezone
 
-# 自定义等待时间（秒），可根据需求调整
-REQUEST_DELAY = 0.5
+SUPPORTED_METHODS = ('get', 'post', 'head')
 today = datetime.now(timezone.utc)
 today_str = today.strftime("%Y%m%d")
 
 
-def _log_response(name: str, response: requests.Response):
-    logger.info(f"{name} Status Code: {response.status_code}")
-    logger.debug(f"{name} Headers: {response.request.headers}")
-    logger.debug(f"{name} Body: {response.text[:500]}...")
+def _log_response(name: str, response: requests.Response, stream: bool = False):
+    logger.info("%s Status Code: %s", name, response.status_code)
+    # 请求头和响应体只在 DEBUG 下处理；响应体直接取已读取的 bytes，不做整体解码
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s Headers: %s", name, response.request.headers)
+        # 流式响应的正文还没读取，不能为了日志把它整体读进内存
+        if not stream:
+            log_body(name, response.content)
 
 
-def make_request(method: str, url: str, headers=None, cookies=None, params=None, name: str = "request") -> Optional[
-    requests.Response]:
+def make_request(method: str, url: str, headers=None, cookies=None, params=None, data=None, json=None,
+                 timeout=None, name: str = "request", stream: bool = False) -> Optional[requests.Response]:
     """
-    封装 requests 请求，统一添加日志和延迟。
-    :param method: 请求方法，'get' 或 'post' 等
+    封装 requests 请求，统一使用共享连接池、按 host 限流，并添加日志。
+    :param method: 请求方法，'get'、'post' 或 'head'
     :param url: 请求 URL
     :param headers: 请求头
     :param cookies: Cookies
     :param params: 查询参数
+    :param data: 表单或原始请求体（POST）
+    :param json: JSON 请求体（POST）
+    :param timeout: 超时时间，默认使用 config.HTTP_TIMEOUT
     :param name: 请求名称，用于日志记录
+    :param stream: 为 True 时不预先读取响应体，由调用方用 iter_content 分块消费并负责关闭响应
     :return: requests.Response 对象，如果失败返回 None
     """
     try:
-        if method.lower() == 'get':
-            res = requests.get(url, headers=headers, cookies=cookies, params=params)
-        else:
+        method = method.lower()
+        if method not in SUPPORTED_METHODS:
             raise ValueError(f"Unsupported method: {method}")
 
-        _log_response(name, res)
-        # 请求完成后等待一段时间
-        time.sleep(REQUEST_DELAY)
-        return res
+        kwargs = {"headers": headers, "cookies": cookies, "params": params}
+        if method == 'post':
+            kwargs.update(data=data, json=json)
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        if stream:
+            kwargs["stream"] = True
+
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            # 按 host 限流，字幕 CDN 等未配置的 host 不等待
+            limiter.acquire(url)
+            res = http_client.request(method, url, **kwargs)
+            _log_response(name, res, stream)
+            if not stream:
+                # 字节数归属到调用方所在的阶段；流式响应由调用方边读边计数
+                metrics.add_bytes(len(res.content))
+            retry_after = limiter.feedback(url, res.status_code, res.headers)
+            if retry_after is None or attempt == RATE_LIMIT_RETRIES:
+                return res
+            # 重试前释放连接
+            res.close()
+            logger.warning("%s throttled with status %s, retry %d/%d",
+                           name, res.status_code, attempt + 1, RATE_LIMIT_RETRIES)
+            if limiter.bucket_for(url) is None:
+                # 未限流的 host 没有令牌桶来负责冷却，直接按 Retry-After 等待
+                time.sleep(retry_after)
     except Exception as e:
-        logger.error(f"Error in {name}: {e}")
-        time.sleep(REQUEST_DELAY)  # 即使请求失败也等待，避免快速重试
+        logger.error("Error in %s: %s", name, e)
         return None
 
 
-def bilibili_history(limit=20, page=1, date=today_str) -> List[BilibiliHistoryItem]:
-    url = "https://api.bilibili.com/x/v2/history"
-    params = {"ps": limit, "pn": page}
+# 历史记录高水位在 SyncState 中的键名
+HISTORY_CURSOR = "bilibili_history.view_at"
+HISTORY_URL = f"{BILIBILI_API_BASE}/x/v2/history"
+PLAYER_URL = f"{BILIBILI_API_BASE}/x/player/wbi/v2"
+
+# 扩展 COMMON_HEADERS，添加 curl 请求中的额外头字段
+PLAYER_HEADERS = {
+    **COMMON_HEADERS,  # 继承原有通用请求头
+    "accept": "application/json, text/plain, */*",
+    "accept-language": "en,zh;q=0.9,zh-CN;q=0.8,zh-TW;q=0.7,ja;q=0.6",
+    "dnt": "1",
+    "origin": "https://www.bilibili.com",
+    "priority": "u=1, i",
+    "referer": f"https://www.bilibili.com/video/BV1ZFEaz7EZz/?spm_id_from=333.1391.0.0&vd_source=d9cfa635cfab03be3bb55be9a6a708ef",
+    "sec-ch-ua": '"Google Chrome";v="135", "Not-A.Brand";v="8", "Chromium";v="135"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"macOS"',
+    "sec-fetch-dest": "empty",
+    "sec-fetch-mode": "cors",
+    "sec-fetch-site": "same-site",
+    "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36"
+}
 
-    res = make_request('get', url, headers=COMMON_HEADERS, cookies=COOKIES, params=params, name="bilibili_history")
-    # 只要当天的视频
-    if res and res.status_code == 200:
-        return BilibiliHistoryItem.from_json_list(res.json())
-    logger.error(f"Failed with status {res.status_code if res else 'N/A'}")
-    return []
 
+def history_params(limit: int, page: int) -> dict:
+    return {"ps": limit, "pn": page}
 
-def get_subtitle_url(aid: int, cid: int) -> Optional[str]:
-    url = "https://api.bilibili.com/x/player/wbi/v2"
-    params = {
+
+def player_params(aid: int, cid: int) -> dict:
+    return {
         "aid": aid,
         "cid": cid,
         "isGaiaAvoided": "false"
     }
 
-    # 扩展 COMMON_HEADERS，添加 curl 请求中的额外头字段
-    custom_headers = {
-        **COMMON_HEADERS,  # 继承原有通用请求头
-        "accept": "application/json, text/plain, */*",
-        "accept-language": "en,zh;q=0.9,zh-CN;q=0.8,zh-TW;q=0.7,ja;q=0.6",
-        "dnt": "1",
-        "origin": "https://www.bilibili.com",
-        "priority": "u=1, i",
-        "referer": f"https://www.bilibili.com/video/BV1ZFEaz7EZz/?spm_id_from=333.1391.0.0&vd_source=d9cfa635cfab03be3bb55be9a6a708ef",
-        "sec-ch-ua": '"Google Chrome";v="135", "Not-A.Brand";v="8", "Chromium";v="135"',
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"macOS"',
-        "sec-fetch-dest": "empty",
-        "sec-fetch-mode": "cors",
-        "sec-fetch-site": "same-site",
-        "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36"
-    }
 
-    res = make_request('get', url, headers=custom_headers, cookies=COOKIES, params=params, name="get_subtitle_url")
-    if res and res.status_code == 200 and res.json().get("code") == 0:
-        aid = res.json().get("data", {}).get("aid")
-        cid = res.json().get("data", {}).get("cid")
-        logger.info(f"aid: {aid}")
-        logger.info(f"cid: {cid}")
-        subtitles = res.json().get("data", {}).get("subtitle", {}).get("subtitles", [])
-        return subtitles[0].get("subtitle_url") if subtitles else None
-    return None
+def normalize_subtitle_url(subtitle_url: str) -> str:
+    """字幕地址可能是协议相对地址（//开头），补全为 https"""
+    if subtitle_url.startswith("//"):
+        return "https:" + subtitle_url
+    return subtitle_url
 
 
-def get_subtitle_content(subtitle_url: str) -> Optional[str]:
-    if subtitle_url.startswith("//"):
-        subtitle_url = "https:" + subtitle_url
+def parse_subtitle_url(data: dict) -> Optional[str]:
+    """从 player 接口的 JSON 中取出第一条字幕地址"""
+    if data.get("code") != 0:
+        return None
+    player = data.get("data") or {}
+    logger.debug("aid: %s, cid: %s", player.get('aid'), player.get('cid'))
+    subtitles = (player.get("subtitle") or {}).get("subtitles", [])
+    return subtitles[0].get("subtitle_url") if subtitles else None
+
+
+def parse_subtitle_content(data: dict) -> str:
+    """把字幕 JSON 的 body 拼接为纯文本"""
+    body = data.get("body", [])
+    return " ".join([item.get("content", "") for item in body])
+
+
+def fetch_history_page(limit=20, page=1) -> Optional[List[BilibiliHistoryItem]]:
+    """拉取一页观看历史，请求失败时返回 None（与空页区分开）"""
+    with metrics.stage("history_fetch", page=page) as timer:
+        res = make_request('get', HISTORY_URL, headers=COMMON_HEADERS, cookies=COOKIES,
+                           params=history_params(limit, page), name="bilibili_history")
+        if res and res.status_code == 200:
+            return parse_history_page(res.content)
+        logger.error("Failed with status %s", res.status_code if res else 'N/A')
+        timer.fail(res.status_code if res else "request failed")
+        return None
+
+
+def bilibili_history(limit=20, page=1, date=None) -> List[BilibiliHistoryItem]:
+    """
+    拉取一页观看历史。
+    :param date: YYYYMMDD 格式的日期，指定时只保留当天（本地时间）观看的视频
+    """
+    items = fetch_history_page(limit=limit, page=page) or []
+    if date:
+        items = [item for item in items if datetime.fromtimestamp(item.view_at).strftime("%Y%m%d") == date]
+    return items
+
+
+def iter_history(limit=20, since: Optional[int] = None, state: Optional[SyncState] = None,
+                 max_pages: Optional[int] = None,
+                 on_complete: Optional[Callable[[int], None]] = None) -> Iterator[BilibiliHistoryItem]:
+    """
+    逐页惰性遍历观看历史（按 view_at 从新到旧），遇到 view_at 不晚于高水位的记录即停止。
+    遍历正常结束后把本次最新的 view_at 写回 state，下次只拉取新的观看记录；
+    调用方中途 break 时不会推进游标。
+    :param limit: 每页条数
+    :param since: 高水位（秒级时间戳），为 None 时从 state 中读取
+    :param state: 游标存储，为 None 时不读写游标
+    :param max_pages: 最多拉取的页数，为 None 时不限
+    :param on_complete: 指定时遍历结束后改为调用 on_complete(最新的 view_at)，由调用方根据各条记录的
+        处理结果决定推进到哪里（见 sync_state.cursor_before_failures）；此时不写 state
+    """
+    if since is None and state is not None:
+        since = state.get(HISTORY_CURSOR)
+    newest = since or 0
+    page = 1
+    while max_pages is None or page <= max_pages:
+        items = fetch_history_page(limit=limit, page=page)
+        if items is None:
+            # 中途失败时不推进游标，否则没拉到的旧记录下次会被跳过
+            logger.error("History walk aborted at page %d, cursor not advanced", page)
+            return
+        reached_cursor = False
+        for item in items:
+            if since and item.view_at <= since:
+                reached_cursor = True
+                break
+            newest = max(newest, item.view_at)
+            yield item
+        if reached_cursor or len(items) < limit:
+            break
+        page += 1
+    if newest > (since or 0):
+        if on_complete is not None:
+            on_complete(newest)
+        elif state is not None:
+            state.set(HISTORY_CURSOR, newest)
+
+
+def get_subtitle_url(aid: int, cid: int, use_cache: bool = SUBTITLE_CACHE_ENABLED) -> Optional[str]:
+    return lookup_subtitle_url(aid, cid, use_cache)[1]
+
+
+def lookup_subtitle_url(aid: int, cid: int,
+                        use_cache: bool = SUBTITLE_CACHE_ENABLED) -> Tuple[bool, Optional[str]]:
+    """
+    查询字幕地址，区分"没有字幕"和"查询失败"。
+    :return: (是否拿到了确定的结果, 字幕地址)；请求失败或接口返回错误码时为 (False, None)，调用方应稍后重试
+    """
+    if use_cache:
+        cached = get_cache().get_subtitle_url(aid, cid)
+        if cached is not MISS:
+            logger.info("get_subtitle_url cache hit: aid=%s, cid=%s", aid, cid)
+            metrics.event("subtitle_lookup", "cache_hit")
+            return True, cached
+
+    with metrics.stage("subtitle_lookup", aid=aid) as timer:
+        res = make_request('get', PLAYER_URL, headers=PLAYER_HEADERS, cookies=COOKIES,
+                           params=player_params(aid, cid), name="get_subtitle_url")
+        if res and res.status_code == 200:
+            data = loads(res.content)
+            subtitle_url = parse_subtitle_url(data)
+            # 只有接口正常返回时才缓存，包括"没有字幕"的结果
+            if data.get("code") != 0:
+                timer.fail(data.get("code"))
+                return False, None
+            if use_cache:
+                get_cache().put_subtitle_url(aid, cid, subtitle_url)
+            return True, subtitle_url
+        timer.fail(res.status_code if res else "request failed")
+        return False, None
+
+
+def get_subtitle_content(subtitle_url: str, use_cache: bool = SUBTITLE_CACHE_ENABLED) -> Optional[str]:
+    subtitle_url = normalize_subtitle_url(subtitle_url)
+    if use_cache:
+        content = get_cache().get_content(subtitle_url)
+        if content is not None:
+            logger.info("get_subtitle_content cache hit")
+            metrics.event("subtitle_download", "cache_hit")
+            return content
+
+    with metrics.stage("subtitle_download") as timer:
+        res = make_request('get', subtitle_url, headers=COMMON_HEADERS, name="get_subtitle_content", stream=True)
+        if res is None or res.status_code != 200:
+            if res is not None:
+                res.close()
+            timer.fail(res.status_code if res is not None else "request failed")
+            return None
+        try:
+            # 边下载边解析，只保留字幕文本本身，不先把整个响应体和 JSON 对象树读进内存
+            content = "".join(iter_subtitle_text(iter_subtitle_segments(_counted(res.iter_content(CHUNK_SIZE),
+                                                                                  timer))))
+        except Exception as e:
+            logger.error("Error in get_subtitle_content: %s", e)
+            timer.fail(e)
+            return None
+        finally:
+            res.close()
+        if use_cache:
+            get_cache().put_content(subtitle_url, content)
+        return content
+
 
-    res = make_request('get', subtitle_url, headers=COMMON_HEADERS, name="get_subtitle_content")
-    if res and res.status_code == 200:
-        body = res.json().get("body", [])
-        return " ".join([item.get("content", "") for item in body])
-    return None
+def _counted(chunks: Iterator[bytes], timer) -> Iterator[bytes]:
+    """透传字节块，同时把字节数记到阶段计时器上"""
+    for chunk in chunks:
+        timer.add_bytes(len(chunk))
+        yield chunk
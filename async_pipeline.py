@@ -0,0 +1,254 @@
+import asyncio
+from typing import Any, Optional, Tuple
+
+import aiohttp
+
+from api import (HISTORY_CURSOR, HISTORY_URL, PLAYER_URL, PLAYER_HEADERS, history_params, player_params,
+                 normalize_subtitle_url, parse_subtitle_url)
+from bilibili_models import BilibiliHistoryItem, loads
+from bundler import SourceBundler
+from dedup_index import DedupIndex
+from search_index import SearchIndex
+from config import (COMMON_HEADERS, COOKIES, HTTP_POOL_MAXSIZE, HTTP_TIMEOUT, RATE_LIMIT_RETRIES,
+                    ASYNC_HISTORY_CONCURRENCY, ASYNC_LOOKUP_CONCURRENCY, ASYNC_DOWNLOAD_CONCURRENCY,
+                    ASYNC_QUEUE_SIZE, SUBTITLE_CACHE_ENABLED)
+from logger_setup import logger, log_body
+from main import store_subtitle
+from metrics import metrics
+from rate_limiter import limiter
+from subtitle_cache import get_cache, MISS
+from sync_state import SyncState, cursor_before_failures
+from text_stream import CHUNK_SIZE, SubtitleStreamParser
+
+# 队列结束标记
+_DONE = object()
+
+
+async def _read_json(res: aiohttp.ClientResponse, name: str) -> Optional[dict]:
+    body = await res.read()
+    metrics.add_bytes(len(body))
+    log_body(name, body)
+    # 直接解析已读取的 bytes，不依赖响应的 Content-Type
+    return loads(body)
+
+
+async def _read_subtitle_text(res: aiohttp.ClientResponse, name: str) -> str:
+    """与 api.get_subtitle_content 相同：边下载边解析字幕 JSON，只保留字幕文本，不缓冲整个响应体"""
+    parser = SubtitleStreamParser()
+    texts = []
+    async for chunk in res.content.iter_chunked(CHUNK_SIZE):
+        metrics.add_bytes(len(chunk))
+        texts.extend(segment.get("content", "") for segment in parser.feed(chunk))
+    texts.extend(segment.get("content", "") for segment in parser.close())
+    content = " ".join(texts)
+    log_body(name, content)
+    return content
+
+
+async def async_request(session: aiohttp.ClientSession, url: str, headers=None, cookies=None, params=None,
+                        name: str = "request", read=_read_json) -> Optional[Tuple[int, Any]]:
+    """
+    make_request 的异步版本：共享限流器，遇到 412/429 按 Retry-After 重试。
+    :param read: 状态码为 200 时读取响应体的协程函数 read(res, name)，默认解析为 JSON
+    :return: (状态码, read 的结果)，非 200 时内容为 None；请求或解析失败返回 None
+    """
+    try:
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            await limiter.acquire_async(url)
+            async with session.get(url, headers=headers, cookies=cookies, params=params) as res:
+                logger.info("%s Status Code: %s", name, res.status)
+                retry_after = limiter.feedback(url, res.status, res.headers)
+                if retry_after is None or attempt == RATE_LIMIT_RETRIES:
+                    data = await read(res, name) if res.status == 200 else None
+                    return res.status, data
+            logger.warning("%s throttled with status %s, retry %d/%d",
+                           name, res.status, attempt + 1, RATE_LIMIT_RETRIES)
+            if limiter.bucket_for(url) is None:
+                await asyncio.sleep(retry_after)
+    except Exception as e:
+        logger.error("Error in %s: %s", name, e)
+        return None
+
+
+async def fetch_history_page(session: aiohttp.ClientSession, page: int, limit: int):
+    """拉取一页观看历史，请求失败时返回 None"""
+    with metrics.stage("history_fetch", page=page) as timer:
+        result = await async_request(session, HISTORY_URL, headers=COMMON_HEADERS, cookies=COOKIES,
+                                     params=history_params(limit, page), name="bilibili_history")
+        if result and result[1] is not None:
+            return BilibiliHistoryItem.from_json_list(result[1])
+        logger.error("Failed with status %s", result[0] if result else 'N/A')
+        timer.fail(result[0] if result else "request failed")
+        return None
+
+
+async def history_stage(session, out_queue: asyncio.Queue, max_pages: Optional[int], limit: int,
+                        concurrency: int, since: Optional[int] = None) -> Optional[int]:
+    """
+    历史记录阶段：每轮并发拉取 concurrency 页，遇到空页、高水位或达到 max_pages 时停止。
+    :return: 本次见到的最新 view_at，中途请求失败时返回 None
+    """
+    newest = since or 0
+    page = 1
+    while max_pages is None or page <= max_pages:
+        last_page = page + concurrency - 1 if max_pages is None else min(page + concurrency - 1, max_pages)
+        pages = range(page, last_page + 1)
+        results = await asyncio.gather(*(fetch_history_page(session, pn, limit) for pn in pages))
+        for pn, items in zip(pages, results):
+            if items is None:
+                logger.error("History walk aborted at page %d, cursor not advanced", pn)
+                return None
+            for item in items:
+                if since and item.view_at <= since:
+                    return newest
+                newest = max(newest, item.view_at)
+                await out_queue.put(item)
+            if len(items) < limit:
+                return newest
+        page = last_page + 1
+    return newest
+
+
+async def lookup_worker(session, in_queue: asyncio.Queue, out_queue: asyncio.Queue, stats: dict, failed: list):
+    """字幕地址查询阶段，查询失败的记录的 view_at 追加到 failed"""
+    # 缓存是同步的 SQLite 读写（含 commit），放到线程池中执行，避免阻塞事件循环
+    loop = asyncio.get_running_loop()
+    cache = await loop.run_in_executor(None, get_cache) if SUBTITLE_CACHE_ENABLED else None
+    while True:
+        item = await in_queue.get()
+        if item is _DONE:
+            return
+        subtitle_url = (await loop.run_in_executor(None, cache.get_subtitle_url, item.aid, item.cid)
+                        if cache else MISS)
+        if subtitle_url is MISS:
+            with metrics.stage("subtitle_lookup", aid=item.aid) as timer:
+                result = await async_request(session, PLAYER_URL, headers=PLAYER_HEADERS, cookies=COOKIES,
+                                             params=player_params(item.aid, item.cid), name="get_subtitle_url")
+                data = result[1] if result else None
+                if data is None:
+                    timer.fail(result[0] if result else "request failed")
+            if data is None or data.get("code") != 0:
+                failed.append(item.view_at)
+                stats["failed"] += 1
+                logger.warning("Subtitle lookup failed, will retry next sync: %s", item.title)
+                continue
+            subtitle_url = parse_subtitle_url(data)
+            if cache:
+                await loop.run_in_executor(None, cache.put_subtitle_url, item.aid, item.cid, subtitle_url)
+        else:
+            stats["cache_hits"] += 1
+            metrics.event("subtitle_lookup", "cache_hit")
+        if subtitle_url:
+            logger.info("Subtitle URL: %s", subtitle_url)
+            await out_queue.put((item, subtitle_url))
+        else:
+            stats["no_subtitle"] += 1
+            logger.warning("No subtitle found: %s", item.title)
+
+
+async def download_worker(session, in_queue: asyncio.Queue, stats: dict, failed: list,
+                          bundler: Optional[SourceBundler] = None, dedup: Optional[DedupIndex] = None,
+                          search: Optional[SearchIndex] = None):
+    """字幕下载阶段：下载正文并在线程池中写文件，避免阻塞事件循环；下载或写文件失败的记录的 view_at 追加到 failed"""
+    loop = asyncio.get_running_loop()
+    cache = await loop.run_in_executor(None, get_cache) if SUBTITLE_CACHE_ENABLED else None
+    while True:
+        entry = await in_queue.get()
+        if entry is _DONE:
+            return
+        item, subtitle_url = entry
+        subtitle_url = normalize_subtitle_url(subtitle_url)
+        content = await loop.run_in_executor(None, cache.get_content, subtitle_url) if cache else None
+        if content is None:
+            with metrics.stage("subtitle_download") as timer:
+                result = await async_request(session, subtitle_url, headers=COMMON_HEADERS,
+                                             name="get_subtitle_content", read=_read_subtitle_text)
+                if result and result[1] is not None:
+                    content = result[1]
+                else:
+                    timer.fail(result[0] if result else "request failed")
+            if cache and content is not None:
+                await loop.run_in_executor(None, cache.put_content, subtitle_url, content)
+        else:
+            stats["cache_hits"] += 1
+            metrics.event("subtitle_download", "cache_hit")
+        if content is not None:
+            # 查重、写文件、合集与全文索引都是同步 I/O，放到线程池中执行；写出成功后才收录到查重索引
+            duplicate, path = await loop.run_in_executor(None, store_subtitle, item, content, bundler, dedup, search)
+            if path is False:
+                failed.append(item.view_at)
+                stats["failed"] += 1
+                logger.warning("Subtitle write failed, will retry next sync: %s", item.title)
+                continue
+            if duplicate:
+                logger.info("Skipping near-duplicate of '%s' (similarity %.2f)", duplicate[1], duplicate[2])
+                stats["duplicates"] += 1
+                metrics.event("subtitle_download", "duplicate")
+                continue
+            # 文件已存在时 path 为 None，不计入写出数
+            if path:
+                stats["written"] += 1
+        else:
+            failed.append(item.view_at)
+            stats["failed"] += 1
+
+
+async def _run_stage(workers, next_queue: Optional[asyncio.Queue], next_workers: int):
+    """等待一个阶段的所有 worker 结束，然后通知下一阶段的每个 worker 退出"""
+    await asyncio.gather(*workers)
+    if next_queue is not None:
+        for _ in range(next_workers):
+            await next_queue.put(_DONE)
+
+
+async def harvest(max_pages: Optional[int] = None, limit: int = 20, state: Optional[SyncState] = None,
+                  since: Optional[int] = None, bundler: Optional[SourceBundler] = None,
+                  dedup: Optional[DedupIndex] = None, search: Optional[SearchIndex] = None,
+                  history_concurrency: int = ASYNC_HISTORY_CONCURRENCY,
+                  lookup_concurrency: int = ASYNC_LOOKUP_CONCURRENCY,
+                  download_concurrency: int = ASYNC_DOWNLOAD_CONCURRENCY) -> dict:
+    """
+    异步字幕抓取流水线：历史记录 -> 字幕地址 -> 字幕正文 -> 写文件，
+    各阶段通过有界队列连接，并发度分别可配。
+    :param max_pages: 最多拉取的历史记录页数，为 None 时不限
+    :param limit: 每页条数
+    :param state: 游标存储，指定时只处理高水位之后的观看记录，全部完成后推进游标；
+        字幕地址查询、下载或写文件失败的记录不会被游标越过，下次同步时重试
+    :param since: 高水位（秒级时间戳），为 None 时从 state 中读取
+    :param bundler: 指定时把写出的字幕同时追加到 NotebookLM 合集
+    :param dedup: 指定时跳过与已收录字幕近似重复的内容
+    :param search: 指定时把写出的字幕收录到全文索引
+    :return: 统计信息
+    """
+    if since is None and state is not None:
+        since = state.get(HISTORY_CURSOR)
+    stats = {"no_subtitle": 0, "written": 0, "failed": 0, "cache_hits": 0, "duplicates": 0}
+    failed = []
+    lookup_queue = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+    download_queue = asyncio.Queue(maxsize=ASYNC_QUEUE_SIZE)
+
+    timeout = aiohttp.ClientTimeout(sock_connect=HTTP_TIMEOUT[0], sock_read=HTTP_TIMEOUT[1])
+    connector = aiohttp.TCPConnector(limit_per_host=HTTP_POOL_MAXSIZE)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        history = [asyncio.create_task(history_stage(session, lookup_queue, max_pages, limit,
+                                                     history_concurrency, since))]
+        lookups = [asyncio.create_task(lookup_worker(session, lookup_queue, download_queue, stats, failed))
+                   for _ in range(lookup_concurrency)]
+        downloads = [asyncio.create_task(download_worker(session, download_queue, stats, failed, bundler, dedup,
+                                                         search))
+                     for _ in range(download_concurrency)]
+        await asyncio.gather(
+            _run_stage(history, lookup_queue, lookup_concurrency),
+            _run_stage(lookups, download_queue, download_concurrency),
+            _run_stage(downloads, None, 0),
+        )
+    newest = history[0].result()
+    cursor = cursor_before_failures(since, newest, failed) if newest else None
+    if state is not None and cursor is not None:
+        state.set(HISTORY_CURSOR, cursor)
+    logger.info("Async harvest finished: %s", stats)
+    return stats
+
+
+def run_harvest(**kwargs) -> dict:
+    return asyncio.run(harvest(**kwargs))
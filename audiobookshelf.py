@@ -1,9 +1,16 @@
-import requests
-from datetime import datetime
-from config import AUDIOBOOKSHELF_TOKEN
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+
+from api import make_request
+from bilibili_models import loads
+from config import AUDIOBOOKSHELF_TOKEN, AUDIOBOOKSHELF_URL, AUDIOBOOKSHELF_DB_PATH, AUDIOBOOKSHELF_PAGE_SIZE
+from logger_setup import logger
+from sync_state import SyncState
 
 # Audiobookshelf 服务器地址和 API 密钥
-SERVER_URL = "http://192.168.1.13:7331"
+SERVER_URL = AUDIOBOOKSHELF_URL
 API_TOKEN = AUDIOBOOKSHELF_TOKEN
 
 # 设置请求头，包含 API 密钥
@@ -12,51 +19,199 @@ headers = {
     "Content-Type": "application/json"
 }
 
+# 收听记录高水位（updatedAt，毫秒）在 SyncState 中的键名
+SESSIONS_CURSOR = "audiobookshelf.updated_at"
+SESSIONS_URL = f"{SERVER_URL}/api/me/listening-sessions"
+
+
+def fetch_sessions_page(page: int = 0, items_per_page: int = AUDIOBOOKSHELF_PAGE_SIZE) -> Optional[List[Dict]]:
+    """
+    拉取一页收听记录（服务端按 updatedAt 从新到旧排序，页码从 0 开始）。
+    :return: 本页记录，请求失败时返回 None（与空页区分开）
+    """
+    res = make_request('get', SESSIONS_URL, headers=headers, params={"itemsPerPage": items_per_page, "page": page},
+                       name="audiobookshelf_sessions")
+    if res is None or res.status_code != 200:
+        logger.error("Failed with status %s", res.status_code if res is not None else 'N/A')
+        return None
+    return loads(res.content).get("sessions") or []
+
+
+def iter_sessions(since: Optional[int] = None, state: Optional[SyncState] = None,
+                  items_per_page: int = AUDIOBOOKSHELF_PAGE_SIZE, max_pages: Optional[int] = None,
+                  on_complete: Optional[Callable[[int], None]] = None) -> Iterator[Dict]:
+    """
+    逐页惰性遍历收听记录，遇到 updatedAt 不晚于高水位的记录即停止。
+    与 api.iter_history 相同：遍历完整结束后才把最新的 updatedAt 写回 state，中途失败或 break 不推进游标。
+    :param since: 高水位（毫秒时间戳），为 None 时从 state 中读取
+    :param on_complete: 指定时遍历结束后改为调用 on_complete(最新的 updatedAt)，由调用方在记录
+        全部落库之后自己推进游标；此时不写 state
+    """
+    if since is None and state is not None:
+        since = state.get(SESSIONS_CURSOR)
+    newest = since or 0
+    page = 0
+    while max_pages is None or page < max_pages:
+        sessions = fetch_sessions_page(page, items_per_page)
+        if sessions is None:
+            logger.error("Listening session walk aborted at page %d, cursor not advanced", page)
+            return
+        reached_cursor = False
+        for session in sessions:
+            updated_at = session.get("updatedAt") or 0
+            if since and updated_at <= since:
+                reached_cursor = True
+                break
+            newest = max(newest, updated_at)
+            yield session
+        if reached_cursor or len(sessions) < items_per_page:
+            break
+        page += 1
+    if newest > (since or 0):
+        if on_complete is not None:
+            on_complete(newest)
+        elif state is not None:
+            state.set(SESSIONS_CURSOR, newest)
+
+
+class ListeningStore:
+    """
+    收听记录的本地 SQLite 库，每条收听会话一行（按会话 id 去重，重复同步时覆盖为最新内容）。
+    按 (library_item_id, updated_at) 和 updated_at 建索引，供按条目、按时间范围查询。
+    """
+
+    def __init__(self, path: str = AUDIOBOOKSHELF_DB_PATH):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS listening_sessions
+                (id TEXT PRIMARY KEY, library_item_id TEXT, display_title TEXT, display_author TEXT,
+                 media_type TEXT, duration REAL, time_listening REAL, date TEXT,
+                 started_at INTEGER, updated_at INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_sessions_item ON listening_sessions (library_item_id, updated_at);
+            CREATE INDEX IF NOT EXISTS idx_sessions_updated ON listening_sessions (updated_at);
+        ''')
+        self.conn.commit()
+
+    def upsert(self, sessions: List[Dict]) -> int:
+        rows = [(s.get("id"), s.get("libraryItemId"), s.get("displayTitle"), s.get("displayAuthor"),
+                 s.get("mediaType"), s.get("duration"), s.get("timeListening"), s.get("date"),
+                 s.get("startedAt"), s.get("updatedAt")) for s in sessions if s.get("id")]
+        with self._lock, self.conn:
+            self.conn.executemany('''
+                INSERT INTO listening_sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    time_listening = excluded.time_listening, date = excluded.date,
+                    updated_at = excluded.updated_at
+            ''', rows)
+        return len(rows)
+
+    def recent_sessions(self, limit: int = 10) -> List[Dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM listening_sessions ORDER BY updated_at DESC LIMIT ?",
+                                     (limit,)).fetchall()
+        return [dict(row) for row in rows]
 
-def get_recently_played():
+    def items_listened_between(self, start: datetime, end: datetime) -> List[Dict]:
+        """时间段内听过的条目（按条目汇总收听秒数），最近听过的在前"""
+        with self._lock:
+            rows = self.conn.execute('''
+                SELECT library_item_id, display_title, display_author, media_type,
+                       SUM(time_listening) AS time_listening, MAX(updated_at) AS last_listened_at
+                FROM listening_sessions
+                WHERE updated_at >= ? AND updated_at < ?
+                GROUP BY library_item_id
+                ORDER BY last_listened_at DESC
+            ''', (int(start.timestamp() * 1000), int(end.timestamp() * 1000))).fetchall()
+        return [dict(row) for row in rows]
+
+    def items_listened_today(self) -> List[Dict]:
+        """今天（本地时间）听过的条目"""
+        start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return self.items_listened_between(start, start + timedelta(days=1))
+
+    def item_sessions(self, library_item_id: str) -> List[Dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM listening_sessions WHERE library_item_id = ? "
+                                     "ORDER BY updated_at DESC", (library_item_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+_store: Optional[ListeningStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ListeningStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ListeningStore()
+    return _store
+
+
+def sync(store: Optional[ListeningStore] = None, state: Optional[SyncState] = None, since: Optional[int] = None,
+         batch_size: int = AUDIOBOOKSHELF_PAGE_SIZE) -> int:
+    """
+    增量同步：只拉取上次同步之后更新过的收听记录并写入本地库。
+    :return: 写入（新增或更新）的记录数
+    """
+    store = store or get_store()
+    state = state or SyncState()
+    if since is None:
+        since = state.get(SESSIONS_CURSOR)
+    count, batch, completed = 0, [], []
+    for session in iter_sessions(since=since, items_per_page=batch_size, on_complete=completed.append):
+        batch.append(session)
+        if len(batch) >= batch_size:
+            count += store.upsert(batch)
+            batch = []
+    if batch:
+        count += store.upsert(batch)
+    # 最后一批写入本地库之后才推进游标，写库失败时下次会重新拉取这些记录
+    if completed:
+        state.set(SESSIONS_CURSOR, completed[0])
+    logger.info("Synced %d listening sessions", count)
+    return count
+
+
+def items_listened_today(refresh: bool = True) -> List[Dict]:
+    """今天听过的条目，refresh 为 True 时先做一次增量同步"""
+    if refresh:
+        sync()
+    return get_store().items_listened_today()
+
+
+def get_recently_played(limit: int = 10):
     """
-    通过 Audiobookshelf API 获取最近听过的音频
+    增量同步后打印最近听过的音频
     """
     try:
-        # 构造 API 端点 URL
-        endpoint = f"{SERVER_URL}/api/me/listening-stats"
-
-        # 发送 GET 请求获取收听统计数据
-        response = requests.get(endpoint, headers=headers)
-
-        # 检查响应状态码
-        if response.status_code == 200:
-            data = response.json()
-
-            # 提取 recentSessions 部分
-            recent_sessions = data.get('recentSessions', [])
-
-            if recent_sessions:
-                print("最近听过的音频:")
-                for index, session in enumerate(recent_sessions, 1):
-                    library_item_id = session.get('libraryItemId', '未知')
-                    display_title = session.get('displayTitle', '未知标题')
-                    display_author = session.get('displayAuthor', '未知作者')
-                    time_listening = session.get('timeListening', 0)
-                    session_date = session.get('date', '未知日期')
-                    updated_at = session.get('updatedAt', 0)
-
-                    # 将时间戳转换为可读格式
-                    updated_at_dt = datetime.fromtimestamp(updated_at / 1000).strftime(
-                        '%Y-%m-%d %H:%M:%S') if updated_at else '未知时间'
-
-                    print(f"{index}. 标题: {display_title}")
-                    print(f"   作者: {display_author}")
-                    print(f"   音频 ID: {library_item_id}")
-                    print(f"   收听时间: {time_listening} 秒")
-                    print(f"   日期: {session_date}")
-                    print(f"   最后更新: {updated_at_dt}")
-                    print("")
-            else:
-                print("没有找到最近听过的音频记录。")
+        sync()
+        recent_sessions = get_store().recent_sessions(limit)
+        if recent_sessions:
+            print("最近听过的音频:")
+            for index, session in enumerate(recent_sessions, 1):
+                updated_at = session['updated_at']
+                # 将时间戳转换为可读格式
+                updated_at_dt = datetime.fromtimestamp(updated_at / 1000).strftime(
+                    '%Y-%m-%d %H:%M:%S') if updated_at else '未知时间'
+
+                print(f"{index}. 标题: {session['display_title'] or '未知标题'}")
+                print(f"   作者: {session['display_author'] or '未知作者'}")
+                print(f"   音频 ID: {session['library_item_id'] or '未知'}")
+                print(f"   收听时间: {session['time_listening'] or 0} 秒")
+                print(f"   日期: {session['date'] or '未知日期'}")
+                print(f"   最后更新: {updated_at_dt}")
+                print("")
         else:
-            print(f"请求失败，状态码: {response.status_code}")
-            print(response.text)
+            print("没有找到最近听过的音频记录。")
     except Exception as e:
         print(f"发生错误: {e}")
 
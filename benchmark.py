@@ -0,0 +1,179 @@
+"""
+端到端基准：启动本地模拟服务，把 B 站 / Audiobookshelf 地址指向它，
+分别跑串行抓取、异步抓取和 Audiobookshelf 客户端，输出各阶段吞吐、p50/p99 延迟和峰值内存。
+
+用法: python benchmark.py --items 200 --latency 0.02 --error-rate 0.01 --json bench.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+
+from mock_server import MockConfig, MockServer
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class StageRecorder:
+    """记录每个阶段每次调用的耗时，以及（串行场景下）单次调用新增的峰值内存"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.peak_bytes: Dict[str, int] = defaultdict(int)
+
+    def wrap(self, stage: str, func, track_memory: bool = False):
+        def wrapper(*args, **kwargs):
+            if track_memory and tracemalloc.is_tracing():
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.latencies[stage].append(time.perf_counter() - started)
+                if track_memory and tracemalloc.is_tracing():
+                    peak = tracemalloc.get_traced_memory()[1] - before
+                    self.peak_bytes[stage] = max(self.peak_bytes[stage], peak)
+        return wrapper
+
+    def wrap_async(self, func):
+        """异步请求按 name 参数区分阶段；并发执行时无法区分各阶段内存，只记录耗时"""
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.latencies[kwargs.get("name", "request")].append(time.perf_counter() - started)
+        return wrapper
+
+    def report(self, elapsed: float) -> Dict[str, dict]:
+        return {stage: {
+            "count": len(values),
+            "throughput_per_s": len(values) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "peak_kb": self.peak_bytes[stage] / 1024 if stage in self.peak_bytes else None,
+        } for stage, values in self.latencies.items()}
+
+
+@contextlib.contextmanager
+def patched(module, name, value):
+    original = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+def run_scenario(name: str, func, recorder: StageRecorder, items: int) -> dict:
+    tracemalloc.start()
+    started = time.perf_counter()
+    # 被测代码会 print 每个写出的文件，基准输出中不需要
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"scenario": name, "elapsed_s": elapsed, "items_per_s": items / elapsed if elapsed else 0.0,
+            "peak_memory_kb": peak / 1024, "stages": recorder.report(elapsed)}
+
+
+def bench_serial(items: int) -> dict:
+    import api
+    import main
+
+    recorder = StageRecorder()
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(patched(api, "fetch_history_page",
+                                    recorder.wrap("bilibili_history", api.fetch_history_page, True)))
+        for stage in ("lookup_subtitle_url", "get_subtitle_content", "write_to_file"):
+            stack.enter_context(patched(main, stage, recorder.wrap(stage, getattr(main, stage), True)))
+        return run_scenario("serial_harvest", lambda: main.harvest(since=0), recorder, items)
+
+
+def bench_async(items: int) -> dict:
+    import async_pipeline
+    import main
+
+    recorder = StageRecorder()
+    # 异步流水线通过 main.store_subtitle 写文件
+    with patched(async_pipeline, "async_request", recorder.wrap_async(async_pipeline.async_request)), \
+            patched(main, "write_to_file", recorder.wrap("write_to_file", main.write_to_file)):
+        return run_scenario("async_harvest", lambda: asyncio.run(async_pipeline.harvest(since=0)), recorder, items)
+
+
+def bench_audiobookshelf(repeat: int) -> dict:
+    import audiobookshelf
+
+    # 第一次调用全量同步，之后每次只拉取第一页确认没有新记录
+    recorder = StageRecorder()
+    stage = recorder.wrap("recently_played", audiobookshelf.get_recently_played, True)
+    with patched(audiobookshelf, "fetch_sessions_page",
+                 recorder.wrap("listening_sessions", audiobookshelf.fetch_sessions_page, True)):
+        return run_scenario("audiobookshelf", lambda: [stage() for _ in range(repeat)], recorder, repeat)
+
+
+def print_report(results: List[dict]):
+    for result in results:
+        print(f"\n== {result['scenario']}: {result['elapsed_s']:.2f}s, {result['items_per_s']:.1f} items/s, "
+              f"peak {result['peak_memory_kb']:.0f} KB")
+        print(f"{'stage':<24}{'count':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak KB':>10}")
+        for stage, row in result["stages"].items():
+            peak = f"{row['peak_kb']:.0f}" if row["peak_kb"] is not None else "-"
+            print(f"{stage:<24}{row['count']:>8}{row['throughput_per_s']:>10.1f}"
+                  f"{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}{peak:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="NotebookLMHelper 端到端基准")
+    parser.add_argument("--items", type=int, default=200, help="观看历史条数")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟服务的单次请求延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟服务返回 500/429 的概率")
+    parser.add_argument("--segments", type=int, default=400, help="每份字幕的片段数")
+    parser.add_argument("--api-rate", type=float, default=50, help="B 站 API 的限流速率（请求/秒）")
+    parser.add_argument("--abs-repeat", type=int, default=20, help="Audiobookshelf 客户端调用次数")
+    parser.add_argument("--scenarios", default="serial,async,audiobookshelf")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    mock_config = MockConfig(latency=args.latency, error_rate=args.error_rate, total_items=args.items,
+                             subtitle_segments=args.segments)
+    with MockServer(mock_config) as server, tempfile.TemporaryDirectory() as workdir:
+        # config 在导入时读取环境变量，必须在导入被测模块之前设置
+        os.environ.update({
+            "BILIBILI_API_BASE": server.url,
+            "AUDIOBOOKSHELF_URL": server.url,
+            "BILIBILI_API_RATE": str(args.api_rate),
+            "BILIBILI_API_BURST": str(max(1, int(args.api_rate))),
+            "NOTEBOOKLM_DIR": workdir,
+            "SYNC_STATE_PATH": os.path.join(workdir, "sync_state.json"),
+            "AUDIOBOOKSHELF_DB_PATH": os.path.join(workdir, "audiobookshelf.db"),
+            "SUBTITLE_CACHE_ENABLED": "0",
+            "DEDUP_ENABLED": "0",
+            "SEARCH_ENABLED": "0",
+        })
+        scenarios = {
+            "serial": lambda: bench_serial(args.items),
+            "async": lambda: bench_async(args.items),
+            "audiobookshelf": lambda: bench_audiobookshelf(args.abs_repeat),
+        }
+        results = [scenarios[name.strip()]() for name in args.scenarios.split(",") if name.strip()]
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -1,10 +1,28 @@
-from dataclasses import dataclass
+import json
+from array import array
+from dataclasses import dataclass, fields
 from datetime import datetime
-from typing import Dict, List
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Union
 
+try:
+    import orjson
+except ImportError:  # 没有 orjson 时使用标准库，结果相同
+    orjson = None
 
-@dataclass
+
+def loads(data: Union[bytes, str]):
+    """解析 JSON：安装了 orjson 时使用 orjson，直接接受 bytes，不需要先解码"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@dataclass(frozen=True)
 class BilibiliHistoryItem:
+    # 手动声明 __slots__：没有 __dict__，每条记录省下一个字典
+    __slots__ = ('title', 'redirect_link', 'short_link', 'bvid', 'aid', 'cid', 'pubdate', 'duration', 'view_at',
+                 'owner_name', 'view_count', 'like_count', 'favorite_count', 'coin_count', 'share_count')
+
     title: str
     redirect_link: str
     short_link: str
@@ -43,26 +61,143 @@ class BilibiliHistoryItem:
             f"Favorites: {self.favorite_count}, Coins: {self.coin_count}, Shares: {self.share_count}\n"
         )
 
+    # frozen + 手动 __slots__ 时默认的 pickle 会在恢复时调用被禁止的 __setattr__（3.10 的 slots=True 才修复）
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
+
     @classmethod
     def from_json(cls, json_data: Dict) -> 'BilibiliHistoryItem':
+        get = json_data.get
+        # 嵌套的 owner / stat 只取一次；接口偶尔返回 null，用 or 兜底（与 HistoryBatch.append_json 一致，
+        # 否则 None 写入 HistoryBatch 的整数列时会抛 TypeError）
+        owner = get('owner') or {}
+        stat = get('stat') or {}
         return cls(
-            title=json_data.get('title', ''),
-            redirect_link=json_data.get('redirect_link', ''),
-            short_link=json_data.get('short_link_v2', ''),
-            bvid=json_data.get('bvid', ''),
-            aid=json_data.get('aid', 0),
-            cid=json_data.get('cid', 0),
-            pubdate=json_data.get('pubdate', 0),
-            duration=json_data.get('duration', 0),
-            view_at=json_data.get('view_at', 0),
-            owner_name=json_data.get('owner', {}).get('name', ''),
-            view_count=json_data.get('stat', {}).get('view', 0),
-            like_count=json_data.get('stat', {}).get('like', 0),
-            favorite_count=json_data.get('stat', {}).get('favorite', 0),
-            coin_count=json_data.get('stat', {}).get('coin', 0),
-            share_count=json_data.get('stat', {}).get('share', 0)
+            get('title') or '',
+            get('redirect_link') or '',
+            get('short_link_v2') or '',
+            get('bvid') or '',
+            get('aid') or 0,
+            get('cid') or 0,
+            get('pubdate') or 0,
+            get('duration') or 0,
+            get('view_at') or 0,
+            owner.get('name') or '',
+            stat.get('view') or 0,
+            stat.get('like') or 0,
+            stat.get('favorite') or 0,
+            stat.get('coin') or 0,
+            stat.get('share') or 0,
         )
 
+    @classmethod
+    def iter_json(cls, json_response: Dict) -> Iterator['BilibiliHistoryItem']:
+        """逐条惰性构造，适合只需要遍历一次的大批量数据"""
+        from_json = cls.from_json
+        for item in json_response.get("data") or []:
+            yield from_json(item)
+
     @classmethod
     def from_json_list(cls, json_response: Dict) -> List['BilibiliHistoryItem']:
-        return [cls.from_json(item) for item in json_response.get("data", [])]
+        return list(cls.iter_json(json_response))
+
+
+def parse_history_page(raw: Union[bytes, str]) -> List[BilibiliHistoryItem]:
+    """从原始响应体解析一页观看历史"""
+    return BilibiliHistoryItem.from_json_list(loads(raw))
+
+
+# 列式存储中整数列使用的 array 类型码（有符号 64 位）
+_INT_COLUMNS = tuple(f.name for f in fields(BilibiliHistoryItem) if f.type in (int, 'int'))
+_STR_COLUMNS = tuple(f.name for f in fields(BilibiliHistoryItem) if f.type in (str, 'str'))
+
+
+class HistoryBatch:
+    """
+    观看历史的列式批量表示：整数字段存为 array('q')，字符串字段存为 list，
+    用于对上万条历史导出做过滤、排序和统计，不必为每条记录构造一个对象。
+    需要单条记录时用 batch[i] 按需构造 BilibiliHistoryItem。
+    """
+
+    INT_COLUMNS = _INT_COLUMNS
+    STR_COLUMNS = _STR_COLUMNS
+
+    def __init__(self):
+        self.columns: Dict[str, Union[array, list]] = {name: array('q') for name in self.INT_COLUMNS}
+        self.columns.update({name: [] for name in self.STR_COLUMNS})
+
+    def __len__(self) -> int:
+        return len(self.columns['aid'])
+
+    def __getitem__(self, index: int) -> BilibiliHistoryItem:
+        return BilibiliHistoryItem(**{name: self.columns[name][index] for name in self.columns})
+
+    def __iter__(self) -> Iterator[BilibiliHistoryItem]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, name: str) -> Union[array, list]:
+        return self.columns[name]
+
+    def append(self, item: BilibiliHistoryItem):
+        for name, values in self.columns.items():
+            values.append(getattr(item, name))
+
+    def append_json(self, json_data: Dict):
+        """直接从接口 JSON 追加一条，不经过 BilibiliHistoryItem"""
+        get = json_data.get
+        owner = get('owner') or {}
+        stat = get('stat') or {}
+        columns = self.columns
+        columns['title'].append(get('title') or '')
+        columns['redirect_link'].append(get('redirect_link') or '')
+        columns['short_link'].append(get('short_link_v2') or '')
+        columns['bvid'].append(get('bvid') or '')
+        columns['aid'].append(get('aid', 0) or 0)
+        columns['cid'].append(get('cid', 0) or 0)
+        columns['pubdate'].append(get('pubdate', 0) or 0)
+        columns['duration'].append(get('duration', 0) or 0)
+        columns['view_at'].append(get('view_at', 0) or 0)
+        columns['owner_name'].append(owner.get('name') or '')
+        columns['view_count'].append(stat.get('view') or 0)
+        columns['like_count'].append(stat.get('like') or 0)
+        columns['favorite_count'].append(stat.get('favorite') or 0)
+        columns['coin_count'].append(stat.get('coin') or 0)
+        columns['share_count'].append(stat.get('share') or 0)
+
+    @classmethod
+    def from_items(cls, items: Iterable[BilibiliHistoryItem]) -> 'HistoryBatch':
+        batch = cls()
+        for item in items:
+            batch.append(item)
+        return batch
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[Union[bytes, str, Dict]]) -> 'HistoryBatch':
+        """从多页原始响应体（或已解析的 JSON）构建，用于导入历史导出文件"""
+        batch = cls()
+        for page in pages:
+            data = loads(page) if isinstance(page, (bytes, str)) else page
+            for item in data.get("data") or []:
+                batch.append_json(item)
+        return batch
+
+    def take(self, indices: Sequence[int]) -> 'HistoryBatch':
+        """按下标取出若干行，组成新的批"""
+        batch = HistoryBatch()
+        for name, values in self.columns.items():
+            taken = [values[i] for i in indices]
+            batch.columns[name] = array('q', taken) if name in self.INT_COLUMNS else taken
+        return batch
+
+    def where(self, column: str, predicate: Callable[[object], bool]) -> 'HistoryBatch':
+        """按单列条件过滤，如 batch.where('view_at', lambda t: t >= since)"""
+        return self.take([i for i, value in enumerate(self.columns[column]) if predicate(value)])
+
+    def sort_by(self, column: str, reverse: bool = False) -> 'HistoryBatch':
+        values = self.columns[column]
+        return self.take(sorted(range(len(values)), key=values.__getitem__, reverse=reverse))
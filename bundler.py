@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Callable, Iterable, Optional
+
+from bilibili_models import BilibiliHistoryItem
+from config import BUNDLE_DIR, BUNDLE_MAX_BYTES, BUNDLE_MAX_WORDS
+from logger_setup import logger
+from text_stream import CHUNK_SIZE, CJK_CHARS, iter_decoded, mapped_file
+
+# 记录各合集文件及已收录条目的状态文件
+STATE_NAME = '.bundles.json'
+# 状态文件之后的增量日志：每次追加只写一两行，打开时重放并合并回状态文件
+JOURNAL_NAME = '.bundles.journal'
+# 日志累积到这么多条时合并一次
+JOURNAL_COMPACT_ENTRIES = 1000
+ENTRY_SEPARATOR = "=" * 40
+_WORD = re.compile(r'[A-Za-z0-9]+')
+# 块末尾未结束的字母数字串，留到下一块再计数
+_TRAILING_WORD = re.compile(r'[A-Za-z0-9]+\Z')
+# 向前解码末尾多少字节来确定去掉尾部空白后的长度
+_TAIL_BYTES = 4096
+
+
+def count_words(text: str) -> int:
+    """NotebookLM 按词数限制来源大小：中日韩字符每个算一个词，其余按字母数字串计数"""
+    return len(CJK_CHARS.findall(text)) + len(_WORD.findall(text))
+
+
+def count_words_chunks(chunks: Iterable[str]) -> int:
+    """分块计数，与 count_words("".join(chunks)) 结果相同：跨块的字母数字串只算一次"""
+    total, carry = 0, ''
+    for chunk in chunks:
+        text = carry + chunk
+        match = _TRAILING_WORD.search(text)
+        carry = match.group() if match else ''
+        total += count_words(text[:len(text) - len(carry)])
+    return total + (1 if carry else 0)
+
+
+def content_key(buffer, end: Optional[int] = None) -> str:
+    """
+    去重键：去掉尾部空白后的正文的 sha256。add 和 add_file 收录同一份字幕时得到相同的键，
+    不依赖 bvid 或文件路径。
+    :param buffer: 正文的 UTF-8 字节（bytes 或 mmap），按块计算，只取前 end 个字节
+    """
+    h = hashlib.sha256()
+    end = len(buffer) if end is None else end
+    for offset in range(0, end, CHUNK_SIZE):
+        h.update(buffer[offset:min(offset + CHUNK_SIZE, end)])
+    return f"sha256:{h.hexdigest()}"
+
+
+def format_header(title: str, url: str = '', meta: str = '') -> str:
+    header = [ENTRY_SEPARATOR, f"标题: {title}"]
+    if url:
+        header.append(f"链接: {url}")
+    if meta:
+        header.append(meta)
+    header.append(ENTRY_SEPARATOR)
+    return "\n".join(header) + "\n"
+
+
+def format_entry(title: str, url: str = '', meta: str = '', content: str = '') -> str:
+    return format_header(title, url, meta) + content.rstrip() + "\n\n"
+
+
+def _rstripped_size(buffer) -> int:
+    """UTF-8 字节缓冲区去掉尾部空白（与 str.rstrip 一致）后的字节长度，只解码末尾几 KB"""
+    end = len(buffer)
+    while end > 0:
+        start = max(0, end - _TAIL_BYTES)
+        # 从字符边界开始解码，跳过 UTF-8 续字节
+        while 0 < start < end and 0x80 <= buffer[start] < 0xC0:
+            start -= 1
+        tail = buffer[start:end].decode('utf-8', 'surrogateescape')
+        stripped = tail.rstrip()
+        if stripped:
+            return start + len(stripped.encode('utf-8', 'surrogateescape'))
+        end = start
+    return 0
+
+
+class SourceBundler:
+    """
+    把逐条写出的字幕打包进少量 NotebookLM 来源文档。
+    按 max_bytes / max_words 预算顺序装箱：新条目追加到最后一个未满的合集，装不下时新开一个；
+    已收录的条目（按正文摘要去重）不会重复写入，已有合集也不会重建。
+    状态文件只在打开时和日志过长时整体重写，每次追加只往日志里写两行：
+    追加前记下目标合集和写入前的文件长度，追加完成后记下条目。追加后崩溃、条目没来得及记录时，
+    下次打开会把合集截断回记录的长度，重跑时不会出现重复的条目。
+    """
+
+    def __init__(self, directory: str = BUNDLE_DIR, max_bytes: int = BUNDLE_MAX_BYTES,
+                 max_words: int = BUNDLE_MAX_WORDS, prefix: str = 'bundle'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_words = max_words
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._state_path = os.path.join(directory, STATE_NAME)
+        self._journal_path = os.path.join(directory, JOURNAL_NAME)
+        self._journal_entries = 0
+        self.state = self._load_state()
+        self._recover()
+
+    def _load_state(self) -> dict:
+        if os.path.exists(self._state_path):
+            try:
+                with open(self._state_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                logger.warning("Bundle state %s is unreadable, starting a new one", self._state_path)
+        return {"bundles": [], "keys": {}}
+
+    def _recover(self):
+        """
+        重放日志中已完成的条目，撤销上次崩溃时追加了一半（或追加完但未记录）的条目，
+        然后把结果合并回状态文件。
+        """
+        pending = self.state.pop("pending", None)
+        for record in self._read_journal():
+            if "pending" in record:
+                pending = record["pending"]
+            else:
+                self._apply(record["add"])
+                pending = None
+        if pending is not None:
+            path = os.path.join(self.directory, pending["bundle"])
+            if os.path.exists(path) and os.path.getsize(path) > pending["offset"]:
+                logger.warning("Truncating %s to %d bytes to undo an unrecorded entry", path, pending["offset"])
+                with open(path, 'r+b') as f:
+                    f.truncate(pending["offset"])
+        self._compact()
+
+    def _read_journal(self) -> Iterable[dict]:
+        if not os.path.exists(self._journal_path):
+            return
+        with open(self._journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 写到一半的最后一行：对应的追加没有完成
+                    logger.warning("Skipping a truncated record in %s", self._journal_path)
+                    return
+
+    def _apply(self, entry: dict):
+        """把一条已完成的追加计入状态；重放时状态文件可能已包含它，按去重键跳过"""
+        if entry["key"] in self.state["keys"]:
+            return
+        bundles = self.state["bundles"]
+        if not bundles or bundles[-1]["name"] != entry["bundle"]:
+            bundles.append({"name": entry["bundle"], "bytes": 0, "words": 0, "entries": 0})
+        bundle = bundles[-1]
+        bundle["bytes"] += entry["bytes"]
+        bundle["words"] += entry["words"]
+        bundle["entries"] += 1
+        self.state["keys"][entry["key"]] = entry["bundle"]
+
+    def _log(self, record: dict):
+        with open(self._journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self):
+        """整体写出状态文件后清空日志；两步之间崩溃时，重放会按去重键跳过已合并的条目"""
+        self._save_state()
+        if os.path.exists(self._journal_path):
+            os.remove(self._journal_path)
+        self._journal_entries = 0
+
+    def _save_state(self):
+        tmp_path = f"{self._state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._state_path)
+
+    def _fits(self, bundle: dict, size: int, words: int) -> bool:
+        return bundle["bytes"] + size <= self.max_bytes and bundle["words"] + words <= self.max_words
+
+    def _next_name(self) -> str:
+        return f"{self.prefix}_{len(self.state['bundles']) + 1:04d}.txt"
+
+    def add_entry(self, key: str, title: str, content: str, url: str = '', meta: str = '') -> Optional[str]:
+        """
+        追加一条记录。
+        :param key: 去重键（见 content_key），已收录时直接跳过
+        :return: 写入的合集路径，已收录时返回 None
+        """
+        text = format_entry(title, url, meta, content)
+        data = text.encode('utf-8')
+        return self._add(key, title, len(data), count_words(text), lambda f: f.write(data))
+
+    def add_content(self, title: str, content: str, url: str = '', meta: str = '') -> Optional[str]:
+        """追加一条记录，以正文摘要为去重键"""
+        return self.add_entry(content_key(content.rstrip().encode('utf-8')), title, content, url, meta)
+
+    def _add(self, key: str, title: str, size: int, words: int, write: Callable) -> Optional[str]:
+        """选定合集并调用 write(f) 追加 size 字节的条目"""
+        with self._lock:
+            if key in self.state["keys"]:
+                return None
+            bundles = self.state["bundles"]
+            bundle = bundles[-1] if bundles else None
+            if bundle is None or (bundle["entries"] and not self._fits(bundle, size, words)):
+                # 新合集在条目记录到日志后才由 _apply 加入状态
+                bundle = {"name": self._next_name(), "bytes": 0, "words": 0, "entries": 0}
+            name = bundle["name"]
+            if not self._fits(bundle, size, words):
+                logger.warning("Entry '%s' exceeds the bundle budget on its own", title)
+            path = os.path.join(self.directory, name)
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            # 先记录意图再追加，日志与合集内容不一致时由 _recover 截断
+            self._log({"pending": {"bundle": name, "offset": offset}})
+            with open(path, 'ab') as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            entry = {"key": key, "bundle": name, "bytes": size, "words": words}
+            self._log({"add": entry})
+            self._apply(entry)
+            self._journal_entries += 1
+            if self._journal_entries >= JOURNAL_COMPACT_ENTRIES:
+                self._compact()
+            return path
+
+    def add(self, item: BilibiliHistoryItem, content: str) -> Optional[str]:
+        """收录一条 B 站字幕，保留标题、链接和 UP 主等信息作为条目头"""
+        meta = f"UP主: {item.owner_name}  发布: {item.pubdate_str}  观看: {item.view_at_str}"
+        return self.add_content(item.title, content, url=item.redirect_link or item.short_link, meta=meta)
+
+    def add_file(self, path: str) -> Optional[str]:
+        """
+        收录一个已写出的 .txt 字幕文件，文件名作为标题。
+        通过 mmap 分块计数和拷贝，长文字稿不会整体读进内存；写出的内容与 add_entry 相同。
+        """
+        title = os.path.splitext(os.path.basename(path))[0]
+        header = format_header(title).encode('utf-8')
+        with mapped_file(path) as buffer:
+            end = _rstripped_size(buffer)
+            key = content_key(buffer, end)
+            if key in self.state["keys"]:
+                return None
+            words = count_words(format_header(title)) + count_words_chunks(iter_decoded(buffer, end))
+
+            def write(f):
+                f.write(header)
+                for offset in range(0, end, CHUNK_SIZE):
+                    f.write(buffer[offset:min(offset + CHUNK_SIZE, end)])
+                f.write(b"\n\n")
+
+            return self._add(key, title, len(header) + end + 2, words, write)
+
+
+_bundler: Optional[SourceBundler] = None
+_bundler_lock = threading.Lock()
+
+
+def get_bundler() -> SourceBundler:
+    global _bundler
+    if _bundler is None:
+        with _bundler_lock:
+            if _bundler is None:
+                _bundler = SourceBundler()
+    return _bundler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="把目录中的 .txt 字幕打包为 NotebookLM 来源文档")
+    parser.add_argument("directories", nargs="+", help="存放 .txt 字幕的目录")
+    args = parser.parse_args()
+
+    bundler = get_bundler()
+    for directory in args.directories:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.txt'):
+                bundler.add_file(os.path.join(directory, name))
+    print(f"共 {len(bundler.state['bundles'])} 个合集，收录 {len(bundler.state['keys'])} 条。")
@@ -0,0 +1,215 @@
+import atexit
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from config import (WHISPER_MODEL, WHISPER_IDLE_TIMEOUT, CHUNK_SECONDS, CHUNK_OVERLAP_SECONDS,
+                    CHUNK_SEARCH_SECONDS, CHUNK_WORKERS)
+from logger_setup import logger
+from text_stream import atomic_open
+import whisper_models
+
+# whisper.load_audio 输出的采样率
+SAMPLE_RATE = 16000
+# 能量检测的帧长与平滑窗口（秒）
+FRAME_SECONDS = 0.03
+SMOOTH_SECONDS = 0.5
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+
+def frame_energy(audio: np.ndarray, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """按帧计算 RMS 能量，并做滑动平均，得到平滑后的能量曲线"""
+    frame = int(sr * FRAME_SECONDS)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    window = max(1, int(SMOOTH_SECONDS / FRAME_SECONDS))
+    return np.convolve(rms, np.ones(window) / window, mode='same')
+
+
+def find_split_points(audio: np.ndarray, sr: int = SAMPLE_RATE, chunk_seconds: float = CHUNK_SECONDS,
+                      search_seconds: float = CHUNK_SEARCH_SECONDS) -> List[int]:
+    """
+    基于能量的简单 VAD：在每个目标切分点前后 search_seconds 范围内，选择能量最低（最安静）的位置切分，
+    尽量避免把一句话切成两半。
+    :return: 切分点（采样点下标），包含开头 0 和结尾 len(audio)
+    """
+    energy = frame_energy(audio, sr)
+    frame = int(sr * FRAME_SECONDS)
+    points = [0]
+    target = chunk_seconds
+    total_seconds = len(audio) / sr
+    while target < total_seconds - search_seconds:
+        lo = max(int((target - search_seconds) / FRAME_SECONDS), 0)
+        hi = min(int((target + search_seconds) / FRAME_SECONDS), len(energy))
+        quietest = lo + int(np.argmin(energy[lo:hi])) if hi > lo else int(target / FRAME_SECONDS)
+        point = quietest * frame
+        if point > points[-1]:
+            points.append(point)
+        target = point / sr + chunk_seconds
+    points.append(len(audio))
+    return points
+
+
+def plan_chunks(points: List[int], n_samples: int, sr: int = SAMPLE_RATE,
+                overlap_seconds: float = CHUNK_OVERLAP_SECONDS) -> List[Tuple[int, int, int, int]]:
+    """
+    :return: [(读取起点, 读取终点, 有效区间起点, 有效区间终点)]，读取区间在有效区间两侧各多出 overlap
+    """
+    overlap = int(overlap_seconds * sr)
+    return [(max(0, start - overlap), min(n_samples, end + overlap), start, end)
+            for start, end in zip(points, points[1:])]
+
+
+def _init_chunk_worker(model_name: str, threads: int):
+    """分块转写进程的 initializer：限制每个进程的 torch 线程数，并预加载模型"""
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    whisper_models.init_worker((model_name,), WHISPER_IDLE_TIMEOUT)
+
+
+def _transcribe_chunk(samples: np.ndarray, model_name: str, language: Optional[str]) -> dict:
+    model = whisper_models.get_model(model_name)
+    return model.transcribe(samples, language=language)
+
+
+def _detect_language(samples: np.ndarray, model_name: str) -> str:
+    import whisper
+
+    model = whisper_models.get_model(model_name)
+    # large-v3 使用 128 个 mel 频带，必须与模型一致
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(samples), n_mels=model.dims.n_mels).to(model.device)
+    _, probs = model.detect_language(mel)
+    return max(probs, key=probs.get)
+
+
+def _get_pool(workers: int, model_name: str) -> ProcessPoolExecutor:
+    """同一进程内复用分块转写的进程池，避免每个文件都重新加载模型"""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        shutdown_pool()
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        _pool = ProcessPoolExecutor(workers, initializer=_init_chunk_worker, initargs=(model_name, threads))
+        _pool_workers = workers
+    return _pool
+
+
+@atexit.register
+def shutdown_pool():
+    """关闭分块转写的进程池（及其中加载的模型），进程退出时也会自动调用"""
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool, _pool_workers = None, 0
+
+
+def checkpoint_dir(audio_path: str) -> str:
+    """分块转写结果的检查点目录，与音频同名"""
+    return os.path.splitext(audio_path)[0] + '.chunks'
+
+
+def _load_checkpoint(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_checkpoint(path: str, value):
+    # whisper 结果中可能有 numpy 标量
+    with atomic_open(path, 'w', encoding='utf-8') as f:
+        json.dump(value, f, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, 'item') else str(o))
+
+
+def clear_checkpoints(audio_path: str):
+    """整份字幕写出并记录检查点后调用，删除分块结果"""
+    shutil.rmtree(checkpoint_dir(audio_path), ignore_errors=True)
+
+
+def stitch(chunks: List[Tuple[int, int, int, int]], results: List[dict], sr: int = SAMPLE_RATE) -> dict:
+    """
+    合并各块的转写结果：时间戳加上块的起始偏移，
+    重叠部分只保留中点落在本块有效区间内的片段，避免重复。
+    """
+    segments = []
+    for (read_start, _, valid_start, valid_end), result in zip(chunks, results):
+        offset = read_start / sr
+        for segment in result.get('segments', []):
+            start, end = segment['start'] + offset, segment['end'] + offset
+            middle = (start + end) / 2
+            if not valid_start / sr <= middle < valid_end / sr:
+                continue
+            segments.append({**segment, 'id': len(segments), 'start': start, 'end': end})
+    language = next((r.get('language') for r in results if r.get('language')), None)
+    text = "".join(segment['text'] for segment in segments)
+    return {'text': text, 'segments': segments, 'language': language}
+
+
+def transcribe_chunked(audio_path: str, model_name: str = WHISPER_MODEL, workers: int = CHUNK_WORKERS,
+                       language: Optional[str] = None,
+                       progress: Optional[Callable[[int, int], None]] = None) -> dict:
+    """
+    把长音频在静音处切成带重叠的块，用进程池并行转写后再拼接。
+    返回值与 model.transcribe 相同（text / segments / language），可直接交给 convert_to_srt。
+    :param workers: 进程池大小；为 1 时在当前进程内逐块转写，不再创建嵌套的进程池
+        （调度器的转写 worker 已经按任务并行，应传 1）
+    :param progress: 每完成一块调用 progress(已完成块数, 总块数)
+    """
+    import whisper
+
+    audio = whisper.load_audio(audio_path)
+    chunks = plan_chunks(find_split_points(audio), len(audio))
+    logger.info("Transcribing %s in %d chunks with %d workers", audio_path, len(chunks), workers)
+    # 每块转写完成即写入检查点，进程崩溃重启后只转写尚未完成的块
+    checkpoints = checkpoint_dir(audio_path)
+    os.makedirs(checkpoints, exist_ok=True)
+
+    pool = _get_pool(workers, model_name) if workers > 1 else None
+    if language is None:
+        language_path = os.path.join(checkpoints, f"language-{model_name}.json")
+        language = _load_checkpoint(language_path)
+        if language is None:
+            # 先统一检测语言，避免各块各自识别出不同语言
+            head = audio[:30 * SAMPLE_RATE]
+            language = (pool.submit(_detect_language, head, model_name).result() if pool
+                        else _detect_language(head, model_name))
+            _save_checkpoint(language_path, language)
+        logger.info("Detected language: %s", language)
+
+    def chunk_path(start, end):
+        return os.path.join(checkpoints, f"{model_name}-{language}-{start}-{end}.json")
+
+    results: List[Optional[dict]] = [_load_checkpoint(chunk_path(start, end)) for start, end, _, _ in chunks]
+    done = sum(1 for result in results if result is not None)
+    if done:
+        logger.info("Resuming %s: %d/%d chunks already transcribed", audio_path, done, len(chunks))
+    pending = [i for i in range(len(chunks)) if results[i] is None]
+    if pool:
+        futures = {pool.submit(_transcribe_chunk, audio[chunks[i][0]:chunks[i][1]], model_name, language): i
+                   for i in pending}
+        finished = ((futures[future], future.result()) for future in as_completed(futures))
+    else:
+        finished = ((i, _transcribe_chunk(audio[chunks[i][0]:chunks[i][1]], model_name, language)) for i in pending)
+    for i, result in finished:
+        results[i] = result
+        _save_checkpoint(chunk_path(*chunks[i][:2]), result)
+        done += 1
+        logger.info("Chunk %d/%d transcribed (%d/%d done)", i + 1, len(chunks), done, len(chunks))
+        if progress:
+            progress(done, len(chunks))
+    return stitch(chunks, results)
@@ -0,0 +1,228 @@
+"""
+NotebookLMHelper 统一命令行入口。
+各子命令只在执行时导入自己需要的模块：定时同步 B 站历史不会加载 whisper / torch / yt-dlp / Google 客户端。
+
+用法:
+    python cli.py harvest --async --bundle
+    python cli.py download https://www.youtube.com/watch?v=... --until-idle
+    python cli.py transcribe lecture.mp3
+    python cli.py stage --list clippings.txt --dest ~/notebooklm
+    python cli.py upload --list files.txt --folder-id <id>
+    python cli.py listening-stats
+    python cli.py index ~/notebooklm --tasks
+    python cli.py search "注意力机制" --kind srt
+加 --timing 可在 stderr 输出启动耗时，配合 python -X importtime 定位慢导入。
+"""
+import argparse
+import os
+import sys
+import time
+
+_STARTED = time.perf_counter()
+
+
+def _ready(args, command: str):
+    """子命令完成导入、即将开始工作时调用，记录启动耗时"""
+    elapsed = (time.perf_counter() - _STARTED) * 1000
+    from logger_setup import logger
+
+    logger.debug("%s ready in %.1f ms", command, elapsed)
+    if args.timing:
+        print(f"[timing] {command} ready in {elapsed:.1f} ms", file=sys.stderr)
+
+
+def cmd_harvest(args):
+    import main
+
+    _ready(args, "harvest")
+    main.run_harvest_command(args)
+
+
+def cmd_download(args):
+    import youtube_downloader
+
+    _ready(args, "download")
+    urls = list(args.urls)
+    if args.file:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            urls.extend(line.strip() for line in f if line.strip())
+    conn = youtube_downloader.init_db()
+    try:
+        if urls:
+            count = youtube_downloader.create_tasks(conn, urls)
+            print(f"任务创建成功，共 {count} 个")
+    finally:
+        conn.close()
+    youtube_downloader.task_scheduler(stop_when_idle=args.until_idle,
+                                      keep_video=args.keep_video or youtube_downloader.YOUTUBE_KEEP_VIDEO)
+
+
+def cmd_transcribe(args):
+    import youtube_downloader
+
+    _ready(args, "transcribe")
+    # 单独转写时没有调度器按任务并行，长音频用分块进程池并行转写
+    for audio_path in args.audio:
+        result = youtube_downloader.transcribe_audio(audio_path, model_name=args.model,
+                                                     chunk_workers=args.chunk_workers)
+        print(youtube_downloader.write_srt(result, audio_path))
+
+
+def cmd_stage(args):
+    import filepath_to_folder
+
+    _ready(args, "stage")
+    file_list = filepath_to_folder.read_file_list(args.list, args.prefix)
+    filepath_to_folder.copy_files(file_list, args.dest, incremental=not args.full, workers=args.workers,
+                                  link_mode=args.link_mode)
+
+
+def cmd_upload(args):
+    import upload_gdrive
+
+    _ready(args, "upload")
+    if args.files:
+        upload_gdrive.upload_files(args.files, args.folder_id, workers=args.workers)
+    else:
+        upload_gdrive.upload_files_from_txt(args.list, args.folder_id, workers=args.workers)
+
+
+def cmd_listening_stats(args):
+    import audiobookshelf
+
+    _ready(args, "listening-stats")
+    if args.today:
+        for item in audiobookshelf.items_listened_today():
+            print(f"{item['display_title']} - {item['display_author']}  {item['time_listening'] or 0:.0f} 秒")
+    else:
+        audiobookshelf.get_recently_played(limit=args.limit)
+
+
+def cmd_index(args):
+    import search_index
+
+    _ready(args, "index")
+    index = search_index.get_index()
+    count = sum(index.index_directory(directory, force=args.force) for directory in args.directories)
+    if args.tasks:
+        import task_store
+
+        conn = task_store.connect()
+        try:
+            count += index.index_tasks(conn)
+        finally:
+            conn.close()
+    print(f"收录 {count} 篇")
+
+
+def cmd_search(args):
+    import search_index
+
+    _ready(args, "search")
+    hits = search_index.get_index().search(" ".join(args.query), limit=args.limit, kind=args.kind,
+                                           source=args.source, per_document=args.per_document)
+    for hit in hits:
+        at = f" @ {hit['start']:.0f}s" if hit['start'] is not None else ""
+        print(f"{hit['title'] or hit['doc_id']}{at}  [{hit['kind']}]")
+        print(f"   {hit['snippet']}")
+        if hit['link'] or hit['path']:
+            print(f"   {hit['link'] or hit['path']}")
+    if not hits:
+        print("没有找到匹配的内容。")
+
+
+def add_harvest_arguments(parser):
+    """harvest 的命令行参数，cli.py 与 main.py 共用；定义在这里是因为本文件只导入标准库"""
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用异步并发流水线")
+    parser.add_argument("--pages", type=int, default=None, help="最多拉取的历史记录页数，默认不限")
+    parser.add_argument("--full", action="store_true", help="忽略同步游标，重新遍历全部历史记录")
+    parser.add_argument("--bundle", action="store_true", help="同时把字幕打包进 NotebookLM 合集文档")
+    parser.add_argument("--no-dedup", action="store_true", help="不做近似重复检测")
+    parser.add_argument("--no-search", action="store_true", help="不收录到全文索引")
+    parser.add_argument("--history-concurrency", type=int, default=None, help="历史记录阶段并发数")
+    parser.add_argument("--lookup-concurrency", type=int, default=None, help="字幕地址查询阶段并发数")
+    parser.add_argument("--download-concurrency", type=int, default=None, help="字幕下载阶段并发数")
+    parser.add_argument("--metrics", action="store_true", help="记录各阶段指标，结束时导出 Prometheus 文件和运行报告")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    # 这里只能使用标准库：子命令的默认值写死在此处，而不是从 config 或各模块中读取
+    parser = argparse.ArgumentParser(description="NotebookLMHelper 命令行工具")
+    parser.add_argument("--log-level", help="日志级别，覆盖 LOG_LEVEL")
+    parser.add_argument("--log-format", choices=("text", "json"), help="日志格式，覆盖 LOG_FORMAT")
+    parser.add_argument("--timing", action="store_true", help="在 stderr 输出启动耗时")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    harvest = subparsers.add_parser("harvest", help="抓取 B 站观看历史的字幕")
+    add_harvest_arguments(harvest)
+    harvest.set_defaults(func=cmd_harvest)
+
+    download = subparsers.add_parser("download", help="创建 YouTube 下载任务并运行调度器")
+    download.add_argument("urls", nargs="*", help="YouTube 视频链接")
+    download.add_argument("--file", help="每行一个链接的 txt 文件")
+    download.add_argument("--until-idle", action="store_true", help="所有任务处理完后退出")
+    download.add_argument("--keep-video", action="store_true", help="下载并保留完整视频，默认只获取音频")
+    download.set_defaults(func=cmd_download)
+
+    transcribe = subparsers.add_parser("transcribe", help="用 whisper 转写本地音频，输出同名 .srt")
+    transcribe.add_argument("audio", nargs="+", help="音频文件")
+    transcribe.add_argument("--model", default=os.environ.get("WHISPER_MODEL", "base"), help="whisper 模型")
+    transcribe.add_argument("--chunk-workers", type=int,
+                            default=int(os.environ.get("CHUNK_WORKERS", max(1, (os.cpu_count() or 2) // 2))),
+                            help="长音频分块并行转写的进程数，为 1 时逐块转写")
+    transcribe.set_defaults(func=cmd_transcribe)
+
+    stage = subparsers.add_parser("stage", help="把剪藏清单中的笔记拷贝到 NotebookLM 目录")
+    stage.add_argument("--prefix", default='', help="清单中相对路径的前缀")
+    stage.add_argument("--list", required=True, help="文件路径列表")
+    stage.add_argument("--dest", required=True, help="目标目录")
+    stage.add_argument("--full", action="store_true", help="忽略清单，全部重新拷贝")
+    stage.add_argument("--workers", type=int, default=8)
+    stage.add_argument("--link-mode", choices=('copy', 'hardlink', 'reflink'), default='copy')
+    stage.set_defaults(func=cmd_stage)
+
+    upload = subparsers.add_parser("upload", help="批量上传文件到 Google Drive")
+    upload.add_argument("files", nargs="*", help="要上传的文件，不指定时读取 --list")
+    upload.add_argument("--list", default='files.txt', help="存放文件路径的txt文件")
+    upload.add_argument("--folder-id", required=True, help="Google Drive目标文件夹的ID")
+    upload.add_argument("--workers", type=int, default=int(os.environ.get("UPLOAD_WORKERS", "4")))
+    upload.set_defaults(func=cmd_upload)
+
+    listening = subparsers.add_parser("listening-stats", help="增量同步并查看 Audiobookshelf 收听记录")
+    listening.add_argument("--today", action="store_true", help="只列出今天听过的条目")
+    listening.add_argument("--limit", type=int, default=10, help="最近收听记录的条数")
+    listening.set_defaults(func=cmd_listening_stats)
+
+    index = subparsers.add_parser("index", help="把已有的字幕、转写稿和摘要收录到全文索引")
+    index.add_argument("directories", nargs="*", help="递归收录其中的 .txt / .srt 文件")
+    index.add_argument("--tasks", action="store_true", help="同时收录 YouTube 下载任务的字幕和摘要")
+    index.add_argument("--force", action="store_true", help="未修改的文件也重新收录")
+    index.set_defaults(func=cmd_index)
+
+    search = subparsers.add_parser("search", help="全文检索已收录的字幕、转写稿和摘要")
+    search.add_argument("query", nargs="+", help="关键词，多个词须同时出现")
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--kind", choices=("transcript", "srt", "summary"), help="只检索某一类文本")
+    search.add_argument("--source", choices=("bilibili", "youtube"), help="只检索某一来源")
+    search.add_argument("--per-document", action="store_true", help="每篇只显示最相关的片段")
+    search.set_defaults(func=cmd_search)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # logger_setup 在首次导入时读取这些环境变量，必须在导入任何业务模块之前设置
+    if args.log_level:
+        os.environ["LOG_LEVEL"] = args.log_level
+    if args.log_format:
+        os.environ["LOG_FORMAT"] = args.log_format
+    try:
+        args.func(args)
+    finally:
+        metrics = sys.modules.get("metrics")
+        if metrics is not None:
+            metrics.metrics.export()
+
+
+if __name__ == "__main__":
+    main()
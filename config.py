@@ -1,4 +1,5 @@
 import os
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,5 +17,128 @@ COOKIES = {
     "SESSDATA": BILIBILI_SESSDATA
 }
 
+# B 站 API 地址，基准测试时可指向本地模拟服务
+BILIBILI_API_BASE = os.environ.get("BILIBILI_API_BASE", "https://api.bilibili.com").rstrip("/")
+
 
 AUDIOBOOKSHELF_TOKEN = os.environ.get("AUDIOBOOKSHELF_TOKEN", "")
+AUDIOBOOKSHELF_URL = os.environ.get("AUDIOBOOKSHELF_URL", "http://192.168.1.13:7331").rstrip("/")
+# Audiobookshelf 收听记录的本地库与分页大小
+AUDIOBOOKSHELF_DB_PATH = os.environ.get("AUDIOBOOKSHELF_DB_PATH", "audiobookshelf.db")
+AUDIOBOOKSHELF_PAGE_SIZE = int(os.environ.get("AUDIOBOOKSHELF_PAGE_SIZE", "50"))
+
+# NotebookLM 资料根目录，字幕按日期写入其子目录
+NOTEBOOKLM_DIR = os.environ.get("NOTEBOOKLM_DIR", "/Users/lynn/Documents/notebooklm")
+
+# HTTP 客户端：连接池、超时与传输层重试
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))
+HTTP_TIMEOUT = (float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5")),
+                float(os.environ.get("HTTP_READ_TIMEOUT", "30")))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.5"))
+
+# 按 host 的令牌桶限流：{host: (每秒请求数, 突发容量)}，未列出的 host（如字幕 CDN）不限速
+RATE_LIMITS = {
+    urlsplit(BILIBILI_API_BASE).hostname: (float(os.environ.get("BILIBILI_API_RATE", "2")),
+                         int(os.environ.get("BILIBILI_API_BURST", "2"))),
+}
+# 遇到 412/429 时最多重试次数
+RATE_LIMIT_RETRIES = int(os.environ.get("RATE_LIMIT_RETRIES", "2"))
+
+# 异步抓取流水线：各阶段并发度与阶段间队列长度
+ASYNC_HISTORY_CONCURRENCY = int(os.environ.get("ASYNC_HISTORY_CONCURRENCY", "2"))
+ASYNC_LOOKUP_CONCURRENCY = int(os.environ.get("ASYNC_LOOKUP_CONCURRENCY", "4"))
+ASYNC_DOWNLOAD_CONCURRENCY = int(os.environ.get("ASYNC_DOWNLOAD_CONCURRENCY", "16"))
+ASYNC_QUEUE_SIZE = int(os.environ.get("ASYNC_QUEUE_SIZE", "100"))
+
+# 增量同步游标（如 B 站历史记录的 view_at 高水位）的存储文件
+SYNC_STATE_PATH = os.environ.get("SYNC_STATE_PATH", "sync_state.json")
+
+# 字幕本地缓存：TTL（秒）与容量上限
+SUBTITLE_CACHE_ENABLED = os.environ.get("SUBTITLE_CACHE_ENABLED", "1") == "1"
+SUBTITLE_CACHE_PATH = os.environ.get("SUBTITLE_CACHE_PATH", "subtitle_cache.db")
+SUBTITLE_URL_TTL = float(os.environ.get("SUBTITLE_URL_TTL", str(7 * 24 * 3600)))
+SUBTITLE_NEGATIVE_TTL = float(os.environ.get("SUBTITLE_NEGATIVE_TTL", str(24 * 3600)))
+SUBTITLE_BODY_TTL = float(os.environ.get("SUBTITLE_BODY_TTL", str(90 * 24 * 3600)))
+SUBTITLE_CACHE_MAX_BYTES = int(os.environ.get("SUBTITLE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+SUBTITLE_CACHE_MAX_URLS = int(os.environ.get("SUBTITLE_CACHE_MAX_URLS", "100000"))
+
+# YouTube 下载任务库与各阶段 worker 数
+YOUTUBE_DB_PATH = os.environ.get("YOUTUBE_DB_PATH", "youtube_tasks.db")
+# YouTube 下载：默认只取音频流并直接转成 whisper 使用的 16kHz 单声道 PCM；保留视频需显式开启
+YOUTUBE_DOWNLOAD_DIR = os.environ.get("YOUTUBE_DOWNLOAD_DIR", "./downloads")
+YOUTUBE_KEEP_VIDEO = os.environ.get("YOUTUBE_KEEP_VIDEO", "0") == "1"
+# 音频模式的 yt-dlp 格式选择：配合按码率升序排序，取码率不低于 48kbps 的最小音频流
+YTDLP_AUDIO_FORMAT = os.environ.get("YTDLP_AUDIO_FORMAT", "ba[abr>=48]/ba/b")
+AUDIO_SAMPLE_RATE = int(os.environ.get("AUDIO_SAMPLE_RATE", "16000"))
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "4"))
+FFMPEG_WORKERS = int(os.environ.get("FFMPEG_WORKERS", "2"))
+TRANSCRIBE_WORKERS = int(os.environ.get("TRANSCRIBE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+SUMMARIZE_WORKERS = int(os.environ.get("SUMMARIZE_WORKERS", "4"))
+# 调度器兜底轮询间隔（秒），用于发现其他进程写入的任务
+SCHEDULER_POLL_INTERVAL = float(os.environ.get("SCHEDULER_POLL_INTERVAL", "30"))
+# 任务租约（秒）：认领任务的调度器定期续约，租约过期的任务视为卡住并退回上一阶段
+TASK_LEASE_SECONDS = float(os.environ.get("TASK_LEASE_SECONDS", "600"))
+# 同一任务被回收超过该次数（如每次都让进程崩溃）后标记为失败
+TASK_MAX_RECOVERIES = int(os.environ.get("TASK_MAX_RECOVERIES", "3"))
+
+# whisper 模型：默认模型、调度器启动时是否预加载、空闲多久后释放（秒）
+WHISPER_MODEL = os.environ.get("WHISPER_MODEL", "base")
+WHISPER_PRELOAD = os.environ.get("WHISPER_PRELOAD", "1") == "1"
+WHISPER_IDLE_TIMEOUT = float(os.environ.get("WHISPER_IDLE_TIMEOUT", "600"))
+
+# 长音频分块并行转写：超过该时长（秒）的音频启用分块
+CHUNKED_TRANSCRIBE_MIN_SECONDS = float(os.environ.get("CHUNKED_TRANSCRIBE_MIN_SECONDS", "900"))
+CHUNK_SECONDS = float(os.environ.get("CHUNK_SECONDS", "300"))
+CHUNK_OVERLAP_SECONDS = float(os.environ.get("CHUNK_OVERLAP_SECONDS", "2"))
+CHUNK_SEARCH_SECONDS = float(os.environ.get("CHUNK_SEARCH_SECONDS", "15"))
+CHUNK_WORKERS = int(os.environ.get("CHUNK_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+# 摘要：OpenAI 兼容接口（OPENAI_BASE_URL 可指向本地桩服务）、每块 token 上限与并发数
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY") or None
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gpt-4")
+SUMMARY_CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", "3000"))
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_CACHE_PATH = os.environ.get("SUMMARY_CACHE_PATH", "summary_cache.db")
+
+# Google Drive 上传：并发数、超过该大小（字节）使用可续传上传、上传日志路径
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "4"))
+UPLOAD_RESUMABLE_THRESHOLD = int(os.environ.get("UPLOAD_RESUMABLE_THRESHOLD", str(5 * 1024 * 1024)))
+UPLOAD_JOURNAL_PATH = os.environ.get("UPLOAD_JOURNAL_PATH", "upload_journal.jsonl")
+
+# NotebookLM 合集：输出目录与单个合集的字节数 / 词数上限
+BUNDLE_DIR = os.environ.get("BUNDLE_DIR", os.path.join(NOTEBOOKLM_DIR, "bundles"))
+BUNDLE_MAX_BYTES = int(os.environ.get("BUNDLE_MAX_BYTES", str(50 * 1024 * 1024)))
+BUNDLE_MAX_WORDS = int(os.environ.get("BUNDLE_MAX_WORDS", "400000"))
+
+# 近似重复检测：索引路径、MinHash 相似度阈值与字符 shingle 长度
+DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED", "1") == "1"
+DEDUP_INDEX_PATH = os.environ.get("DEDUP_INDEX_PATH", "dedup_index.db")
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.85"))
+DEDUP_SHINGLE_SIZE = int(os.environ.get("DEDUP_SHINGLE_SIZE", "5"))
+
+# 指标与追踪：默认关闭；开启后运行结束时导出 Prometheus 文本文件和 JSON 运行报告
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+METRICS_PROM_PATH = os.environ.get("METRICS_PROM_PATH", "metrics.prom")
+METRICS_REPORT_PATH = os.environ.get("METRICS_REPORT_PATH", "run_report.json")
+# 大于 0 时在该端口提供 /metrics 抓取端点
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# 运行报告中保留的最近 span 数
+METRICS_MAX_SPANS = int(os.environ.get("METRICS_MAX_SPANS", "10000"))
+
+# 日志：级别、输出格式（text 或 json）、可选的日志文件，以及 DEBUG 下响应体的截断长度与采样率
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_FILE = os.environ.get("LOG_FILE") or None
+LOG_BODY_MAX_CHARS = int(os.environ.get("LOG_BODY_MAX_CHARS", "500"))
+LOG_BODY_SAMPLE_RATE = float(os.environ.get("LOG_BODY_SAMPLE_RATE", "1.0"))
+
+# 全文检索：转写稿、SRT 字幕和摘要写出时增量收录到 SQLite FTS5 索引
+SEARCH_ENABLED = os.environ.get("SEARCH_ENABLED", "1") == "1"
+SEARCH_INDEX_PATH = os.environ.get("SEARCH_INDEX_PATH", "search_index.db")
+# trigram 分词（SQLite 3.34+）支持中文子串检索；旧版 SQLite 可改为 unicode61
+SEARCH_TOKENIZER = os.environ.get("SEARCH_TOKENIZER", "trigram")
+# 没有时间轴的纯文本按该字符数切成段落收录
+SEARCH_PASSAGE_CHARS = int(os.environ.get("SEARCH_PASSAGE_CHARS", "500"))
@@ -0,0 +1,219 @@
+import hashlib
+import re
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config import DEDUP_INDEX_PATH, DEDUP_THRESHOLD, DEDUP_SHINGLE_SIZE
+
+try:
+    import numpy as np
+except ImportError:  # 没有 numpy 时退回纯 Python 计算，结果相同，只是慢一些
+    np = None
+
+# MinHash 参数：NUM_PERM = BANDS * ROWS；16 x 8 时相似度约 0.7 以上的文本大概率落入同一个桶
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# 梅森素数 2^61 - 1，作为哈希置换的模数；a < 2^31、分片哈希 < 2^32，保证 a * h + b 不超出 uint64
+_PRIME = (1 << 61) - 1
+_MAX_A = (1 << 31) - 1
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+# 每批计算的分片数，限制 numpy 中间矩阵（NUM_PERM x 批大小）的内存
+HASH_BATCH = 8192
+
+
+def _permutations():
+    """固定种子生成的 (a, b) 置换参数，保证不同进程、不同运行之间签名一致"""
+    params, counter = [], 0
+    while len(params) < NUM_PERM:
+        digest = hashlib.blake2b(f"minhash-{counter}".encode(), digest_size=16).digest()
+        a, b = struct.unpack('<QQ', digest)
+        params.append((a % _MAX_A + 1, b % _PRIME))
+        counter += 1
+    return params
+
+
+_PERMS = _permutations()
+
+
+def shingles(text: str, k: int = DEDUP_SHINGLE_SIZE) -> set:
+    """去掉空白和标点后取字符 k-gram，对中文和英文都适用"""
+    normalized = _NON_WORD.sub('', text.lower())
+    if len(normalized) <= k:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + k] for i in range(len(normalized) - k + 1)}
+
+
+def iter_shingles(chunks: Iterable[str], k: int = DEDUP_SHINGLE_SIZE) -> Iterator[str]:
+    """
+    分块产出字符 k-gram，与 shingles("".join(chunks)) 覆盖相同的分片（可能有重复）。
+    块之间保留末尾 k-1 个字符，跨块的分片不会丢失。
+    """
+    carry, emitted = '', False
+    for chunk in chunks:
+        text = carry + _NON_WORD.sub('', chunk.lower())
+        if len(text) < k:
+            carry = text
+            continue
+        for i in range(len(text) - k + 1):
+            yield text[i:i + k]
+        emitted = True
+        carry = text[len(text) - k + 1:]
+    if not emitted and carry:
+        yield carry
+
+
+def _shingle_hashes(items: Iterable[str]) -> List[int]:
+    return [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in items]
+
+
+def minhash_chunks(chunks: Iterable[str]) -> Optional[array]:
+    """
+    分块计算 MinHash 签名，文本为空时返回 None。
+    每次只对 HASH_BATCH 个分片求哈希和置换，逐批取最小值，内存占用与文本长度无关。
+    """
+    shingle_iter = iter_shingles(chunks)
+    mins = None
+    if np is not None:
+        a = np.array([p[0] for p in _PERMS], dtype=np.uint64)[:, None]
+        b = np.array([p[1] for p in _PERMS], dtype=np.uint64)[:, None]
+    while True:
+        hashes = _shingle_hashes(islice(shingle_iter, HASH_BATCH))
+        if not hashes:
+            break
+        if np is not None:
+            values = np.array(hashes, dtype=np.uint64)
+            batch = ((a * values + b) % np.uint64(_PRIME)).min(axis=1)
+            mins = batch if mins is None else np.minimum(mins, batch)
+        else:
+            batch = [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+            mins = batch if mins is None else [min(x, y) for x, y in zip(mins, batch)]
+    if mins is None:
+        return None
+    return array('Q', mins.tolist() if np is not None else mins)
+
+
+def minhash(text: str) -> Optional[array]:
+    """计算文本的 MinHash 签名，文本为空时返回 None"""
+    return minhash_chunks([text])
+
+
+def similarity(sig1: array, sig2: array) -> float:
+    """两个签名相同位置相等的比例，即 Jaccard 相似度的估计值"""
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / NUM_PERM
+
+
+def _band_keys(signature: array) -> List[Tuple[int, int]]:
+    keys = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS].tobytes()
+        keys.append((band, int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), 'little', signed=True)))
+    return keys
+
+
+class DedupIndex:
+    """
+    持久化的 MinHash/LSH 近似重复索引。
+    每篇文本的签名分成 BANDS 段，每段哈希到一个桶；查询只比较至少共享一个桶的候选，
+    不需要与全部历史文本逐一比较。
+    """
+
+    def __init__(self, path: str = DEDUP_INDEX_PATH, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        # 可重入：_query_signature 在 check_and_add 持锁期间再次加锁
+        self._lock = threading.RLock()
+        # check_and_add 已通过查重、正在 store 的签名 {doc_id: (title, 签名)}；查重时与已收录的文本一起比较
+        self._reserved: Dict[str, Tuple[str, array]] = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS documents
+                (doc_id TEXT PRIMARY KEY, title TEXT, signature BLOB, created_at REAL);
+            CREATE TABLE IF NOT EXISTS lsh_buckets
+                (band INTEGER, bucket INTEGER, doc_id TEXT);
+            CREATE INDEX IF NOT EXISTS idx_lsh_buckets ON lsh_buckets (band, bucket);
+        ''')
+        self.conn.commit()
+
+    def _candidates(self, signature: array) -> List[Tuple[str, str, array]]:
+        keys = _band_keys(signature)
+        where = " OR ".join(["(band = ? AND bucket = ?)"] * len(keys))
+        params = [value for key in keys for value in key]
+        rows = self.conn.execute(
+            f"SELECT doc_id, title, signature FROM documents WHERE doc_id IN "
+            f"(SELECT doc_id FROM lsh_buckets WHERE {where})", params).fetchall()
+        return [(doc_id, title, array('Q', blob)) for doc_id, title, blob in rows]
+
+    def query(self, text: str, threshold: Optional[float] = None) -> List[Tuple[str, str, float]]:
+        """:return: 相似度不低于阈值的已收录文本 [(doc_id, title, 相似度)]，按相似度降序"""
+        signature = minhash(text)
+        if signature is None:
+            return []
+        return self._query_signature(signature, self.threshold if threshold is None else threshold)
+
+    def _query_signature(self, signature: array, threshold: float) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            candidates = self._candidates(signature)
+        matches = [(doc_id, title, similarity(signature, other)) for doc_id, title, other in candidates]
+        return sorted([m for m in matches if m[2] >= threshold], key=lambda m: m[2], reverse=True)
+
+    def _add_signature(self, doc_id: str, title: str, signature: array) -> bool:
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM documents WHERE doc_id = ?", (doc_id,)).fetchone():
+                return False
+            with self.conn:
+                self.conn.execute("INSERT INTO documents VALUES (?, ?, ?, ?)",
+                                  (doc_id, title, signature.tobytes(), time.time()))
+                self.conn.executemany("INSERT INTO lsh_buckets VALUES (?, ?, ?)",
+                                      [(band, bucket, doc_id) for band, bucket in _band_keys(signature)])
+            return True
+
+    def check_and_add(self, doc_id: str, text: str, title: str = '',
+                      store: Optional[Callable[[], bool]] = None) -> Optional[Tuple[str, str, float]]:
+        """
+        查重并收录：找到近似重复时返回最相似的 (doc_id, title, 相似度) 且不收录；否则收录并返回 None。
+        同一 doc_id 再次出现（如重跑）不视为重复。
+        :param store: 确认不重复后调用（如写文件），返回真值时才收录；写出失败的文本不会被记为已见过，
+            下次仍会写出。查重通过后先在锁内预留签名，store 在锁外执行，完成后再收录或撤销预留：
+            并发的近似重复会与预留的签名比较，不会同时通过，写文件也不会互相等待
+        """
+        signature = minhash(text)
+        if signature is None:
+            if store is not None:
+                store()
+            return None
+        with self._lock:
+            matches = [m for m in self._query_signature(signature, self.threshold) if m[0] != doc_id]
+            matches += [(other_id, other_title, similarity(signature, other))
+                        for other_id, (other_title, other) in self._reserved.items() if other_id != doc_id]
+            matches = [m for m in matches if m[2] >= self.threshold]
+            if matches:
+                return max(matches, key=lambda m: m[2])
+            self._reserved[doc_id] = (title, signature)
+        stored = False
+        try:
+            stored = store is None or store()
+        finally:
+            with self._lock:
+                self._reserved.pop(doc_id, None)
+                if stored:
+                    self._add_signature(doc_id, title, signature)
+        return None
+
+
+_index: Optional[DedupIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> DedupIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DedupIndex()
+    return _index
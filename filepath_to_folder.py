@@ -1,5 +1,19 @@
+import json
 import shutil
 import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from text_stream import hash_file
+
+# 目标目录中记录已拷贝文件状态的清单文件
+MANIFEST_NAME = '.staging_manifest.json'
+# 文件数超过该值时使用线程池并行拷贝
+PARALLEL_THRESHOLD = 16
+# Linux 下 FICLONE ioctl 的请求号，用于 reflink（写时复制）
+FICLONE = 0x40049409
+LINK_MODES = ('copy', 'hardlink', 'reflink')
 
 
 def read_file_list(file_path, path_prefix):
@@ -13,28 +27,152 @@ def read_file_list(file_path, path_prefix):
         return []
 
 
-def copy_files(file_list, target_dir):
-    """将文件列表中的文件拷贝到目标目录"""
+def load_manifest(target_dir):
+    path = os.path.join(target_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(target_dir, manifest):
+    path = os.path.join(target_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def reflink(src, dst):
+    """写时复制地克隆文件（Linux: FICLONE，macOS: cp -c），不支持时抛出 OSError"""
+    if sys.platform == 'darwin':
+        result = subprocess.run(['cp', '-c', src, dst], capture_output=True)
+        if result.returncode != 0:
+            raise OSError(result.stderr.decode(errors='replace').strip())
+        return
+    import fcntl
+
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def place_file(src, dst, link_mode='copy'):
+    """
+    把 src 放到 dst：硬链接或 reflink 失败（跨文件系统、文件系统不支持等）时退回普通拷贝。
+    :return: 实际使用的方式
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    if link_mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    elif link_mode == 'reflink':
+        try:
+            reflink(src, dst)
+            shutil.copystat(src, dst)
+            return 'reflink'
+        except (OSError, ImportError):
+            if os.path.exists(dst):
+                os.remove(dst)
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def stage_file(file, target_dir, manifest, incremental=True, link_mode='copy'):
+    """
+    处理单个文件。增量模式下：大小和 mtime 都与清单一致时只需 stat，直接跳过；
+    不一致时再比较内容哈希，内容未变只更新清单。
+    哈希只在拷贝模式下计算：硬链接和 reflink 重新放置几乎没有开销，比读一遍文件算哈希还便宜。
+    :return: (状态, 清单条目)，状态为 'copied' / 'skipped'
+    """
+    name = os.path.basename(file)
+    dst = os.path.join(target_dir, name)
+    st = os.stat(file)
+    entry = manifest.get(name)
+    use_hash = incremental and link_mode == 'copy'
+    digest = None
+    if incremental and entry and entry.get('src') == file and os.path.exists(dst):
+        if entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return 'skipped', entry
+        if use_hash and entry['size'] == st.st_size and entry.get('sha256'):
+            digest = hash_file(file)
+            if entry['sha256'] == digest:
+                return 'skipped', {**entry, 'mtime_ns': st.st_mtime_ns}
+    if use_hash and digest is None:
+        digest = hash_file(file)
+    method = place_file(file, dst, link_mode)
+    return 'copied', {'src': file, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digest,
+                      'method': method}
+
+
+def copy_files(file_list, target_dir, incremental=True, workers=8, link_mode='copy'):
+    """
+    将文件列表中的文件拷贝到目标目录
+    :param incremental: 根据目标目录中的清单跳过未变化的文件
+    :param workers: 文件较多时并行拷贝的线程数
+    :param link_mode: 'copy'、'hardlink' 或 'reflink'，同一文件系统上可用链接代替拷贝
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unsupported link mode: {link_mode}")
     # 确保目标目录存在，不存在则创建
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
 
+    manifest = load_manifest(target_dir) if incremental else {}
     successful_copies = 0
+    skipped = 0
     failed_files = []
 
-    for file in file_list:
-        if os.path.exists(file):
-            try:
-                shutil.copy(file, target_dir)
-                successful_copies += 1
-            except Exception as e:
-                failed_files.append((file, str(e)))
+    # 目标目录是扁平的：同名文件会写到同一个路径，并行时互相覆盖。提交前找出冲突，只放置第一个
+    staged_names = {}
+    to_stage = []
+    for file in dict.fromkeys(file_list):
+        name = os.path.basename(file)
+        if name in staged_names:
+            failed_files.append((file, f"与 {staged_names[name]} 同名，目标路径冲突"))
+            continue
+        staged_names[name] = file
+        to_stage.append(file)
+
+    def process(file):
+        if not os.path.exists(file):
+            return file, None, None, "文件不存在"
+        try:
+            status, entry = stage_file(file, target_dir, manifest, incremental, link_mode)
+            return file, status, entry, None
+        except Exception as e:
+            return file, None, None, str(e)
+
+    if len(to_stage) > PARALLEL_THRESHOLD and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(process, to_stage))
+    else:
+        results = [process(file) for file in to_stage]
+
+    for file, status, entry, error in results:
+        if error is not None:
+            failed_files.append((file, error))
+            continue
+        manifest[os.path.basename(file)] = entry
+        if status == 'copied':
+            successful_copies += 1
         else:
-            failed_files.append((file, "文件不存在"))
+            skipped += 1
+
+    if incremental:
+        save_manifest(target_dir, manifest)
 
     # 总结输出
     print(f"共拷贝 {len(file_list)} 个文件。")
     print(f"成功拷贝 {successful_copies} 个文件。")
+    if incremental:
+        print(f"未变化跳过 {skipped} 个文件。")
 
     if failed_files:
         print("以下文件拷贝失败：")
@@ -44,12 +182,20 @@ def copy_files(file_list, target_dir):
         print("所有文件拷贝成功！")
 
 
-# 从 txt 文件中读取文件路径列表
-path_prefix = '/Users/lynn/Library/CloudStorage/Dropbox/Private/obsidian/personal/'
-file_list_path = "/Users/lynn/Downloads/clippings.txt"  # 请替换为你的文件路径
-file_list = read_file_list(file_list_path, path_prefix)
-# 目标目录
-destination = "/Users/lynn/Documents/notebooklm/"
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="把剪藏清单中的笔记拷贝到 NotebookLM 目录")
+    # 从 txt 文件中读取文件路径列表
+    parser.add_argument("--prefix", default='/Users/lynn/Library/CloudStorage/Dropbox/Private/obsidian/personal/')
+    parser.add_argument("--list", default="/Users/lynn/Downloads/clippings.txt", help="文件路径列表")
+    # 目标目录
+    parser.add_argument("--dest", default="/Users/lynn/Documents/notebooklm/")
+    parser.add_argument("--full", action="store_true", help="忽略清单，全部重新拷贝")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--link-mode", choices=LINK_MODES, default='copy')
+    args = parser.parse_args()
 
-# 调用函数进行文件拷贝
-copy_files(file_list, destination)
+    file_list = read_file_list(args.list, args.prefix)
+    # 调用函数进行文件拷贝
+    copy_files(file_list, args.dest, incremental=not args.full, workers=args.workers, link_mode=args.link_mode)
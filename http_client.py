@@ -0,0 +1,77 @@
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_TIMEOUT,
+                    HTTP_RETRIES, HTTP_BACKOFF_FACTOR)
+
+# 传输层重试的状态码（412/429 属于风控/限流，交给上层处理，不在这里重试）
+RETRY_STATUS_FORCELIST = (500, 502, 503, 504)
+# 允许自动重试的方法，POST 非幂等不重试
+RETRY_ALLOWED_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def build_session(pool_connections: int = HTTP_POOL_CONNECTIONS,
+                  pool_maxsize: int = HTTP_POOL_MAXSIZE,
+                  retries: int = HTTP_RETRIES,
+                  backoff_factor: float = HTTP_BACKOFF_FACTOR) -> requests.Session:
+    """
+    创建带连接池、keep-alive 和传输层重试的 Session。
+    :param pool_connections: 缓存的主机连接池个数（每个 host 一个池）
+    :param pool_maxsize: 每个主机连接池的最大连接数
+    :param retries: 连接错误 / 5xx 的最大重试次数
+    :param backoff_factor: 指数退避系数，第 n 次重试等待 backoff_factor * 2^(n-1) 秒
+    :return: requests.Session 对象
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_FORCELIST,
+        allowed_methods=RETRY_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """获取进程内共享的 Session，首次调用时创建"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def close_session():
+    """关闭共享 Session，释放连接池"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def request(method: str, url: str, timeout=HTTP_TIMEOUT, **kwargs) -> requests.Response:
+    """
+    通过共享 Session 发送请求，未指定 timeout 时使用默认的 (连接, 读取) 超时。
+    :param method: 请求方法
+    :param url: 请求 URL
+    :param timeout: 超时时间，秒或 (connect, read) 元组
+    :return: requests.Response 对象
+    """
+    return get_session().request(method.upper(), url, timeout=timeout, **kwargs)
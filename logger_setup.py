@@ -1,9 +1,104 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import random
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler()]
-)
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_BODY_MAX_CHARS, LOG_BODY_SAMPLE_RATE
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# LogRecord 自带的属性，JSON 输出时其余属性（extra=...）作为结构化字段输出
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，extra 传入的字段原样保留"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    标准库的 QueueHandler.prepare 会在调用方线程里格式化消息并清掉 exc_info；
+    这里把记录原样（浅拷贝）放进队列，拼接 %-参数、格式化时间和异常堆栈都留给监听线程，
+    JsonFormatter 也能拿到 exc_info 输出 exc 字段。
+    因此不要在记录日志之后原地修改作为参数传入的可变对象。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+
+def _build_handlers():
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if LOG_FILE:
+        handlers.append(logging.FileHandler(LOG_FILE, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def _configure():
+    """
+    调用方只把日志记录放进队列（见 DeferredQueueHandler），消息拼接、格式化和写 stderr / 文件
+    都由 QueueListener 的后台线程完成，worker 不会因为格式化或终端、磁盘 I/O 阻塞。
+    """
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *_build_handlers(), respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(DeferredQueueHandler(log_queue))
+    return listener
+
+
+def _reset_in_child():
+    # fork 出的子进程（如 whisper 进程池）没有监听线程，改为直接写出，否则日志会堆在队列里丢失
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    for handler in _build_handlers():
+        root.addHandler(handler)
+
+
+_listener = _configure()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
 
 logger = logging.getLogger(__name__)
+
+
+def log_body(name: str, body, level: int = logging.DEBUG):
+    """
+    记录响应体或字幕正文等大块内容：级别未开启时不做任何处理；
+    按 LOG_BODY_SAMPLE_RATE 采样，只解码并输出前 LOG_BODY_MAX_CHARS 个字符。
+    :param body: bytes 或 str
+    """
+    if not logger.isEnabledFor(level) or random.random() >= LOG_BODY_SAMPLE_RATE:
+        return
+    size = len(body)
+    if isinstance(body, bytes):
+        # UTF-8 每个字符最多 4 字节，只解码需要的前缀
+        snippet = body[:LOG_BODY_MAX_CHARS * 4].decode('utf-8', 'replace')[:LOG_BODY_MAX_CHARS]
+        truncated = len(snippet.encode('utf-8')) < size
+    else:
+        snippet = body[:LOG_BODY_MAX_CHARS]
+        truncated = size > LOG_BODY_MAX_CHARS
+    logger.log(level, "%s Body (%d): %s%s", name, size, snippet, "..." if truncated else "",
+               extra={"body_name": name, "body_size": size})
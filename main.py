@@ -1,5 +1,12 @@
-from api import bilibili_history, get_subtitle_url, get_subtitle_content
-from logger_setup import logger
+from cli import add_harvest_arguments
+from api import HISTORY_CURSOR, iter_history, lookup_subtitle_url, get_subtitle_content
+import os
+from config import DEDUP_ENABLED, NOTEBOOKLM_DIR, SEARCH_ENABLED, SUBTITLE_CACHE_ENABLED
+from logger_setup import logger, log_body
+from metrics import metrics
+from search_index import index_quietly
+from sync_state import cursor_before_failures
+from text_stream import write_chunks
 from datetime import datetime
 
 def get_today_date():
@@ -13,34 +20,49 @@ def get_today_date():
     return today.strftime("%Y%m%d")
 
 
-def write_to_file(title, content, directory=f'/Users/lynn/Documents/notebooklm/{get_today_date()}'):
+# 字幕按日期写入 NotebookLM 资料目录的子目录
+OUTPUT_DIR = os.path.join(NOTEBOOKLM_DIR, get_today_date())
+
+
+def subtitle_path(title, directory=OUTPUT_DIR):
+    """write_to_file 写出的文件路径"""
+    return os.path.join(directory, f"{title}.txt")
+
+
+def write_to_file(title, content, directory=OUTPUT_DIR):
     """
     将内容写入以 title 为文件名的文本文件，文件存放在指定目录中。
     如果文件已存在，则忽略不写入。
 
     参数:
         title (str): 文件名（不包含后缀）
-        content (str): 要写入文件的内容
+        content (str | Iterable[str]): 要写入文件的内容，可以是按块产出文本的迭代器
         directory (str): 文件存放的目录路径
+
+    返回:
+        写入的文件路径；文件已存在时返回 None；写入失败时返回 False
     """
-    try:
-        # 构造完整文件路径，添加 .txt 后缀
-        import os
-        # 确保目录存在，如果不存在则创建
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        filename = os.path.join(directory, f"{title}.txt")
-        # 检查文件是否存在
-        if os.path.exists(filename):
-            print(f"文件已存在，忽略写入: {filename}")
-            return
-        # 以写入模式打开文件（文件不存在时会自动创建）
-        with open(filename, 'w', encoding='utf-8') as file:
-            # 写入内容
-            file.write(content)
-        print(f"成功写入文件: {filename}")
-    except Exception as e:
-        print(f"写入文件时出错: {e}")
+    with metrics.stage("file_write") as timer:
+        try:
+            # 确保目录存在，如果不存在则创建
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            # 构造完整文件路径，添加 .txt 后缀
+            filename = subtitle_path(title, directory)
+            # 检查文件是否存在
+            if os.path.exists(filename):
+                logger.info("文件已存在，忽略写入: %s", filename)
+                metrics.event("file_write", "exists")
+                return
+            # 逐块编码写入临时文件再原子替换：崩溃时不会留下被当作"已存在"的半截文件
+            written = write_chunks(filename, [content] if isinstance(content, str) else content)
+            timer.add_bytes(written)
+            logger.info("成功写入文件: %s", filename)
+            return filename
+        except Exception as e:
+            timer.fail(e)
+            logger.error("写入文件时出错: %s", e)
+            return False
 
 
 # 示例用法
@@ -50,19 +72,130 @@ if __name__ == "__main__":
     directory = "output_folder"
     write_to_file(title, content, directory)
 
-if __name__ == "__main__":
-    history = bilibili_history()
+
+def store_subtitle(item, content, bundler=None, dedup=None, search=None):
+    """
+    写出一条字幕，并追加到 NotebookLM 合集、收录到全文索引。
+    指定 dedup 时先查重，文件落盘（新写入或此前已存在）之后才把文本收录到查重索引。
+    写文件失败时既不收录到查重索引，也不追加合集、不建全文索引；
+    调用方应把该记录当作失败处理，不让游标越过它，下次同步时重试。
+    :return: (近似重复的 (doc_id, title, 相似度)，不重复时为 None,
+              新写出的文件路径，文件已存在时为 None，写入失败时为 False)
+    """
+    written = []
+
+    def save():
+        written.append(write_to_file(item.title, content))
+        return written[0] is not False
+
+    if dedup is not None and content:
+        duplicate = dedup.check_and_add(item.bvid or f"{item.aid}:{item.cid}", content, item.title, store=save)
+        if duplicate:
+            return duplicate, None
+    else:
+        save()
+    path = written[0]
+    if path is False:
+        return None, False
+    if bundler is not None and content:
+        bundler.add(item, content)
+    if search is not None and path:
+        index_quietly(search.add_bilibili, item, content, path)
+    return None, path
+
+
+def harvest(max_pages=None, state=None, since=None, bundler=None, dedup=None, search=None):
+    """
+    串行抓取：历史记录 -> 字幕地址 -> 字幕正文 -> 写文件。
+    指定 state 时只处理上次同步之后的新观看记录；指定 bundler 时同时追加到 NotebookLM 合集；
+    指定 dedup 时跳过与已收录字幕近似重复的内容；指定 search 时把写出的字幕收录到全文索引。
+    字幕地址查询、下载或写文件失败的记录不会被游标越过，下次同步时重试。
+    """
+    if since is None and state is not None:
+        since = state.get(HISTORY_CURSOR)
+    completed, failed = [], []
+    history = iter_history(since=since, max_pages=max_pages, on_complete=completed.append)
     for i, item in enumerate(history, 0):
-        logger.info(f'-----{i}   EBEGIN--------')
-        logger.info(f"Item {i}:\n{item}")
+        logger.info('-----%d   EBEGIN--------', i)
+        logger.debug("Item %d:\n%s", i, item)
         aid, cid = item.aid, item.cid
-        subtitle_url = get_subtitle_url(aid, cid)
+        ok, subtitle_url = lookup_subtitle_url(aid, cid)
         if subtitle_url:
-            logger.info(f"Subtitle URL: {subtitle_url}")
+            logger.info("Subtitle URL: %s", subtitle_url)
             content = get_subtitle_content(subtitle_url)
             logger.info(item.title)
-            logger.info(f"Subtitle Content: {content}")
-            write_to_file(item.title, content)
+            # 字幕正文可能很长，只在 DEBUG 下截断输出
+            if content:
+                log_body("Subtitle Content", content)
+            if content is None:
+                failed.append(item.view_at)
+            else:
+                duplicate, path = store_subtitle(item, content, bundler, dedup, search)
+                if path is False:
+                    failed.append(item.view_at)
+                    logger.warning("Subtitle write failed, will retry next sync: %s", item.title)
+                elif duplicate:
+                    logger.info("Skipping near-duplicate of '%s' (similarity %.2f)", duplicate[1], duplicate[2])
+                    metrics.event("subtitle_download", "duplicate")
+        elif not ok:
+            failed.append(item.view_at)
+            logger.warning("Subtitle lookup failed, will retry next sync: %s", item.title)
         else:
             logger.warning("No subtitle found.")
-        logger.info(f'-----{i}   END--------')
+        logger.info('-----%d   END--------', i)
+    cursor = cursor_before_failures(since, completed[0], failed) if completed else None
+    if state is not None and cursor is not None:
+        state.set(HISTORY_CURSOR, cursor)
+
+
+def run_harvest_command(args):
+    """执行 add_harvest_arguments 定义的命令行参数，供本文件和 cli.py 共用"""
+    from sync_state import SyncState
+
+    metrics.enabled = metrics.enabled or args.metrics
+    metrics.serve()
+    state = SyncState()
+    # --full 时从 0 开始遍历，不读取旧游标，但遍历完成后仍会刷新游标
+    since = 0 if args.full else None
+    bundler = None
+    if args.bundle:
+        from bundler import get_bundler
+
+        bundler = get_bundler()
+    dedup = None
+    if not args.no_dedup and DEDUP_ENABLED:
+        from dedup_index import get_index
+
+        dedup = get_index()
+    search = None
+    if not args.no_search and SEARCH_ENABLED:
+        from search_index import get_index as get_search_index
+
+        # 打不开全文索引（如数据库被锁）时照常抓取，只是不收录
+        search = index_quietly(get_search_index)
+    if args.use_async:
+        from async_pipeline import run_harvest
+
+        concurrency = {
+            "history_concurrency": args.history_concurrency,
+            "lookup_concurrency": args.lookup_concurrency,
+            "download_concurrency": args.download_concurrency,
+        }
+        run_harvest(max_pages=args.pages, state=state, since=since, bundler=bundler, dedup=dedup, search=search,
+                    **{k: v for k, v in concurrency.items() if v is not None})
+    else:
+        harvest(max_pages=args.pages, state=state, since=since, bundler=bundler, dedup=dedup, search=search)
+    if SUBTITLE_CACHE_ENABLED:
+        from subtitle_cache import get_cache
+
+        # 过期条目读取时不会返回，但仍占着空间；每次同步结束时清理一次
+        get_cache().purge_expired()
+    metrics.export()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="抓取 B 站观看历史的字幕")
+    add_harvest_arguments(parser)
+    run_harvest_command(parser.parse_args())
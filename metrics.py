@@ -0,0 +1,329 @@
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from config import METRICS_ENABLED, METRICS_PROM_PATH, METRICS_REPORT_PATH, METRICS_PORT, METRICS_MAX_SPANS
+
+# 延迟直方图分桶上界（秒），覆盖从单次 HTTP 请求到整段 whisper 转写
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+PROM_PREFIX = "notebooklm"
+
+# 当前正在执行的 span，线程和 asyncio 任务各自独立，用于关联父子 span 和归属字节数
+_current = contextvars.ContextVar("metrics_current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Histogram:
+    """固定分桶的直方图，分位数按桶上界近似"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.inflight = 0
+        self.bytes = 0
+        self.events: Dict[str, int] = {}
+        self.latency = Histogram()
+
+    def to_dict(self) -> dict:
+        latency = self.latency
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "inflight": self.inflight,
+            "bytes": self.bytes,
+            "events": dict(self.events),
+            "latency": {
+                "total_s": latency.sum,
+                "mean_s": latency.sum / latency.count if latency.count else 0.0,
+                "p50_s": latency.quantile(0.5),
+                "p95_s": latency.quantile(0.95),
+                "p99_s": latency.quantile(0.99),
+                "max_s": latency.max,
+            },
+        }
+
+
+class StageTimer:
+    """
+    一次阶段执行，同时也是一个 trace span。
+    可以用作 with 语句（块内的 add_bytes 和子阶段会归属到它），
+    也可以在跨线程的场景下手动调用 finish（如调度器在回调中结束）。
+    """
+
+    def __init__(self, registry: 'Metrics', stage: str, attrs: dict):
+        self.registry = registry
+        self.stage = stage
+        self.attrs = attrs
+        self.span_id = next(_span_ids)
+        parent = _current.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.bytes = 0
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._token = None
+        self._finished = False
+        registry._begin(stage)
+
+    def add_bytes(self, n: int):
+        self.bytes += n
+
+    def fail(self, reason: object = "failed"):
+        """标记失败：用于不抛异常、以返回值表示失败的调用"""
+        self.error = str(reason)
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self._finished:
+            return
+        self._finished = True
+        if error is not None:
+            self.fail(error)
+        self.registry._end(self, time.perf_counter() - self._start)
+
+    def __enter__(self) -> 'StageTimer':
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.finish(exc)
+        return False
+
+
+class _NoopTimer:
+    """关闭指标时返回的空实现，不计时也不加锁"""
+
+    def add_bytes(self, n: int):
+        pass
+
+    def fail(self, reason: object = "failed"):
+        pass
+
+    def finish(self, error: Optional[BaseException] = None):
+        pass
+
+    def __enter__(self) -> '_NoopTimer':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+class Metrics:
+    """
+    按阶段汇总的计数、延迟直方图、并发数（in-flight）和字节数，以及最近的 trace span。
+    关闭时 stage() 返回空实现，埋点的开销只有一次属性判断。
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED, max_spans: int = METRICS_MAX_SPANS):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stages: Dict[str, StageStats] = {}
+        self.spans = deque(maxlen=max_spans)
+        self.dropped_spans = 0
+        self.started_at = time.time()
+
+    def _stats(self, stage: str) -> StageStats:
+        stats = self._stages.get(stage)
+        if stats is None:
+            stats = self._stages[stage] = StageStats()
+        return stats
+
+    def _begin(self, stage: str):
+        with self._lock:
+            self._stats(stage).inflight += 1
+
+    def _end(self, timer: StageTimer, elapsed: float):
+        with self._lock:
+            stats = self._stats(timer.stage)
+            stats.inflight -= 1
+            stats.calls += 1
+            stats.bytes += timer.bytes
+            stats.latency.observe(elapsed)
+            if timer.error is not None:
+                stats.errors += 1
+            if len(self.spans) == self.spans.maxlen:
+                self.dropped_spans += 1
+            self.spans.append({
+                "id": timer.span_id, "parent": timer.parent_id, "stage": timer.stage,
+                "start": timer.started_at, "duration_s": elapsed, "bytes": timer.bytes,
+                "error": timer.error, "attrs": timer.attrs,
+            })
+
+    def stage(self, name: str, **attrs):
+        """开始一次阶段执行，attrs 记录到 span 中（如 task_id、page）"""
+        if not self.enabled:
+            return _NOOP
+        return StageTimer(self, name, attrs)
+
+    def add_bytes(self, n: int, stage: Optional[str] = None):
+        """记录传输的字节数；不指定 stage 时归属到当前 with 块中的阶段"""
+        if not self.enabled:
+            return
+        if stage is None:
+            current = _current.get()
+            if current is not None:
+                current.add_bytes(n)
+            return
+        with self._lock:
+            self._stats(stage).bytes += n
+
+    def event(self, stage: str, name: str, n: int = 1):
+        """阶段内的附加计数，如缓存命中、重复跳过"""
+        if not self.enabled:
+            return
+        with self._lock:
+            events = self._stats(stage).events
+            events[name] = events.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self.spans.clear()
+            self.dropped_spans = 0
+            self.started_at = time.time()
+
+    def render_prometheus(self) -> str:
+        """Prometheus 文本格式（exposition format 0.0.4）"""
+        with self._lock:
+            stages = {name: stats for name, stats in sorted(self._stages.items())}
+            lines = [
+                f"# HELP {PROM_PREFIX}_stage_calls_total Finished stage executions.",
+                f"# TYPE {PROM_PREFIX}_stage_calls_total counter",
+            ]
+            for name, stats in stages.items():
+                lines.append(f'{PROM_PREFIX}_stage_calls_total{{stage="{name}",status="ok"}} '
+                             f'{stats.calls - stats.errors}')
+                lines.append(f'{PROM_PREFIX}_stage_calls_total{{stage="{name}",status="error"}} {stats.errors}')
+            lines += [f"# HELP {PROM_PREFIX}_stage_inflight Stage executions currently running.",
+                      f"# TYPE {PROM_PREFIX}_stage_inflight gauge"]
+            lines += [f'{PROM_PREFIX}_stage_inflight{{stage="{name}"}} {stats.inflight}'
+                      for name, stats in stages.items()]
+            lines += [f"# HELP {PROM_PREFIX}_stage_bytes_total Bytes moved by the stage.",
+                      f"# TYPE {PROM_PREFIX}_stage_bytes_total counter"]
+            lines += [f'{PROM_PREFIX}_stage_bytes_total{{stage="{name}"}} {stats.bytes}'
+                      for name, stats in stages.items()]
+            lines += [f"# HELP {PROM_PREFIX}_stage_events_total Stage-specific events such as cache hits.",
+                      f"# TYPE {PROM_PREFIX}_stage_events_total counter"]
+            lines += [f'{PROM_PREFIX}_stage_events_total{{stage="{name}",event="{event}"}} {count}'
+                      for name, stats in stages.items() for event, count in sorted(stats.events.items())]
+            lines += [f"# HELP {PROM_PREFIX}_stage_latency_seconds Stage execution latency.",
+                      f"# TYPE {PROM_PREFIX}_stage_latency_seconds histogram"]
+            for name, stats in stages.items():
+                histogram, cumulative = stats.latency, 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{PROM_PREFIX}_stage_latency_seconds_bucket{{stage="{name}",le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{PROM_PREFIX}_stage_latency_seconds_bucket{{stage="{name}",le="+Inf"}} '
+                             f'{histogram.count}')
+                lines.append(f'{PROM_PREFIX}_stage_latency_seconds_sum{{stage="{name}"}} {histogram.sum}')
+                lines.append(f'{PROM_PREFIX}_stage_latency_seconds_count{{stage="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> dict:
+        """JSON 运行报告：各阶段汇总、按总耗时排序的阶段列表和最近的 span"""
+        with self._lock:
+            stages = {name: stats.to_dict() for name, stats in self._stages.items()}
+            spans = list(self.spans)
+            dropped = self.dropped_spans
+        finished_at = time.time()
+        return {
+            "started_at": self.started_at,
+            "finished_at": finished_at,
+            "duration_s": finished_at - self.started_at,
+            "stages": stages,
+            "time_by_stage": sorted(((name, s["latency"]["total_s"]) for name, s in stages.items()),
+                                    key=lambda pair: pair[1], reverse=True),
+            "spans": spans,
+            "dropped_spans": dropped,
+        }
+
+    @staticmethod
+    def _write_atomic(path: str, text: str):
+        # 先写临时文件再 rename，node_exporter 的 textfile collector 不会读到半个文件
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def write_prometheus(self, path: str = METRICS_PROM_PATH):
+        self._write_atomic(path, self.render_prometheus())
+
+    def write_report(self, path: str = METRICS_REPORT_PATH):
+        self._write_atomic(path, json.dumps(self.report(), ensure_ascii=False, indent=2))
+
+    def export(self, prom_path: Optional[str] = METRICS_PROM_PATH, report_path: Optional[str] = METRICS_REPORT_PATH):
+        """运行结束时导出，未开启指标时什么也不做"""
+        if not self.enabled:
+            return
+        if prom_path:
+            self.write_prometheus(prom_path)
+        if report_path:
+            self.write_report(report_path)
+
+    def serve(self, port: int = METRICS_PORT, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+        """在后台线程中提供 /metrics 抓取端点，port 为 0 或未开启指标时不启动"""
+        if not self.enabled or not port:
+            return None
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = registry.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+
+metrics = Metrics()
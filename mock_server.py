@@ -0,0 +1,224 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class MockConfig:
+    """
+    模拟服务的行为参数。
+    :param latency: 每个请求的基础延迟（秒）
+    :param jitter: 延迟的随机抖动范围（秒）
+    :param error_rate: 返回错误的概率，其中一半为 500，一半为带 Retry-After 的 429
+    :param total_items: 观看历史总条数
+    :param subtitle_rate: 有字幕的视频比例
+    :param subtitle_segments: 每份字幕的片段数，控制字幕正文大小
+    :param sessions: Audiobookshelf 收听记录条数
+    """
+
+    def __init__(self, latency=0.02, jitter=0.01, error_rate=0.0, total_items=200, subtitle_rate=0.8,
+                 subtitle_segments=400, sessions=50, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.total_items = total_items
+        self.subtitle_rate = subtitle_rate
+        self.subtitle_segments = subtitle_segments
+        self.sessions = sessions
+        self.random = random.Random(seed)
+        # 观看时间从现在开始每条往前推 10 分钟，与真实接口一样按 view_at 倒序
+        self.now = int(time.time())
+
+
+def _history_item(config: MockConfig, index: int) -> dict:
+    aid = 100000 + index
+    return {
+        "title": f"模拟视频 {index}",
+        "redirect_link": f"https://www.bilibili.com/video/BVmock{aid}",
+        "short_link_v2": f"https://b23.tv/BVmock{aid}",
+        "bvid": f"BVmock{aid}",
+        "aid": aid,
+        "cid": aid * 10,
+        "pubdate": config.now - 86400 - index * 600,
+        "duration": 600,
+        "view_at": config.now - index * 600,
+        "owner": {"name": f"UP主{index % 7}"},
+        "stat": {"view": index * 10, "like": index, "favorite": index // 2, "coin": index // 3, "share": index // 5},
+    }
+
+
+def _subtitle_body(config: MockConfig, aid: int) -> dict:
+    return {"body": [{"from": i * 2.0, "to": i * 2.0 + 1.8,
+                      "content": f"这是视频 {aid} 的第 {i} 句字幕，用于模拟真实的字幕内容长度。"}
+                     for i in range(config.subtitle_segments)]}
+
+
+def _session(config: MockConfig, index: int) -> dict:
+    updated_at = (config.now - index * 3600) * 1000
+    return {
+        "id": f"session-{index}",
+        "libraryItemId": f"li-{index % 20}",
+        "displayTitle": f"模拟有声书 {index % 20}",
+        "displayAuthor": f"作者 {index % 5}",
+        "timeListening": 600 + index,
+        "date": time.strftime('%Y-%m-%d', time.localtime(updated_at / 1000)),
+        "startedAt": updated_at - 600000,
+        "updatedAt": updated_at,
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """模拟 B 站历史记录 / 播放器 / 字幕接口和 Audiobookshelf 收听统计 / 收听记录接口"""
+
+    server_version = "NotebookLMHelperMock/1.0"
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，关闭 Nagle 避免与客户端延迟 ACK 叠加出 40ms 的假延迟
+    disable_nagle_algorithm = True
+
+    @property
+    def config(self) -> MockConfig:
+        return self.server.mock_config
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200, headers=None):
+        payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def _simulate(self) -> bool:
+        """注入延迟和错误，返回 False 表示已经发送了错误响应"""
+        config = self.config
+        delay = config.latency + config.random.uniform(-config.jitter, config.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if config.random.random() < config.error_rate:
+            if config.random.random() < 0.5:
+                self._send_json({"code": -500, "message": "mock server error"}, status=500)
+            else:
+                self._send_json({"code": -429, "message": "mock throttled"}, status=429,
+                                headers={"Retry-After": "0"})
+            return False
+        return True
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        if not self._simulate():
+            return
+        config = self.config
+        if parts.path == "/x/v2/history":
+            ps, pn = int(query.get("ps", 20)), int(query.get("pn", 1))
+            start = (pn - 1) * ps
+            items = [_history_item(config, i) for i in range(start, min(start + ps, config.total_items))]
+            self._send_json({"code": 0, "data": items})
+        elif parts.path == "/x/player/wbi/v2":
+            aid, cid = int(query.get("aid", 0)), int(query.get("cid", 0))
+            # 按 aid 决定是否有字幕，同一视频多次请求结果一致
+            has_subtitle = random.Random(aid).random() < config.subtitle_rate
+            subtitles = []
+            if has_subtitle:
+                # 字幕正文由另一个主机名的监听端口提供，与真实的字幕 CDN 一样不占用 API 主机的限流配额
+                subtitle_url = f"{self.server.cdn_url}/subtitles/{aid}.json?auth_key={time.time()}"
+                subtitles.append({"lan": "ai-zh", "subtitle_url": subtitle_url})
+            self._send_json({"code": 0, "data": {"aid": aid, "cid": cid, "subtitle": {"subtitles": subtitles}}})
+        elif parts.path.startswith("/subtitles/"):
+            aid = int(parts.path.rsplit("/", 1)[-1].split(".")[0])
+            self._send_json(_subtitle_body(config, aid))
+        elif parts.path == "/api/me/listening-stats":
+            sessions = [_session(config, i) for i in range(min(config.sessions, 10))]
+            self._send_json({"totalTime": sum(s["timeListening"] for s in sessions), "recentSessions": sessions})
+        elif parts.path == "/api/me/listening-sessions":
+            # 与真实接口一样按 updatedAt 倒序分页，页码从 0 开始
+            per_page, page = int(query.get("itemsPerPage", 10)), int(query.get("page", 0))
+            start = page * per_page
+            sessions = [_session(config, i) for i in range(start, min(start + per_page, config.sessions))]
+            self._send_json({"total": config.sessions, "numPages": -(-config.sessions // per_page),
+                             "page": page, "itemsPerPage": per_page, "sessions": sessions})
+        else:
+            self._send_json({"code": -404, "message": "not found"}, status=404)
+
+
+class MockServer:
+    """
+    在后台线程中运行的本地模拟服务，支持 with 语句。
+    字幕正文另起一个监听端口，通过 cdn_host 访问：限流器按主机名分桶，
+    与真实环境一样，字幕 CDN 不和 API 共用一个限流桶。
+    """
+
+    def __init__(self, config: MockConfig = None, host: str = "127.0.0.1", port: int = 0,
+                 cdn_host: str = "localhost", cdn_port: int = 0):
+        config = config or MockConfig()
+        self.httpd = self._listen(host, port, config)
+        self.cdn = self._listen(cdn_host, cdn_port, config)
+        self.cdn_host = cdn_host
+        self.httpd.cdn_url = self.cdn.cdn_url = self.cdn_url
+        self._threads = []
+
+    @staticmethod
+    def _listen(host: str, port: int, config: MockConfig) -> ThreadingHTTPServer:
+        httpd = ThreadingHTTPServer((host, port), MockHandler)
+        httpd.daemon_threads = True
+        httpd.mock_config = config
+        return httpd
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def cdn_url(self) -> str:
+        return f"http://{self.cdn_host}:{self.cdn.server_address[1]}"
+
+    def start(self) -> 'MockServer':
+        for name, httpd in (("mock-server", self.httpd), ("mock-cdn", self.cdn)):
+            thread = threading.Thread(target=httpd.serve_forever, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        for httpd in (self.httpd, self.cdn):
+            httpd.shutdown()
+            httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地模拟 B 站 / Audiobookshelf 接口")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--segments", type=int, default=400, help="每份字幕的片段数")
+    args = parser.parse_args()
+
+    server = MockServer(MockConfig(latency=args.latency, error_rate=args.error_rate, total_items=args.items,
+                                   subtitle_segments=args.segments), port=args.port)
+    server.start()
+    print(f"Mock server listening on {server.url}, subtitles on {server.cdn_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
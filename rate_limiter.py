@@ -0,0 +1,144 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from config import RATE_LIMITS
+
+# 触发限流（412 风控 / 429 Too Many Requests）的状态码
+THROTTLE_STATUS_CODES = (412, 429)
+# 被限流后速率乘以该系数，之后每次成功按 base_rate * RECOVER_STEP 线性恢复
+PENALTY_FACTOR = 0.5
+RECOVER_STEP = 0.05
+# 没有 Retry-After 时被限流后的最短冷却时间（秒）
+DEFAULT_COOLDOWN = 5.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头，支持秒数和 HTTP 日期两种格式，返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶。
+    rate 为每秒补充的令牌数，burst 为桶容量；令牌不足时调用方排队等待，
+    收到限流响应后降低速率并暂停发放，之后随成功请求逐步恢复到 base_rate。
+    """
+
+    def __init__(self, rate: float, burst: int = 1, min_rate: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive: {rate}")
+        self.base_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 8
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self._updated = now
+
+    def reserve(self) -> float:
+        """预定一个令牌，返回调用方需要等待的秒数（0 表示可以立即发送）"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        """阻塞直到拿到令牌"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """协程版 acquire，等待期间不阻塞事件循环"""
+        wait = self.reserve()
+        if wait > 0:
+            import asyncio
+
+            await asyncio.sleep(wait)
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """收到限流响应：降低速率，清空令牌，并在 retry_after 秒内暂停发放"""
+        with self._lock:
+            now = time.monotonic()
+            self.rate = max(self.min_rate, self.rate * PENALTY_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            self._updated = now
+            cooldown = retry_after if retry_after is not None else max(DEFAULT_COOLDOWN, 1 / self.rate)
+            self.blocked_until = max(self.blocked_until, now + cooldown)
+
+    def reward(self):
+        """请求成功：速率线性恢复，直到 base_rate"""
+        if self.rate >= self.base_rate:
+            return
+        with self._lock:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * RECOVER_STEP)
+
+
+class RateLimiter:
+    """按 host 分桶的限流器，未配置的 host 不限速"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]]):
+        """
+        :param limits: {host: (每秒请求数, 突发容量)}
+        """
+        self._buckets = {host: TokenBucket(rate, burst) for host, (rate, burst) in limits.items()}
+
+    def bucket_for(self, url: str) -> Optional[TokenBucket]:
+        host = urlsplit(url).hostname or ""
+        return self._buckets.get(host)
+
+    def acquire(self, url: str):
+        bucket = self.bucket_for(url)
+        if bucket is not None:
+            bucket.acquire()
+
+    async def acquire_async(self, url: str):
+        bucket = self.bucket_for(url)
+        if bucket is not None:
+            await bucket.acquire_async()
+
+    def feedback(self, url: str, status_code: int, headers=None) -> Optional[float]:
+        """
+        根据响应调整对应 host 的速率。
+        :return: 被限流时返回应等待的秒数（Retry-After，没有该头时为 DEFAULT_COOLDOWN；Retry-After: 0 时为 0.0），
+            否则返回 None
+        """
+        bucket = self.bucket_for(url)
+        if status_code in THROTTLE_STATUS_CODES:
+            retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+            if bucket is not None:
+                bucket.penalize(retry_after)
+            return DEFAULT_COOLDOWN if retry_after is None else retry_after
+        if bucket is not None and status_code < 400:
+            bucket.reward()
+        return None
+
+
+# api.py 中所有请求共享的限流器
+limiter = RateLimiter(RATE_LIMITS)
@@ -0,0 +1,181 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List
+
+from config import TASK_LEASE_SECONDS, TASK_MAX_RECOVERIES
+from logger_setup import logger
+from metrics import metrics, StageTimer
+from task_store import claim_tasks, lease_owners, recover_tasks, release_tasks, renew_leases
+
+
+class Stage:
+    """
+    流水线中的一个阶段。
+    :param name: 阶段名，用于日志
+    :param ready_status: 可被本阶段认领的任务状态
+    :param claimed_status: 认领后写入的状态
+    :param job: 任务函数 job(task_id, db_path)，需为模块级函数以便提交到进程池
+    :param make_executor: 创建本阶段专用线程池或进程池的工厂；进程池损坏（如 worker 被 OOM 杀死）后用它重建
+    :param workers: 本阶段同时处理的最大任务数
+    """
+
+    def __init__(self, name: str, ready_status: str, claimed_status: str,
+                 job: Callable[[int, str], object], make_executor: Callable[[], Executor], workers: int):
+        self.name = name
+        self.ready_status = ready_status
+        self.claimed_status = claimed_status
+        self.job = job
+        self.make_executor = make_executor
+        self.executor = make_executor()
+        self.workers = workers
+        # 进行中的 future -> 任务 id
+        self.inflight: Dict[Future, int] = {}
+
+    def rebuild_executor(self):
+        """丢弃已损坏的池并新建一个；旧池中的 future 都已以 BrokenProcessPool 结束"""
+        self.executor.shutdown(wait=False)
+        self.executor = self.make_executor()
+
+
+class StageScheduler:
+    """
+    按阶段调度的任务调度器：每个阶段有独立的 worker 池，
+    任务完成或新任务创建时立即唤醒调度线程，poll_interval 只作为兜底
+    （用于发现其他进程写入的任务）。
+    认领的任务带租约并定期续约；进程崩溃后租约过期（同一台机器上认领者已退出时立即）的任务
+    被退回所在阶段的 ready 状态，由各阶段根据检查点从最后完成的产物继续。
+    """
+
+    def __init__(self, db_path: str, stages: List[Stage], connect: Callable[[str], sqlite3.Connection],
+                 poll_interval: float = 30, lease_seconds: float = TASK_LEASE_SECONDS,
+                 max_recoveries: int = TASK_MAX_RECOVERIES):
+        self.db_path = db_path
+        self.stages = stages
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_recoveries = max_recoveries
+        # 租约持有者标识：主机名:pid:随机后缀
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._renewed_at = 0.0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self):
+        """有新任务或状态变化时调用，唤醒调度线程"""
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _on_done(self, stage: Stage, task_id: int, future: Future, timer: StageTimer):
+        error = future.exception()
+        # 在调度进程中计时，进程池中执行的阶段（whisper）同样能统计到
+        timer.finish(error)
+        if error is not None:
+            logger.error("%s failed for task %s: %s", stage.name, task_id, error)
+        else:
+            logger.info("%s finished for task %s", stage.name, task_id)
+        self.notify()
+
+    def _dead_owners(self, conn: sqlite3.Connection) -> List[str]:
+        """同一台机器上已经退出的调度器，其任务不必等租约过期"""
+        host = socket.gethostname()
+        dead = []
+        for owner in lease_owners(conn):
+            owner_host, _, rest = owner.partition(':')
+            pid = rest.split(':', 1)[0]
+            if owner_host != host or owner == self.owner or not pid.isdigit():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                dead.append(owner)
+            except PermissionError:
+                pass  # 进程存在，只是属于其他用户
+        return dead
+
+    def recover(self, conn: sqlite3.Connection) -> List[int]:
+        """把卡住的任务退回所在阶段的 ready 状态"""
+        task_ids = recover_tasks(conn, {stage.claimed_status: stage.ready_status for stage in self.stages},
+                                 self._dead_owners(conn), self.max_recoveries)
+        if task_ids:
+            logger.warning("Recovered stuck tasks %s", task_ids)
+        return task_ids
+
+    def _renew(self, conn: sqlite3.Connection):
+        """每过三分之一个租约期为进行中的任务续约"""
+        now = time.monotonic()
+        if now - self._renewed_at < self.lease_seconds / 3:
+            return
+        self._renewed_at = now
+        task_ids = [task_id for stage in self.stages for task_id in stage.inflight.values()]
+        if task_ids:
+            renew_leases(conn, task_ids, self.owner, self.lease_seconds)
+
+    def _release_broken(self, conn: sqlite3.Connection, stage: Stage, task_ids: List[int]):
+        """worker 进程崩溃导致进程池损坏：退回受影响的任务并重建进程池，调度器本身继续运行"""
+        logger.error("%s worker pool is broken, rebuilding it and releasing tasks %s", stage.name, task_ids)
+        stage.rebuild_executor()
+        released = release_tasks(conn, task_ids, stage.claimed_status, stage.ready_status,
+                                 self.owner, self.max_recoveries)
+        if released:
+            logger.warning("Released tasks %s back to %s", released, stage.ready_status)
+
+    def _dispatch(self, conn: sqlite3.Connection) -> bool:
+        """尽量为每个阶段填满空闲 worker，返回是否还有任务在处理"""
+        busy = False
+        for stage in self.stages:
+            broken = [task_id for f, task_id in stage.inflight.items()
+                      if f.done() and isinstance(f.exception(), BrokenProcessPool)]
+            stage.inflight = {f: task_id for f, task_id in stage.inflight.items() if not f.done()}
+            if broken:
+                self._release_broken(conn, stage, broken)
+            # 一个事务内按空闲 worker 数批量认领
+            free = stage.workers - len(stage.inflight)
+            claimed = claim_tasks(conn, stage.ready_status, stage.claimed_status, free,
+                                  owner=self.owner, lease_seconds=self.lease_seconds)
+            for i, task_id in enumerate(claimed):
+                logger.info("Starting %s for task %s", stage.name, task_id)
+                timer = metrics.stage(stage.name, task_id=task_id)
+                try:
+                    future = stage.executor.submit(stage.job, task_id, self.db_path)
+                except BrokenProcessPool as e:
+                    # 池在上次检查之后才损坏：本轮剩下的任务都没有提交，一并退回
+                    timer.finish(e)
+                    self._release_broken(conn, stage, claimed[i:])
+                    break
+                stage.inflight[future] = task_id
+                future.add_done_callback(lambda f, s=stage, t=task_id, m=timer: self._on_done(s, t, f, m))
+            busy = busy or bool(stage.inflight)
+        return busy
+
+    def run(self, stop_when_idle: bool = False):
+        """
+        调度主循环。
+        :param stop_when_idle: 为 True 时所有阶段都没有任务可做后退出
+        """
+        conn = self.connect(self.db_path)
+        # 续约不能依赖任务完成的通知，等待时间不超过续约间隔
+        wait = min(self.poll_interval, self.lease_seconds / 3)
+        try:
+            while not self._stopped.is_set():
+                # 先清除再扫描：扫描期间到达的通知不会丢失
+                self._wakeup.clear()
+                self._renew(conn)
+                self.recover(conn)
+                busy = self._dispatch(conn)
+                if stop_when_idle and not busy:
+                    break
+                self._wakeup.wait(wait)
+        finally:
+            conn.close()
+            for stage in self.stages:
+                stage.executor.shutdown(wait=True)
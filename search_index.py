@@ -0,0 +1,311 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from bilibili_models import BilibiliHistoryItem
+from config import SEARCH_INDEX_PATH, SEARCH_TOKENIZER, SEARCH_PASSAGE_CHARS
+from logger_setup import logger
+from text_stream import iter_passages, iter_srt_segments, iter_text_chunks
+
+# 已收录文本的种类
+KIND_TRANSCRIPT = 'transcript'
+KIND_SRT = 'srt'
+KIND_SUMMARY = 'summary'
+# 按文件收录时识别的扩展名
+INDEXED_EXTENSIONS = ('.txt', '.srt')
+# trigram 分词下短于 3 个字符的词无法走索引，改为 LIKE 扫描
+_TRIGRAM_MIN_CHARS = 3
+
+# (开始秒数, 结束秒数, 文本)，没有时间轴时开始和结束为 None
+Segment = Tuple[Optional[float], Optional[float], str]
+
+
+def bilibili_doc_id(item: BilibiliHistoryItem) -> str:
+    return f"bilibili:{item.bvid or f'{item.aid}:{item.cid}'}"
+
+
+def task_doc_id(task_id: int, kind: str) -> str:
+    return f"task:{task_id}:{kind}"
+
+
+def link_at(url: Optional[str], seconds: Optional[float]) -> Optional[str]:
+    """带时间点的跳转链接：YouTube 使用 t=123s，B 站使用 t=123"""
+    if not url or seconds is None:
+        return url
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != 't']
+    query.append(('t', f"{int(seconds)}s" if 'youtu' in parts.netloc else str(int(seconds))))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+_LIKE_CLAUSE = "s.text LIKE ? ESCAPE '\\'"
+
+
+def _escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _fts_query(query: str) -> str:
+    """把用户输入的关键词转为 FTS5 查询：每个词按短语处理（转义引号），多个词之间为 AND"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+class SearchIndex:
+    """
+    转写稿、SRT 字幕和摘要的 SQLite FTS5 全文索引。
+    - documents: 每篇文本一行，保存来源、标题、链接、UP 主、下载任务 id、文件路径等元数据
+    - segments: 文本切成的片段，SRT 保留每条字幕的起止时间，纯文本按段落切分
+    - segments_fts: 以 segments 为外部内容表的 FTS5 索引，由触发器同步
+    同一 doc_id 再次收录时整体替换；按文件收录时比较 mtime 和大小，未变化的文件跳过。
+    """
+
+    def __init__(self, path: str = SEARCH_INDEX_PATH, tokenizer: str = SEARCH_TOKENIZER,
+                 passage_chars: int = SEARCH_PASSAGE_CHARS):
+        self.passage_chars = passage_chars
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(f'''
+            CREATE TABLE IF NOT EXISTS documents
+                (doc_id TEXT PRIMARY KEY, kind TEXT, source TEXT, title TEXT, url TEXT, owner TEXT,
+                 path TEXT, task_id INTEGER, published_at INTEGER, viewed_at INTEGER,
+                 mtime REAL, size INTEGER, indexed_at REAL);
+            CREATE INDEX IF NOT EXISTS idx_documents_path ON documents (path);
+            CREATE TABLE IF NOT EXISTS segments
+                (id INTEGER PRIMARY KEY, doc_id TEXT, seq INTEGER, start REAL, end REAL, text TEXT);
+            CREATE INDEX IF NOT EXISTS idx_segments_doc ON segments (doc_id, seq);
+            CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts
+                USING fts5(text, content='segments', content_rowid='id', tokenize='{tokenizer}');
+            CREATE TRIGGER IF NOT EXISTS segments_ai AFTER INSERT ON segments BEGIN
+                INSERT INTO segments_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS segments_ad AFTER DELETE ON segments BEGIN
+                INSERT INTO segments_fts (segments_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+        ''')
+        self.conn.commit()
+        # 已有索引以建表时的分词器为准
+        sql = self.conn.execute("SELECT sql FROM sqlite_master WHERE name = 'segments_fts'").fetchone()[0]
+        self.trigram = 'trigram' in sql
+
+    def add_document(self, doc_id: str, segments: Iterable[Segment], kind: str, source: str = '',
+                     title: str = '', url: str = '', owner: str = '', path: Optional[str] = None,
+                     task_id: Optional[int] = None, published_at: Optional[int] = None,
+                     viewed_at: Optional[int] = None, mtime: Optional[float] = None,
+                     size: Optional[int] = None) -> int:
+        """
+        收录（或整体替换）一篇文本。
+        :param segments: [(开始秒数, 结束秒数, 文本)]，可以是生成器
+        :return: 收录的片段数
+        """
+        rows = ((doc_id, seq, start, end, text) for seq, (start, end, text) in enumerate(segments) if text)
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM segments WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              (doc_id, kind, source, title, url, owner, path, task_id, published_at, viewed_at,
+                               mtime, size, time.time()))
+            count = self.conn.executemany("INSERT INTO segments (doc_id, seq, start, end, text) "
+                                          "VALUES (?, ?, ?, ?, ?)", rows).rowcount
+        return count
+
+    def remove(self, doc_id: str):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM segments WHERE doc_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    def _passages(self, chunks: Iterable[str]) -> Iterable[Segment]:
+        return ((None, None, passage) for passage in iter_passages(chunks, self.passage_chars))
+
+    def add_bilibili(self, item: BilibiliHistoryItem, content: str, path: Optional[str] = None) -> int:
+        """收录一条 B 站字幕正文（没有时间轴，按段落切分），保留视频元数据"""
+        stat = os.stat(path) if path else None
+        return self.add_document(
+            bilibili_doc_id(item), self._passages([content]), KIND_TRANSCRIPT, source='bilibili',
+            title=item.title, url=item.redirect_link or item.short_link, owner=item.owner_name,
+            path=os.path.abspath(path) if path else None, published_at=item.pubdate, viewed_at=item.view_at,
+            mtime=stat.st_mtime if stat else None, size=stat.st_size if stat else None)
+
+    def add_task_segments(self, task: Dict, segments: Iterable[Dict], srt_path: Optional[str] = None) -> int:
+        """
+        收录下载任务的转写结果。
+        :param task: DownloadTasks 中的一行（id、title、youtube_url）
+        :param segments: whisper 片段或 iter_srt_segments 的结果 {'start', 'end', 'text'}
+        """
+        stat = os.stat(srt_path) if srt_path else None
+        return self.add_document(
+            task_doc_id(task['id'], KIND_SRT),
+            ((s['start'], s['end'], s['text'].strip()) for s in segments), KIND_SRT, source='youtube',
+            title=task['title'] or '', url=task['youtube_url'], path=os.path.abspath(srt_path) if srt_path else None,
+            task_id=task['id'], mtime=stat.st_mtime if stat else None, size=stat.st_size if stat else None)
+
+    def add_task_summary(self, task: Dict, summary: str) -> int:
+        # 摘要没有文件，size 记录字符数，补录时据此跳过未变化的摘要
+        return self.add_document(
+            task_doc_id(task['id'], KIND_SUMMARY), self._passages([summary]), KIND_SUMMARY, source='youtube',
+            title=task['title'] or '', url=task['youtube_url'], task_id=task['id'], size=len(summary))
+
+    def _unchanged(self, path: str, stat: os.stat_result) -> Tuple[Optional[str], bool]:
+        """:return: (该文件已有的 doc_id, 是否未变化)"""
+        with self._lock:
+            row = self.conn.execute("SELECT doc_id, mtime, size FROM documents WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None, False
+        return row['doc_id'], row['mtime'] == stat.st_mtime and row['size'] == stat.st_size
+
+    def index_file(self, path: str, force: bool = False) -> Optional[int]:
+        """
+        收录一个 .txt 转写稿或 .srt 字幕文件，文件名作为标题。
+        已由抓取流程收录过的文件沿用原有的 doc_id 和元数据，只更新内容。
+        :return: 收录的片段数，文件未变化而跳过时返回 None
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        doc_id, unchanged = self._unchanged(path, stat)
+        if unchanged and not force:
+            return None
+        meta = {}
+        if doc_id is not None:
+            with self._lock:
+                row = self.conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            meta = {key: row[key] for key in ('source', 'title', 'url', 'owner', 'task_id', 'published_at',
+                                              'viewed_at')}
+        else:
+            meta['title'] = os.path.splitext(os.path.basename(path))[0]
+        if path.endswith('.srt'):
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                return self.add_document(doc_id or path, ((s['start'], s['end'], s['text'])
+                                                          for s in iter_srt_segments(f)),
+                                         KIND_SRT, path=path, mtime=stat.st_mtime, size=stat.st_size, **meta)
+        return self.add_document(doc_id or path, self._passages(iter_text_chunks(path)), KIND_TRANSCRIPT,
+                                 path=path, mtime=stat.st_mtime, size=stat.st_size, **meta)
+
+    def index_directory(self, directory: str, force: bool = False) -> int:
+        """递归收录目录下新增或修改过的 .txt / .srt 文件，返回收录的文件数"""
+        count = 0
+        for root, _, names in os.walk(directory):
+            for name in sorted(names):
+                if not name.endswith(INDEXED_EXTENSIONS) or name.startswith('.'):
+                    continue
+                try:
+                    if self.index_file(os.path.join(root, name), force=force) is not None:
+                        count += 1
+                except (OSError, UnicodeDecodeError) as e:
+                    logger.warning("Failed to index %s: %s", os.path.join(root, name), e)
+        logger.info("Indexed %d files under %s", count, directory)
+        return count
+
+    def index_tasks(self, conn: sqlite3.Connection) -> int:
+        """从 DownloadTasks 补录已有的 SRT 字幕和摘要，返回收录的文本数"""
+        count = 0
+        rows = conn.execute("SELECT id, title, youtube_url, srt_path, summary FROM DownloadTasks "
+                            "WHERE srt_path IS NOT NULL OR summary IS NOT NULL").fetchall()
+        for row in rows:
+            task = {'id': row[0], 'title': row[1], 'youtube_url': row[2]}
+            srt_path, summary = row[3], row[4]
+            if srt_path and os.path.exists(srt_path):
+                doc_id, unchanged = self._unchanged(os.path.abspath(srt_path), os.stat(srt_path))
+                if not unchanged:
+                    with open(srt_path, 'r', encoding='utf-8', errors='replace') as f:
+                        self.add_task_segments(task, iter_srt_segments(f), srt_path)
+                    count += 1
+            if summary:
+                with self._lock:
+                    row = self.conn.execute("SELECT size FROM documents WHERE doc_id = ?",
+                                            (task_doc_id(task['id'], KIND_SUMMARY),)).fetchone()
+                if row is None or row['size'] != len(summary):
+                    self.add_task_summary(task, summary)
+                    count += 1
+        return count
+
+    def search(self, query: str, limit: int = 20, kind: Optional[str] = None, source: Optional[str] = None,
+               per_document: bool = False) -> List[Dict]:
+        """
+        按相关度（bm25）检索片段。
+        :param query: 关键词，空格分隔的多个词须同时出现
+        :param kind: 只检索某一类文本（transcript / srt / summary）
+        :param per_document: 为 True 时每篇文本只返回最相关的一个片段
+        :return: [{doc_id, kind, source, title, url, owner, path, task_id, start, end, snippet, score, link}]
+        """
+        terms = query.split()
+        if not terms:
+            return []
+        filters, params = [], []
+        if kind:
+            filters.append("d.kind = ?")
+            params.append(kind)
+        if source:
+            filters.append("d.source = ?")
+            params.append(source)
+        extra = "".join(f" AND {f}" for f in filters)
+        # per_document 时多取一些片段再按文本去重
+        fetch = limit * 10 if per_document else limit
+        if self.trigram and any(len(term) < _TRIGRAM_MIN_CHARS for term in terms):
+            where = " AND ".join([_LIKE_CLAUSE] * len(terms))
+            sql = f'''
+                SELECT s.doc_id, s.start, s.end, substr(s.text, 1, 200) AS snippet, 0.0 AS score, d.*
+                FROM segments s JOIN documents d ON d.doc_id = s.doc_id
+                WHERE {where}{extra}
+                ORDER BY d.indexed_at DESC, s.seq LIMIT ?'''
+            args = [f"%{_escape_like(term)}%" for term in terms] + params + [fetch]
+        else:
+            sql = f'''
+                SELECT s.doc_id, s.start, s.end, snippet(segments_fts, 0, '[', ']', '…', 24) AS snippet,
+                       -bm25(segments_fts) AS score, d.*
+                FROM segments_fts JOIN segments s ON s.id = segments_fts.rowid
+                JOIN documents d ON d.doc_id = s.doc_id
+                WHERE segments_fts MATCH ?{extra}
+                ORDER BY bm25(segments_fts) LIMIT ?'''
+            args = [_fts_query(query)] + params + [fetch]
+        with self._lock:
+            rows = self.conn.execute(sql, args).fetchall()
+        hits, seen = [], set()
+        for row in rows:
+            if per_document:
+                if row['doc_id'] in seen:
+                    continue
+                seen.add(row['doc_id'])
+            hits.append({
+                "doc_id": row['doc_id'], "kind": row['kind'], "source": row['source'], "title": row['title'],
+                "url": row['url'], "owner": row['owner'], "path": row['path'], "task_id": row['task_id'],
+                "start": row['start'], "end": row['end'], "snippet": row['snippet'], "score": row['score'],
+                "link": link_at(row['url'], row['start']),
+            })
+            if len(hits) >= limit:
+                break
+        return hits
+
+    def close(self):
+        self.conn.close()
+
+
+T = TypeVar('T')
+
+
+def index_quietly(func: Callable[..., T], *args, **kwargs) -> Optional[T]:
+    """
+    调用收录方法；失败（如数据库被锁）只记录警告，不影响抓取和下载任务本身。
+    打开索引（get_index）也要放在 func 内部执行，否则打开失败会绕过这里的保护。
+    """
+    try:
+        return func(*args, **kwargs)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Search indexing failed: %s", e)
+        return None
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> SearchIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SearchIndex()
+    return _index
@@ -0,0 +1,188 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from config import (SUBTITLE_CACHE_PATH, SUBTITLE_URL_TTL, SUBTITLE_NEGATIVE_TTL, SUBTITLE_BODY_TTL,
+                    SUBTITLE_CACHE_MAX_BYTES, SUBTITLE_CACHE_MAX_URLS)
+
+# 缓存未命中（与"确认没有字幕"的 None 区分开）
+MISS = object()
+
+
+def content_key(subtitle_url: str) -> str:
+    """
+    字幕地址的缓存键：去掉协议和查询参数。
+    字幕 CDN 地址里的 auth_key 每次请求都会变，但路径对同一份字幕是稳定的。
+    """
+    parts = urlsplit(subtitle_url if not subtitle_url.startswith("//") else "https:" + subtitle_url)
+    return urlunsplit(("", parts.netloc, parts.path, "", ""))
+
+
+class SubtitleCache:
+    """
+    字幕的本地 SQLite 缓存：
+    - subtitle_urls: (aid, cid) -> 字幕地址，地址为 NULL 表示确认没有字幕（负缓存，TTL 更短）
+    - subtitle_bodies: 字幕地址 -> 正文哈希
+    - blobs: 正文哈希 -> 正文，按内容寻址，相同字幕只存一份
+    条目均有 TTL，正文总大小超过上限时按最近访问时间（LRU）淘汰。
+    地址条数和正文总大小在内存中维护累计值，写入时不必每次全表统计；
+    其他进程写入同一个库造成的偏差在 purge_expired 时重新统计校正。
+    """
+
+    def __init__(self, path: str = SUBTITLE_CACHE_PATH, url_ttl: float = SUBTITLE_URL_TTL,
+                 negative_ttl: float = SUBTITLE_NEGATIVE_TTL, body_ttl: float = SUBTITLE_BODY_TTL,
+                 max_bytes: int = SUBTITLE_CACHE_MAX_BYTES, max_urls: int = SUBTITLE_CACHE_MAX_URLS):
+        self.url_ttl = url_ttl
+        self.negative_ttl = negative_ttl
+        self.body_ttl = body_ttl
+        self.max_bytes = max_bytes
+        self.max_urls = max_urls
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS subtitle_urls
+                (aid INTEGER, cid INTEGER, subtitle_url TEXT, fetched_at REAL, accessed_at REAL,
+                 PRIMARY KEY (aid, cid));
+            CREATE TABLE IF NOT EXISTS subtitle_bodies
+                (url_key TEXT PRIMARY KEY, content_hash TEXT, fetched_at REAL, accessed_at REAL);
+            CREATE TABLE IF NOT EXISTS blobs
+                (content_hash TEXT PRIMARY KEY, content TEXT, size INTEGER, accessed_at REAL);
+            CREATE INDEX IF NOT EXISTS idx_subtitle_urls_accessed ON subtitle_urls (accessed_at);
+            CREATE INDEX IF NOT EXISTS idx_subtitle_bodies_hash ON subtitle_bodies (content_hash);
+            CREATE INDEX IF NOT EXISTS idx_blobs_accessed ON blobs (accessed_at);
+        ''')
+        self.conn.commit()
+        self._recount()
+
+    def _recount(self):
+        self._url_count = self.conn.execute("SELECT COUNT(*) FROM subtitle_urls").fetchone()[0]
+        self._blob_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def get_subtitle_url(self, aid: int, cid: int):
+        """
+        字幕地址带一次性的 auth_key，只有对应的正文仍在缓存中时才可以不重新查询；
+        正文已过期或被淘汰时，旧地址多半已经失效（CDN 返回 403），按未命中处理。
+        :return: 字幕地址；确认没有字幕时返回 None；未命中或已过期返回 MISS
+        """
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT subtitle_url, fetched_at FROM subtitle_urls WHERE aid = ? AND cid = ?",
+                                    (aid, cid)).fetchone()
+            if row is None:
+                return MISS
+            subtitle_url, fetched_at = row
+            ttl = self.url_ttl if subtitle_url else self.negative_ttl
+            if now - fetched_at > ttl:
+                return MISS
+            if subtitle_url and not self._has_content(content_key(subtitle_url), now):
+                return MISS
+            self.conn.execute("UPDATE subtitle_urls SET accessed_at = ? WHERE aid = ? AND cid = ?", (now, aid, cid))
+            self.conn.commit()
+            return subtitle_url
+
+    def _has_content(self, key: str, now: float) -> bool:
+        row = self.conn.execute("SELECT s.fetched_at FROM subtitle_bodies s JOIN blobs b "
+                                "ON b.content_hash = s.content_hash WHERE s.url_key = ?", (key,)).fetchone()
+        return row is not None and now - row[0] <= self.body_ttl
+
+    def put_subtitle_url(self, aid: int, cid: int, subtitle_url: Optional[str]):
+        """缓存字幕地址，subtitle_url 为 None 表示该视频没有字幕"""
+        now = time.time()
+        with self._lock:
+            exists = self.conn.execute("SELECT 1 FROM subtitle_urls WHERE aid = ? AND cid = ?",
+                                       (aid, cid)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO subtitle_urls VALUES (?, ?, ?, ?, ?)",
+                              (aid, cid, subtitle_url, now, now))
+            if exists is None:
+                self._url_count += 1
+            self._evict_urls()
+            self.conn.commit()
+
+    def get_content(self, subtitle_url: str) -> Optional[str]:
+        """:return: 缓存的字幕正文，未命中或已过期返回 None"""
+        now = time.time()
+        key = content_key(subtitle_url)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT b.content_hash, s.fetched_at, b.content FROM subtitle_bodies s "
+                "JOIN blobs b ON b.content_hash = s.content_hash WHERE s.url_key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.body_ttl:
+                return None
+            self.conn.execute("UPDATE subtitle_bodies SET accessed_at = ? WHERE url_key = ?", (now, key))
+            self.conn.execute("UPDATE blobs SET accessed_at = ? WHERE content_hash = ?", (now, row[0]))
+            self.conn.commit()
+            return row[2]
+
+    def put_content(self, subtitle_url: str, content: str):
+        now = time.time()
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        size = len(content.encode('utf-8'))
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO subtitle_bodies VALUES (?, ?, ?, ?)",
+                              (content_key(subtitle_url), content_hash, now, now))
+            exists = self.conn.execute("SELECT 1 FROM blobs WHERE content_hash = ?", (content_hash,)).fetchone()
+            self.conn.execute(
+                "INSERT INTO blobs VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (content_hash) DO UPDATE SET accessed_at = excluded.accessed_at",
+                (content_hash, content, size, now))
+            if exists is None:
+                self._blob_bytes += size
+            self._evict_blobs()
+            self.conn.commit()
+
+    def _evict_urls(self):
+        if self._url_count <= self.max_urls:
+            return
+        deleted = self.conn.execute(
+            "DELETE FROM subtitle_urls WHERE rowid IN "
+            "(SELECT rowid FROM subtitle_urls ORDER BY accessed_at LIMIT ?)", (self._url_count - self.max_urls,))
+        self._url_count -= deleted.rowcount
+
+    def _evict_blobs(self):
+        if self._blob_bytes <= self.max_bytes:
+            return
+        # 按访问时间顺序逐行读取（有索引），够数即停，不扫描整张表
+        evicted = []
+        for content_hash, size in self.conn.execute("SELECT content_hash, size FROM blobs ORDER BY accessed_at"):
+            if self._blob_bytes <= self.max_bytes:
+                break
+            evicted.append((content_hash,))
+            self._blob_bytes -= size
+        self.conn.executemany("DELETE FROM blobs WHERE content_hash = ?", evicted)
+        self.conn.executemany("DELETE FROM subtitle_bodies WHERE content_hash = ?", evicted)
+
+    def purge_expired(self):
+        """删除所有过期条目"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("DELETE FROM subtitle_urls WHERE subtitle_url IS NOT NULL AND fetched_at < ?",
+                              (now - self.url_ttl,))
+            self.conn.execute("DELETE FROM subtitle_urls WHERE subtitle_url IS NULL AND fetched_at < ?",
+                              (now - self.negative_ttl,))
+            self.conn.execute("DELETE FROM subtitle_bodies WHERE fetched_at < ?", (now - self.body_ttl,))
+            self.conn.execute("DELETE FROM blobs WHERE content_hash NOT IN (SELECT content_hash FROM subtitle_bodies)")
+            self.conn.commit()
+            self._recount()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+_cache: Optional[SubtitleCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> SubtitleCache:
+    """获取进程内共享的字幕缓存，首次调用时打开数据库"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SubtitleCache()
+    return _cache
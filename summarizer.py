@@ -0,0 +1,189 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Optional
+
+from config import (SUMMARY_MODEL, SUMMARY_CHUNK_TOKENS, SUMMARY_CONCURRENCY, SUMMARY_CACHE_PATH,
+                    OPENAI_BASE_URL, OPENAI_API_KEY)
+from logger_setup import logger
+from text_stream import CJK_CHARS
+
+MAP_PROMPT = "Summarize the following part of a video transcript. Keep key facts, names and numbers."
+REDUCE_PROMPT = "Combine the following partial summaries of one video into a single coherent summary."
+SINGLE_PROMPT = "Summarize the following video content."
+
+# 句子边界：中英文句末标点或换行
+_SENTENCE_END = re.compile(r'(?<=[。！？!?.;；\n])\s*')
+
+
+class ChatClient:
+    """LLM 接口抽象，测试或基准时可替换为本地桩服务或假实现"""
+
+    model = ""
+
+    def complete(self, system: str, user: str) -> str:
+        raise NotImplementedError
+
+
+class OpenAIChatClient(ChatClient):
+    """OpenAI 兼容的 Chat Completions 接口，base_url 可指向任意兼容服务（包括本地桩服务）"""
+
+    def __init__(self, model: str = SUMMARY_MODEL, base_url: Optional[str] = OPENAI_BASE_URL,
+                 api_key: Optional[str] = OPENAI_API_KEY):
+        from openai import OpenAI
+
+        self.model = model
+        self._client = OpenAI(base_url=base_url, api_key=api_key)
+
+    def complete(self, system: str, user: str) -> str:
+        response = self._client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": user}
+            ]
+        )
+        return response.choices[0].message.content
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except ImportError:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """估算 token 数：安装了 tiktoken 时精确计算，否则中日韩字符按 1 个、其他按 4 个字符 1 个估算"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = len(CJK_CHARS.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s for s in _SENTENCE_END.split(text) if s]
+
+
+def chunk_text(text: str, max_tokens: int = SUMMARY_CHUNK_TOKENS) -> List[str]:
+    """按句子切分文本，每块不超过 max_tokens；单句超长时按字符硬切"""
+    chunks, current, current_tokens = [], [], 0
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence)
+        if tokens > max_tokens:
+            step = max(1, len(sentence) * max_tokens // tokens)
+            pieces = [sentence[i:i + step] for i in range(0, len(sentence), step)]
+        else:
+            pieces = [sentence]
+        for piece in pieces:
+            piece_tokens = count_tokens(piece) if len(pieces) > 1 else tokens
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """截取不超过 max_tokens 的开头（按句子，单句超长时按字符硬切）"""
+    chunks = chunk_text(text, max_tokens)
+    return chunks[0] if chunks else ''
+
+
+class SummaryCache:
+    """按 (模型, 提示词, 输入块) 的哈希缓存摘要结果，重试时跳过已完成的块"""
+
+    def __init__(self, path: str = SUMMARY_CACHE_PATH):
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS summaries
+                             (key TEXT PRIMARY KEY, summary TEXT, created_at REAL)''')
+        self.conn.commit()
+
+    @staticmethod
+    def key(model: str, prompt: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}\0{text}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, summary: str):
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)", (key, summary, time.time()))
+            self.conn.commit()
+
+
+class Summarizer:
+    """
+    Map-Reduce 摘要：长文本按 token 切块后并发摘要（map），再把部分摘要合并（reduce）；
+    部分摘要仍然过长时递归地继续合并。
+    """
+
+    def __init__(self, client: Optional[ChatClient] = None, cache: Optional[SummaryCache] = None,
+                 max_tokens: int = SUMMARY_CHUNK_TOKENS, concurrency: int = SUMMARY_CONCURRENCY):
+        self.client = client or OpenAIChatClient()
+        self.cache = cache
+        self.max_tokens = max_tokens
+        self.concurrency = concurrency
+
+    def _complete(self, prompt: str, text: str) -> str:
+        key = SummaryCache.key(self.client.model, prompt, text)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        summary = self.client.complete(prompt, text)
+        if self.cache is not None:
+            self.cache.put(key, summary)
+        return summary
+
+    def _map(self, prompt: str, chunks: List[str]) -> List[str]:
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(chunks))) as executor:
+            return list(executor.map(lambda chunk: self._complete(prompt, chunk), chunks))
+
+    def summarize(self, text: str) -> str:
+        chunks = chunk_text(text, self.max_tokens)
+        if len(chunks) <= 1:
+            return self._complete(SINGLE_PROMPT, text)
+        logger.info("Summarizing %d chunks with concurrency %d", len(chunks), self.concurrency)
+        partials = self._map(MAP_PROMPT, chunks)
+        # 部分摘要合起来仍超长时，按预算分组继续合并，每次请求都不超过 max_tokens，直到能放进一次请求
+        tokens = count_tokens("\n\n".join(partials))
+        while tokens > self.max_tokens:
+            reduced = self._map(REDUCE_PROMPT, chunk_text("\n\n".join(partials), self.max_tokens))
+            reduced_tokens = count_tokens("\n\n".join(reduced))
+            if reduced_tokens >= tokens:
+                # 模型输出不比输入短，合并不会收敛：把每份截到半个预算，下一轮每组至少容纳两份，份数随之减半
+                logger.warning("Reduce round did not shrink %d tokens of partial summaries, truncating each of %d "
+                               "to %d tokens", tokens, len(reduced), self.max_tokens // 2)
+                reduced = [truncate_tokens(partial, self.max_tokens // 2) for partial in reduced]
+                reduced_tokens = count_tokens("\n\n".join(reduced))
+            partials, tokens = reduced, reduced_tokens
+        return self._complete(REDUCE_PROMPT, "\n\n".join(partials))
+
+
+_summarizer: Optional[Summarizer] = None
+_summarizer_lock = threading.Lock()
+
+
+def get_summarizer() -> Summarizer:
+    """获取进程内共享的 Summarizer（默认 OpenAI 兼容接口 + 本地缓存）"""
+    global _summarizer
+    if _summarizer is None:
+        with _summarizer_lock:
+            if _summarizer is None:
+                _summarizer = Summarizer(cache=SummaryCache())
+    return _summarizer
@@ -0,0 +1,52 @@
+import json
+import os
+import threading
+from typing import Any, Iterable, Optional
+
+from config import SYNC_STATE_PATH
+
+
+class SyncState:
+    """
+    增量同步的游标存储，所有游标以 {name: value} 的形式保存在一个 JSON 文件中。
+    写入时先写临时文件再 rename，避免中途崩溃留下损坏的状态文件。
+    """
+
+    def __init__(self, path: str = SYNC_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = self._load()
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, name: str, default: Optional[Any] = None) -> Any:
+        return self._data.get(name, default)
+
+    def set(self, name: str, value: Any):
+        """更新游标并立即持久化"""
+        with self._lock:
+            self._data[name] = value
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+def cursor_before_failures(since: Optional[int], newest: int, failed: Iterable[int]) -> Optional[int]:
+    """
+    遍历完成后可以安全推进到的高水位：不越过最早一条处理失败的记录（取它的时间戳减一），
+    下次同步会从失败的记录重新开始；成功写出的较新记录会再过一遍，写文件时按已存在跳过。
+    :param failed: 处理失败的记录的时间戳
+    :return: 新游标，不比 since 新时返回 None（不推进）
+    """
+    cursor = min([newest, *(value - 1 for value in failed)])
+    return cursor if cursor > (since or 0) else None
@@ -0,0 +1,275 @@
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import YOUTUBE_DB_PATH, TASK_LEASE_SECONDS, TASK_MAX_RECOVERIES
+from text_stream import hash_file
+
+# 终止状态之外的任务都是"活跃"任务；查询时带上同样的条件，SQLite 才会使用部分索引
+ACTIVE_FILTER = "status NOT IN ('FAILED', 'DONE')"
+
+# 版本化的 schema 迁移：(版本号, SQL)，已执行到的版本记录在 PRAGMA user_version 中
+MIGRATIONS: List[Tuple[int, str]] = [
+    (1, '''CREATE TABLE IF NOT EXISTS DownloadTasks
+           (id INTEGER PRIMARY KEY AUTOINCREMENT,
+            youtube_url TEXT,
+            title TEXT,
+            status TEXT,
+            video_path TEXT,
+            audio_path TEXT,
+            srt_path TEXT,
+            summary TEXT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP)'''),
+    (2, f'''CREATE INDEX IF NOT EXISTS idx_tasks_active
+            ON DownloadTasks (status, id) WHERE {ACTIVE_FILTER}'''),
+    # 租约：认领任务的调度器标识与到期时间（time.time()）；recoveries 为任务因租约过期被回收的次数
+    (3, "ALTER TABLE DownloadTasks ADD COLUMN lease_owner TEXT"),
+    (4, "ALTER TABLE DownloadTasks ADD COLUMN lease_expires_at REAL"),
+    (5, "ALTER TABLE DownloadTasks ADD COLUMN recoveries INTEGER NOT NULL DEFAULT 0"),
+    # 各阶段完成时的产物校验信息：文件产物记录路径、大小和 sha256，文本产物（摘要）只记录哈希
+    (6, '''CREATE TABLE IF NOT EXISTS TaskCheckpoints
+           (task_id INTEGER,
+            stage TEXT,
+            artifact_path TEXT,
+            artifact_size INTEGER,
+            artifact_hash TEXT,
+            completed_at TIMESTAMP,
+            PRIMARY KEY (task_id, stage))'''),
+]
+
+# 允许通过 update_task 修改的字段
+TASK_FIELDS = ('youtube_url', 'title', 'status', 'video_path', 'audio_path', 'srt_path', 'summary')
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # WAL 下 NORMAL 只在 checkpoint 时 fsync，单次提交不再落盘等待
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """执行尚未执行的迁移，返回当前 schema 版本"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target, sql in MIGRATIONS:
+        if target <= version:
+            continue
+        with conn:
+            conn.execute(sql)
+            conn.execute(f"PRAGMA user_version = {target}")
+        version = target
+    return version
+
+
+def connect(db_path: str = YOUTUBE_DB_PATH) -> sqlite3.Connection:
+    """
+    打开任务库：开启 WAL 与调优后的 pragma，并执行 schema 迁移。
+    sqlite3 模块会按 SQL 文本缓存预编译语句，本模块的 SQL 都是固定文本，因此会被复用。
+    """
+    conn = sqlite3.connect(db_path, timeout=30, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    migrate(conn)
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection, immediate: bool = False):
+    """
+    在一个事务中执行多次状态变更，只提交一次。
+    :param immediate: 为 True 时开始事务就拿写锁，用于"先查后改"需要原子性的场景
+    """
+    if immediate:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _update_sql(fields: Iterable[str]) -> str:
+    fields = list(fields)
+    unknown = set(fields) - set(TASK_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown task fields: {sorted(unknown)}")
+    assignments = ", ".join(f"{field} = ?" for field in fields)
+    return f"UPDATE DownloadTasks SET {assignments}, updated_at = ? WHERE id = ?"
+
+
+def create_task(conn: sqlite3.Connection, youtube_url: str) -> int:
+    now = datetime.now()
+    with transaction(conn):
+        c = conn.execute("INSERT INTO DownloadTasks (youtube_url, status, created_at, updated_at) "
+                         "VALUES (?, ?, ?, ?)", (youtube_url, 'PENDING', now, now))
+    return c.lastrowid
+
+
+def create_tasks(conn: sqlite3.Connection, youtube_urls: Iterable[str]) -> int:
+    """批量导入任务，一个事务内完成，返回导入的条数"""
+    now = datetime.now()
+    rows = [(url.strip(), 'PENDING', now, now) for url in youtube_urls if url.strip()]
+    with transaction(conn):
+        conn.executemany("INSERT INTO DownloadTasks (youtube_url, status, created_at, updated_at) "
+                         "VALUES (?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+def get_task(conn: sqlite3.Connection, task_id: int) -> Optional[sqlite3.Row]:
+    return conn.execute("SELECT * FROM DownloadTasks WHERE id = ?", (task_id,)).fetchone()
+
+
+def update_task(conn: sqlite3.Connection, task_id: int, **fields):
+    """在一个事务中更新任务的若干字段（如 status、video_path），同时刷新 updated_at"""
+    with transaction(conn):
+        conn.execute(_update_sql(fields), (*fields.values(), datetime.now(), task_id))
+
+
+def mark_failed(conn: sqlite3.Connection, task_id: int):
+    update_task(conn, task_id, status='FAILED')
+
+
+def claim_tasks(conn: sqlite3.Connection, ready_status: str, claimed_status: str, limit: int = 1,
+                owner: Optional[str] = None, lease_seconds: float = TASK_LEASE_SECONDS) -> List[int]:
+    """
+    原子地认领至多 limit 个处于 ready_status 的任务，把状态改为 claimed_status，并写入租约。
+    BEGIN IMMEDIATE 在查询前就拿到写锁，多个进程共享任务库时不会认领到同一个任务。
+    """
+    if limit <= 0:
+        return []
+    with transaction(conn, immediate=True):
+        rows = conn.execute(f"SELECT id FROM DownloadTasks WHERE status = ? AND {ACTIVE_FILTER} "
+                            f"ORDER BY id LIMIT ?", (ready_status, limit)).fetchall()
+        task_ids = [row[0] for row in rows]
+        now, expires_at = datetime.now(), time.time() + lease_seconds
+        conn.executemany("UPDATE DownloadTasks SET status = ?, lease_owner = ?, lease_expires_at = ?, "
+                         "updated_at = ? WHERE id = ?",
+                         [(claimed_status, owner, expires_at, now, task_id) for task_id in task_ids])
+    return task_ids
+
+
+def renew_leases(conn: sqlite3.Connection, task_ids: Iterable[int], owner: Optional[str],
+                 lease_seconds: float = TASK_LEASE_SECONDS):
+    """为仍在处理的任务续约；任务已被其他调度器回收时不会改动"""
+    expires_at = time.time() + lease_seconds
+    with transaction(conn):
+        conn.executemany("UPDATE DownloadTasks SET lease_expires_at = ? WHERE id = ? AND lease_owner IS ?",
+                         [(expires_at, task_id, owner) for task_id in task_ids])
+
+
+def recover_tasks(conn: sqlite3.Connection, claimed_to_ready: Dict[str, str], dead_owners: Iterable[str] = (),
+                  max_recoveries: int = TASK_MAX_RECOVERIES) -> List[int]:
+    """
+    回收卡在处理中状态的任务：租约已过期（或没有租约，如升级前遗留的任务）、或认领者进程已退出时，
+    把状态退回该阶段的 ready 状态，从最后一个完成的阶段继续；回收次数超过 max_recoveries 的标记为失败。
+    :param claimed_to_ready: 各阶段 claimed_status -> ready_status
+    :param dead_owners: 已确认退出的调度器标识，其任务不必等租约过期
+    :return: 退回重试的任务 id
+    """
+    dead_owners = list(dead_owners)
+    owner_filter = f" OR lease_owner IN ({', '.join('?' * len(dead_owners))})" if dead_owners else ""
+    recovered = []
+    with transaction(conn, immediate=True):
+        now = datetime.now()
+        for claimed_status, ready_status in claimed_to_ready.items():
+            rows = conn.execute(f"SELECT id, recoveries FROM DownloadTasks WHERE status = ? AND "
+                                f"(lease_expires_at IS NULL OR lease_expires_at < ?{owner_filter})",
+                                (claimed_status, time.time(), *dead_owners)).fetchall()
+            for task_id, recoveries in rows:
+                status = ready_status if recoveries < max_recoveries else 'FAILED'
+                conn.execute("UPDATE DownloadTasks SET status = ?, lease_owner = NULL, lease_expires_at = NULL, "
+                             "recoveries = recoveries + 1, updated_at = ? WHERE id = ?", (status, now, task_id))
+                if status != 'FAILED':
+                    recovered.append(task_id)
+    return recovered
+
+
+def release_tasks(conn: sqlite3.Connection, task_ids: Iterable[int], claimed_status: str, ready_status: str,
+                  owner: Optional[str], max_recoveries: int = TASK_MAX_RECOVERIES) -> List[int]:
+    """
+    立即退回本调度器认领、但执行它的 worker 已经崩溃（如进程池损坏）的任务，不必等租约过期；
+    与 recover_tasks 一样计入回收次数，超过 max_recoveries 的标记为失败。
+    :return: 退回重试的任务 id
+    """
+    released = []
+    with transaction(conn, immediate=True):
+        now = datetime.now()
+        for task_id in task_ids:
+            row = conn.execute("SELECT recoveries FROM DownloadTasks WHERE id = ? AND status = ? AND lease_owner IS ?",
+                               (task_id, claimed_status, owner)).fetchone()
+            if row is None:
+                continue
+            status = ready_status if row[0] < max_recoveries else 'FAILED'
+            conn.execute("UPDATE DownloadTasks SET status = ?, lease_owner = NULL, lease_expires_at = NULL, "
+                         "recoveries = recoveries + 1, updated_at = ? WHERE id = ?", (status, now, task_id))
+            if status != 'FAILED':
+                released.append(task_id)
+    return released
+
+
+def lease_owners(conn: sqlite3.Connection) -> List[str]:
+    """当前持有租约的调度器标识"""
+    rows = conn.execute(f"SELECT DISTINCT lease_owner FROM DownloadTasks "
+                        f"WHERE lease_owner IS NOT NULL AND {ACTIVE_FILTER}").fetchall()
+    return [row[0] for row in rows]
+
+
+def artifact_digest(path: Optional[str] = None, content: Optional[str] = None) -> Tuple[Optional[int], str]:
+    """产物的 (大小, sha256)：文件按内容分块计算，文本按 UTF-8 编码计算"""
+    if path is not None:
+        return os.path.getsize(path), hash_file(path)
+    data = (content or '').encode('utf-8')
+    return len(data), hashlib.sha256(data).hexdigest()
+
+
+def complete_stage(conn: sqlite3.Connection, task_id: int, stage: str, path: Optional[str] = None,
+                   content: Optional[str] = None, **fields):
+    """
+    记录阶段完成：产物的校验信息与任务字段（通常包括推进后的 status）在同一个事务中写入，
+    不会出现状态已推进但没有检查点、或有检查点但状态未推进的情况。
+    """
+    size, digest = artifact_digest(path, content)
+    now = datetime.now()
+    with transaction(conn):
+        conn.execute("INSERT OR REPLACE INTO TaskCheckpoints VALUES (?, ?, ?, ?, ?, ?)",
+                     (task_id, stage, path, size, digest, now))
+        if fields:
+            conn.execute(_update_sql(fields), (*fields.values(), now, task_id))
+
+
+def get_checkpoint(conn: sqlite3.Connection, task_id: int, stage: str) -> Optional[sqlite3.Row]:
+    return conn.execute("SELECT * FROM TaskCheckpoints WHERE task_id = ? AND stage = ?", (task_id, stage)).fetchone()
+
+
+def checkpoint_valid(conn: sqlite3.Connection, task_id: int, stage: str, path: Optional[str] = None,
+                     content: Optional[str] = None) -> bool:
+    """
+    阶段产物是否仍与检查点一致：文件存在且大小、哈希都相同（文本产物比较哈希）。
+    :param path: 期望的产物路径，为 None 时使用检查点中记录的路径
+    """
+    checkpoint = get_checkpoint(conn, task_id, stage)
+    if checkpoint is None:
+        return False
+    if checkpoint['artifact_path'] is not None or path is not None:
+        path = path or checkpoint['artifact_path']
+        if path != checkpoint['artifact_path'] or not os.path.exists(path) \
+                or os.path.getsize(path) != checkpoint['artifact_size']:
+            return False
+    elif content is None:
+        return False
+    return artifact_digest(path, content)[1] == checkpoint['artifact_hash']
+
+
+def find_checkpoint(conn: sqlite3.Connection, task_id: int, path: str) -> Optional[sqlite3.Row]:
+    """按产物路径查找产出该文件的阶段检查点"""
+    return conn.execute("SELECT * FROM TaskCheckpoints WHERE task_id = ? AND artifact_path = ?",
+                        (task_id, path)).fetchone()
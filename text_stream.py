@@ -0,0 +1,242 @@
+import codecs
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+# 流式读写的块大小（字节）
+CHUNK_SIZE = 1024 * 1024
+_WHITESPACE = ' \t\r\n'
+# 中日韩字符与全角符号：摘要估算 token 数、合集统计词数时每个字符单独计数
+CJK_CHARS = re.compile(r'[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+
+class SubtitleStreamParser:
+    """
+    增量解析 B 站字幕 JSON：按块 feed 原始字节，body 数组中每解析完一条字幕就交出，
+    内存中只保留尚未解析完的部分，不需要先拿到完整响应体再 json.loads 成整棵对象树。
+    """
+
+    def __init__(self, key: str = 'body'):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._marker = f'"{key}"'
+        self._buf = ''
+        # seek: 寻找 "body": [；items: 逐条解析；done: 数组结束或没有 body
+        self._state = 'seek'
+
+    def feed(self, data: bytes) -> List[Dict]:
+        if self._state == 'done':
+            return []
+        self._buf += self._decoder.decode(data)
+        return self._drain()
+
+    def close(self) -> List[Dict]:
+        self._buf += self._decoder.decode(b'', final=True)
+        items = self._drain()
+        if self._state == 'items':
+            raise ValueError("Subtitle JSON ended before the body array was closed")
+        return items
+
+    def _seek(self, buf: str) -> int:
+        """定位 body 数组的起始位置，数据不足时返回 -1"""
+        index = buf.find(self._marker)
+        if index < 0:
+            # 键名可能被块边界截断，保留末尾一小段
+            self._buf = buf[-len(self._marker):]
+            return -1
+        pos = index + len(self._marker)
+        for expected in (':', '['):
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos >= len(buf):
+                self._buf = buf[index:]
+                return -1
+            if buf[pos] != expected:
+                # body 为 null 或不是数组
+                self._state = 'done'
+                self._buf = ''
+                return -1
+            pos += 1
+        self._state = 'items'
+        return pos
+
+    def _drain(self) -> List[Dict]:
+        items = []
+        buf, pos = self._buf, 0
+        if self._state == 'seek':
+            pos = self._seek(buf)
+            if pos < 0:
+                return items
+        while self._state == 'items':
+            while pos < len(buf) and (buf[pos] in _WHITESPACE or buf[pos] == ','):
+                pos += 1
+            if pos >= len(buf):
+                break
+            if buf[pos] == ']':
+                self._state = 'done'
+                break
+            try:
+                item, pos = self._json.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # 这一条还没收全，等待下一块
+            items.append(item)
+        self._buf = buf[pos:] if self._state == 'items' else ''
+        return items
+
+
+def iter_subtitle_segments(chunks: Iterable[bytes]) -> Iterator[Dict]:
+    """从原始字节块流中逐条产出字幕片段 {'from', 'to', 'content'}"""
+    parser = SubtitleStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def iter_subtitle_text(segments: Iterable[Dict], separator: str = " ") -> Iterator[str]:
+    """字幕片段 -> 纯文本块，与 api.parse_subtitle_content 的拼接结果一致"""
+    first = True
+    for segment in segments:
+        yield segment.get("content", "") if first else separator + segment.get("content", "")
+        first = False
+
+
+def format_srt_time(seconds: float) -> str:
+    ms = int((seconds % 1) * 1000)
+    seconds = int(seconds)
+    h, m, s = seconds // 3600, (seconds // 60) % 60, seconds % 60
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def iter_srt(segments: Iterable[Dict]) -> Iterator[str]:
+    """whisper 片段 {'start', 'end', 'text'} -> 逐条 SRT 文本块"""
+    for i, segment in enumerate(segments):
+        block = f"{i + 1}\n{format_srt_time(segment['start'])} --> {format_srt_time(segment['end'])}\n" \
+                f"{segment['text']}\n"
+        yield block if i == 0 else "\n" + block
+
+
+def parse_srt_time(value: str) -> float:
+    """"HH:MM:SS,mmm"（也接受 "." 作为毫秒分隔符）-> 秒"""
+    hms, _, ms = value.strip().replace('.', ',').partition(',')
+    h, m, s = (int(part) for part in hms.split(':'))
+    return h * 3600 + m * 60 + s + int(ms or 0) / 1000
+
+
+def iter_srt_segments(lines: Iterable[str]) -> Iterator[Dict]:
+    """逐行解析 SRT，产出 {'start', 'end', 'text'}；多行字幕以空格连接"""
+    segment, block_start = None, True
+    for line in lines:
+        line = line.strip()
+        if not line:
+            block_start = True
+            continue
+        if '-->' in line:
+            if segment is not None and segment['text']:
+                yield segment
+            start, _, end = line.partition('-->')
+            try:
+                segment = {'start': parse_srt_time(start), 'end': parse_srt_time(end.split()[0]), 'text': ''}
+            except (ValueError, IndexError):
+                segment = None
+        elif block_start and line.isdigit():
+            pass  # 序号行
+        elif segment is not None:
+            segment['text'] = f"{segment['text']} {line}" if segment['text'] else line
+        block_start = False
+    if segment is not None and segment['text']:
+        yield segment
+
+
+def iter_passages(chunks: Iterable[str], max_chars: int) -> Iterator[str]:
+    """把没有时间轴的文本流切成不超过 max_chars 的段落，尽量在空白或句号处断开"""
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= max_chars:
+            cut = max(buf.rfind(sep, 0, max_chars) for sep in (' ', '\n', '。'))
+            cut = cut + 1 if cut > 0 else max_chars
+            passage = buf[:cut].strip()
+            if passage:
+                yield passage
+            buf = buf[cut:]
+    passage = buf.strip()
+    if passage:
+        yield passage
+
+
+@contextmanager
+def atomic_open(path: str, mode: str = 'wb', encoding: Optional[str] = None):
+    """
+    先写同目录下的临时文件，写完并 fsync 后 rename 到目标路径。
+    中途出错或进程崩溃时目标路径上不会出现半截文件，"文件存在"即可视为写入完整。
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_chunks(path: str, chunks: Iterable[str]) -> int:
+    """把文本块依次写入文件（原子替换），返回写入的字节数"""
+    written = 0
+    with atomic_open(path) as f:
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            f.write(data)
+            written += len(data)
+    return written
+
+
+@contextmanager
+def mapped_file(path: str):
+    """只读映射文件内容，由操作系统按需换入页面；空文件无法 mmap，返回空 bytes"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def hash_file(path: str, algorithm: str = 'sha256', chunk_size: int = CHUNK_SIZE) -> str:
+    """分块计算文件摘要；通过 mmap 读取，不经过 Python 层的读缓冲"""
+    h = hashlib.new(algorithm)
+    with mapped_file(path) as buffer:
+        view = memoryview(buffer)
+        try:
+            for offset in range(0, len(view), chunk_size):
+                h.update(view[offset:offset + chunk_size])
+        finally:
+            view.release()
+    return h.hexdigest()
+
+
+def iter_decoded(buffer: Union[bytes, mmap.mmap], end: int = None, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """把字节缓冲区（如 mmap）的前 end 个字节按块解码为文本，多字节字符跨块时由增量解码器拼接"""
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    end = len(buffer) if end is None else end
+    for offset in range(0, end, chunk_size):
+        text = decoder.decode(buffer[offset:min(offset + chunk_size, end)])
+        if text:
+            yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def iter_text_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """按块读取已有的文字稿，内存占用与文件大小无关"""
+    with mapped_file(path) as buffer:
+        yield from iter_decoded(buffer, chunk_size=chunk_size)
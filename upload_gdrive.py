@@ -1,13 +1,25 @@
+import json
 import os
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config import UPLOAD_WORKERS, UPLOAD_RESUMABLE_THRESHOLD, UPLOAD_JOURNAL_PATH
+from metrics import metrics
+from text_stream import hash_file
+
+SCOPES = ['https://www.googleapis.com/auth/drive.file']
+# 可续传上传的分块大小（必须是 256KB 的整数倍）
+RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024
 
 
 # 认证并建立服务
 def authenticate_gdrive():
-    SCOPES = ['https://www.googleapis.com/auth/drive.file']
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
@@ -24,35 +36,181 @@ def authenticate_gdrive():
     return service
 
 
-# 上传文件
-def upload_file_to_gdrive(service, file_path, folder_id):
+# 上传文件：小文件用一次性 multipart 上传，大文件用可续传上传
+def upload_file_to_gdrive(service, file_path, folder_id, resumable=None):
+    from googleapiclient.http import MediaFileUpload
+
+    if resumable is None:
+        resumable = os.path.getsize(file_path) > UPLOAD_RESUMABLE_THRESHOLD
     file_metadata = {
         'name': os.path.basename(file_path),
         'parents': [folder_id]  # 指定目标文件夹的ID
     }
-    media = MediaFileUpload(file_path, resumable=True)
-    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    if resumable:
+        media = MediaFileUpload(file_path, resumable=True, chunksize=RESUMABLE_CHUNK_SIZE)
+        request = service.files().create(body=file_metadata, media_body=media, fields='id')
+        file = None
+        while file is None:
+            _, file = request.next_chunk()
+    else:
+        media = MediaFileUpload(file_path, resumable=False)
+        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
     print(f'File ID: {file["id"]} uploaded successfully.')
+    return file["id"]
 
 
-# 批量上传文件
-def upload_files_from_txt(txt_file, folder_id):
-    service = authenticate_gdrive()
+def file_md5(path, chunk_size=1024 * 1024):
+    """分块计算本地文件的 MD5，与 Drive 的 md5Checksum 比较"""
+    return hash_file(path, 'md5', chunk_size)
+
+
+class DriveBackend:
+    """Drive API 抽象，测试时可注入本地假实现"""
+
+    def list_folder(self, folder_id: str) -> List[Dict]:
+        """返回文件夹下的文件：[{'id', 'name', 'md5Checksum'}]"""
+        raise NotImplementedError
+
+    def upload(self, file_path: str, folder_id: str, resumable: bool) -> str:
+        """上传文件，返回文件 ID"""
+        raise NotImplementedError
+
+
+class GoogleDriveBackend(DriveBackend):
+    """
+    基于 google-api-python-client 的实现。
+    底层 httplib2 连接不是线程安全的，因此每个线程各自建立一个 service。
+    """
+
+    def __init__(self, service_factory=authenticate_gdrive):
+        self.service_factory = service_factory
+        self._local = threading.local()
+        self._auth_lock = threading.Lock()
+
+    @property
+    def service(self):
+        if not hasattr(self._local, 'service'):
+            # 首次授权可能需要打开浏览器写 token.json，串行执行
+            with self._auth_lock:
+                self._local.service = self.service_factory()
+        return self._local.service
+
+    def list_folder(self, folder_id: str) -> List[Dict]:
+        # 一次分页列出整个文件夹（每页 1000 条），代替逐个文件查询
+        files, page_token = [], None
+        while True:
+            response = self.service.files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                fields='nextPageToken, files(id, name, md5Checksum)',
+                pageSize=1000, pageToken=page_token).execute()
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def upload(self, file_path: str, folder_id: str, resumable: bool) -> str:
+        return upload_file_to_gdrive(self.service, file_path, folder_id, resumable=resumable)
+
+
+class UploadJournal:
+    """
+    上传日志（JSON Lines），每上传完一个文件追加一行；
+    批次中断后重新运行时，日志里已有的 (文件夹, MD5) 直接跳过。
+    """
 
+    def __init__(self, path: str = UPLOAD_JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 中断时可能留下半行
+                    self.entries[(entry['folder_id'], entry['md5'])] = entry
+
+    def done(self, folder_id: str, md5: str) -> bool:
+        return (folder_id, md5) in self.entries
+
+    def record(self, folder_id: str, md5: str, file_path: str, file_id: str):
+        entry = {'folder_id': folder_id, 'md5': md5, 'path': file_path, 'file_id': file_id}
+        with self._lock:
+            self.entries[(folder_id, md5)] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def upload_files(file_paths: List[str], folder_id: str, backend: Optional[DriveBackend] = None,
+                 journal: Optional[UploadJournal] = None, workers: int = UPLOAD_WORKERS) -> Dict[str, int]:
+    """
+    并发上传一批文件：先列出目标文件夹一次，跳过 MD5 已存在的文件和日志中已完成的文件，
+    批次内内容相同的文件只上传一份。
+    :return: 统计信息
+    """
+    backend = backend or GoogleDriveBackend()
+    journal = journal or UploadJournal()
+    remote_md5 = {f.get('md5Checksum') for f in backend.list_folder(folder_id) if f.get('md5Checksum')}
+    stats = {'uploaded': 0, 'skipped': 0, 'missing': 0, 'failed': 0}
+
+    pending, seen = [], set()
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            print(f"File not found: {file_path}")
+            stats['missing'] += 1
+            continue
+        md5 = file_md5(file_path)
+        if md5 in remote_md5 or md5 in seen or journal.done(folder_id, md5):
+            stats['skipped'] += 1
+            metrics.event('upload', 'skipped')
+            continue
+        seen.add(md5)
+        pending.append((file_path, md5))
+
+    def upload(item):
+        file_path, md5 = item
+        with metrics.stage('upload', path=os.path.basename(file_path)) as timer:
+            try:
+                size = os.path.getsize(file_path)
+                file_id = backend.upload(file_path, folder_id, size > UPLOAD_RESUMABLE_THRESHOLD)
+                journal.record(folder_id, md5, file_path, file_id)
+                timer.add_bytes(size)
+                return True
+            except Exception as e:
+                timer.fail(e)
+                print(f"Upload failed: {file_path} - {e}")
+                return False
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for ok in executor.map(upload, pending):
+            stats['uploaded' if ok else 'failed'] += 1
+    print(f"Uploaded {stats['uploaded']}, skipped {stats['skipped']}, "
+          f"missing {stats['missing']}, failed {stats['failed']}.")
+    return stats
+
+
+# 批量上传文件
+def upload_files_from_txt(txt_file, folder_id, backend=None, workers=UPLOAD_WORKERS):
     with open(txt_file, 'r') as file:
         file_paths = file.readlines()
 
     # 清除换行符并上传文件
-    for file_path in file_paths:
-        file_path = file_path.strip()  # 去除每行的换行符
-        if os.path.exists(file_path):
-            upload_file_to_gdrive(service, file_path, folder_id)
-        else:
-            print(f"File not found: {file_path}")
+    file_paths = [file_path.strip() for file_path in file_paths if file_path.strip()]
+    return upload_files(file_paths, folder_id, backend=backend, workers=workers)
+
 
+if __name__ == "__main__":
+    import argparse
 
-# 用户输入txt文件路径和Google Drive文件夹ID
-txt_file = 'files.txt'  # 存放文件路径的txt文件
-folder_id = 'your-folder-id-here'  # 替换为Google Drive目标文件夹的ID
+    parser = argparse.ArgumentParser(description="批量上传文件到 Google Drive")
+    # 用户输入txt文件路径和Google Drive文件夹ID
+    parser.add_argument("--list", default='files.txt', help="存放文件路径的txt文件")
+    parser.add_argument("--folder-id", default='your-folder-id-here', help="Google Drive目标文件夹的ID")
+    parser.add_argument("--workers", type=int, default=UPLOAD_WORKERS)
+    args = parser.parse_args()
 
-upload_files_from_txt(txt_file, folder_id)
+    upload_files_from_txt(args.list, args.folder_id, workers=args.workers)
+    metrics.export()
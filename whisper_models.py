@@ -0,0 +1,76 @@
+import gc
+import threading
+import time
+from typing import Dict, Iterable, Tuple
+
+from config import WHISPER_MODEL, WHISPER_IDLE_TIMEOUT
+from logger_setup import logger
+
+# 进程内已加载的模型：{模型名: (模型, 最近使用时间)}
+_models: Dict[str, Tuple[object, float]] = {}
+_lock = threading.Lock()
+_reaper_started = False
+
+
+def get_model(name: str = WHISPER_MODEL):
+    """获取 whisper 模型，每个进程内每种模型只加载一次"""
+    with _lock:
+        entry = _models.get(name)
+        if entry is None:
+            import whisper
+
+            started = time.monotonic()
+            model = whisper.load_model(name)
+            logger.info("Loaded whisper model '%s' in %.1fs", name, time.monotonic() - started)
+        else:
+            model = entry[0]
+        _models[name] = (model, time.monotonic())
+        return model
+
+
+def preload(names: Iterable[str] = (WHISPER_MODEL,)):
+    """预先加载模型，避免第一个任务承担加载耗时"""
+    for name in names:
+        get_model(name)
+
+
+def release_idle(idle_timeout: float = WHISPER_IDLE_TIMEOUT) -> int:
+    """释放超过 idle_timeout 秒未使用的模型，返回释放的个数"""
+    now = time.monotonic()
+    with _lock:
+        idle = [name for name, (_, last_used) in _models.items() if now - last_used > idle_timeout]
+        for name in idle:
+            del _models[name]
+            logger.info("Released idle whisper model '%s'", name)
+    if idle:
+        gc.collect()
+        try:
+            import torch
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+    return len(idle)
+
+
+def start_idle_reaper(idle_timeout: float = WHISPER_IDLE_TIMEOUT, interval: float = 60):
+    """启动后台线程，定期释放空闲模型（每个进程只启动一次）"""
+    global _reaper_started
+    with _lock:
+        if _reaper_started:
+            return
+        _reaper_started = True
+
+    def reap():
+        while True:
+            time.sleep(interval)
+            release_idle(idle_timeout)
+
+    threading.Thread(target=reap, name="whisper-reaper", daemon=True).start()
+
+
+def init_worker(names: Iterable[str] = (WHISPER_MODEL,), idle_timeout: float = WHISPER_IDLE_TIMEOUT):
+    """转写进程池的 initializer：预加载模型并启动空闲回收"""
+    preload(names)
+    start_idle_reaper(idle_timeout, interval=min(60.0, idle_timeout))
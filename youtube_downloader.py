@@ -1,166 +1,392 @@
-import sqlite3
 import os
-import time
-import yt_dlp
-import ffmpeg
-import whisper
-import openai
-from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from config import (YOUTUBE_DB_PATH, DOWNLOAD_WORKERS, FFMPEG_WORKERS, TRANSCRIBE_WORKERS, SUMMARIZE_WORKERS,
+                    SCHEDULER_POLL_INTERVAL, WHISPER_MODEL, WHISPER_PRELOAD, WHISPER_IDLE_TIMEOUT,
+                    CHUNKED_TRANSCRIBE_MIN_SECONDS, YOUTUBE_DOWNLOAD_DIR, YOUTUBE_KEEP_VIDEO, YTDLP_AUDIO_FORMAT,
+                    AUDIO_SAMPLE_RATE, SEARCH_ENABLED)
+from scheduler import Stage, StageScheduler
+from logger_setup import logger
+from metrics import metrics
+from text_stream import format_srt_time as format_time, iter_srt, iter_srt_segments, write_chunks
+import task_store
+import whisper_models
+
+# yt_dlp、ffmpeg、whisper（torch）、numpy 和 openai 都在用到的函数内导入，导入本模块不加载它们
+
+# ffmpeg 可以直接读取的 yt-dlp 协议；DASH 分片等其他协议需要先由 yt-dlp 下载音频流
+STREAMABLE_PROTOCOLS = ('http', 'https', 'm3u8', 'm3u8_native')
+# whisper 内部按 16kHz 单声道处理，提前转好可省去转写时的重采样
+WAV_OUTPUT_ARGS = {'vn': None, 'ac': 1, 'ar': AUDIO_SAMPLE_RATE, 'acodec': 'pcm_s16le', 'format': 'wav'}
+
+
+# 各阶段产物对应的检查点名，以及产物失效时任务退回的状态（即重新执行产出它的阶段）
+STAGE_READY_STATUS = {'download': 'PENDING', 'extract_audio': 'COMPLETED', 'transcribe': 'PROCESSING',
+                      'summarize': 'TRANSCRIBED'}
+# yt-dlp 断点续传：保留 .part 文件，重启后从已下载的位置继续
+YTDLP_RESUME_OPTS = {'continuedl': True, 'nopart': False}
+# 产物按视频 id 命名：同名的不同视频不会互相覆盖，_adopt 沿用的文件一定属于同一个视频（标题存在任务表中）
+YTDLP_OUTTMPL = os.path.join(YOUTUBE_DOWNLOAD_DIR, '%(id)s.%(ext)s')
+
+
+# 打开数据库连接（WAL、调优 pragma 与 schema 迁移由 task_store 负责）
+def connect_db(db_path=YOUTUBE_DB_PATH):
+    return task_store.connect(db_path)
 
 
 # 初始化SQLite数据库
-def init_db():
-    conn = sqlite3.connect('youtube_tasks.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS DownloadTasks
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  youtube_url TEXT,
-                  title TEXT,
-                  status TEXT,
-                  video_path TEXT,
-                  audio_path TEXT,
-                  srt_path TEXT,
-                  summary TEXT,
-                  created_at TIMESTAMP,
-                  updated_at TIMESTAMP)''')
-    conn.commit()
-    return conn
+def init_db(db_path=YOUTUBE_DB_PATH):
+    return connect_db(db_path)
 
 
 # 创建下载任务
 def create_task(conn, youtube_url):
-    c = conn.cursor()
-    now = datetime.now()
-    c.execute("INSERT INTO DownloadTasks (youtube_url, status, created_at, updated_at) VALUES (?, ?, ?, ?)",
-              (youtube_url, 'PENDING', now, now))
-    conn.commit()
-    return c.lastrowid
+    return task_store.create_task(conn, youtube_url)
+
+
+# 批量创建下载任务，一个事务内导入
+def create_tasks(conn, youtube_urls):
+    return task_store.create_tasks(conn, youtube_urls)
+
+
+# 本阶段的产物仍与检查点一致时（如崩溃发生在状态推进之后、下游认领之前）直接推进状态，不重做
+def _resume(conn, task_id, stage, path=None, content=None, **fields):
+    if not task_store.checkpoint_valid(conn, task_id, stage, path=path, content=content):
+        return False
+    logger.info("Task %s: %s already completed, resuming from checkpoint", task_id, stage)
+    task_store.update_task(conn, task_id, **fields)
+    return True
+
+
+# 检查上游产物：有检查点但文件已丢失或被改动时，把任务退回产出它的阶段重新执行
+def _verify_input(conn, task_id, path):
+    checkpoint = task_store.find_checkpoint(conn, task_id, path)
+    if checkpoint is None:
+        if not path or not os.path.exists(path):
+            raise FileNotFoundError(f"Input for task {task_id} is missing: {path}")
+        return True
+    if task_store.checkpoint_valid(conn, task_id, checkpoint['stage']):
+        return True
+    status = STAGE_READY_STATUS[checkpoint['stage']]
+    logger.warning("Task %s: %s no longer matches its checkpoint, back to %s", task_id, path, status)
+    task_store.update_task(conn, task_id, status=status)
+    return False
+
+
+# 目标文件都是原子写入的：路径上已有文件说明上次已完整产出（只是没来得及记录检查点），直接沿用
+def _adopt(task_id, path, source=None):
+    if not os.path.exists(path):
+        return False
+    if source is not None and os.path.getmtime(path) < os.path.getmtime(source):
+        return False
+    logger.info("Task %s: reusing existing %s", task_id, path)
+    return True
 
 
 # 下载YouTube视频
 def download_video(task_id, youtube_url, conn):
-    c = conn.cursor()
-    c.execute("UPDATE DownloadTasks SET status = ?, updated_at = ? WHERE id = ?",
-              ('DOWNLOADING', datetime.now(), task_id))
-    conn.commit()
+    import yt_dlp
+
+    task = task_store.get_task(conn, task_id)
+    if task['video_path'] and _resume(conn, task_id, 'download', path=task['video_path'], status='COMPLETED'):
+        return task['video_path']
+    task_store.update_task(conn, task_id, status='DOWNLOADING')
 
     ydl_opts = {
-        'outtmpl': './downloads/%(title)s.%(ext)s',
+        'outtmpl': YTDLP_OUTTMPL,
         'format': 'bestvideo+bestaudio/best',
+        **YTDLP_RESUME_OPTS,
     }
     try:
+        # 已下载完的文件 yt-dlp 会跳过，只下载了一部分的从 .part 继续
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(youtube_url, download=True)
             video_path = ydl.prepare_filename(info)
             title = info.get('title', 'Unknown Title')
-            c.execute("UPDATE DownloadTasks SET status = ?, title = ?, video_path = ?, updated_at = ? WHERE id = ?",
-                      ('COMPLETED', title, video_path, datetime.now(), task_id))
-            conn.commit()
+            if os.path.exists(video_path):
+                metrics.add_bytes(os.path.getsize(video_path), stage='download')
+            task_store.complete_stage(conn, task_id, 'download', path=video_path,
+                                      status='COMPLETED', title=title, video_path=video_path)
         return video_path
     except Exception as e:
-        c.execute("UPDATE DownloadTasks SET status = ?, updated_at = ? WHERE id = ?",
-                  ('FAILED', datetime.now(), task_id))
-        conn.commit()
+        task_store.mark_failed(conn, task_id)
+        raise e
+
+
+# 用 ffmpeg 把输入（本地文件或流地址）转成 16kHz 单声道 wav，先写临时文件再 rename
+def convert_to_wav(stream, audio_path):
+    import ffmpeg
+
+    tmp_path = f"{audio_path}.tmp"
+    try:
+        stream.output(tmp_path, **WAV_OUTPUT_ARGS).overwrite_output().run(quiet=True)
+    except ffmpeg.Error as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        stderr = (e.stderr or b'').decode('utf-8', 'replace')
+        raise RuntimeError(f"ffmpeg failed: {stderr[-500:]}") from e
+    os.replace(tmp_path, audio_path)
+    return audio_path
+
+
+# 只获取音频：选最小的合适音频流，由 ffmpeg 直接读取流地址转成 wav，磁盘上不落视频文件
+def download_audio(task_id, youtube_url, conn):
+    import ffmpeg
+    import yt_dlp
+
+    task = task_store.get_task(conn, task_id)
+    if task['audio_path'] and _resume(conn, task_id, 'download', path=task['audio_path'], status='PROCESSING'):
+        return task['audio_path']
+    task_store.update_task(conn, task_id, status='DOWNLOADING')
+    os.makedirs(YOUTUBE_DOWNLOAD_DIR, exist_ok=True)
+    ydl_opts = {
+        'outtmpl': YTDLP_OUTTMPL,
+        'format': YTDLP_AUDIO_FORMAT,
+        # 码率和文件大小升序：同样满足格式条件时优先取最小的流
+        'format_sort': ['+abr', '+size'],
+        'noplaylist': True,
+        'quiet': True,
+        **YTDLP_RESUME_OPTS,
+    }
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(youtube_url, download=False)
+            title = info.get('title', 'Unknown Title')
+            audio_path = os.path.splitext(ydl.prepare_filename(info))[0] + '.wav'
+            if _adopt(task_id, audio_path):
+                pass
+            elif info.get('url') and info.get('protocol') in STREAMABLE_PROTOCOLS:
+                headers = ''.join(f"{key}: {value}\r\n" for key, value in (info.get('http_headers') or {}).items())
+                convert_to_wav(ffmpeg.input(info['url'], headers=headers), audio_path)
+            else:
+                # ffmpeg 无法直接读取的协议：让 yt-dlp 下载选中的音频流，转换后删除
+                info = ydl.process_ie_result(info, download=True)
+                stream_path = ydl.prepare_filename(info)
+                try:
+                    convert_to_wav(ffmpeg.input(stream_path), audio_path)
+                finally:
+                    if os.path.exists(stream_path):
+                        os.remove(stream_path)
+        metrics.add_bytes(os.path.getsize(audio_path), stage='download')
+        # 已经是转写可用的音频，跳过提取音频阶段
+        task_store.complete_stage(conn, task_id, 'download', path=audio_path,
+                                  status='PROCESSING', title=title, audio_path=audio_path)
+        return audio_path
+    except Exception as e:
+        task_store.mark_failed(conn, task_id)
         raise e
 
 
-# 提取音频
+# 提取音频（保留视频时使用）
 def extract_audio(task_id, video_path, conn):
-    audio_path = video_path.replace('.mp4', '.mp3')
+    import ffmpeg
+
+    audio_path = os.path.splitext(video_path)[0] + '.wav'
+    if _resume(conn, task_id, 'extract_audio', path=audio_path, status='PROCESSING', audio_path=audio_path):
+        return audio_path
     try:
-        ffmpeg.input(video_path).output(audio_path, vn=True, acodec='copy').run()
-        c = conn.cursor()
-        c.execute("UPDATE DownloadTasks SET audio_path = ?, updated_at = ? WHERE id = ?",
-                  (audio_path, datetime.now(), task_id))
-        conn.commit()
+        if not _verify_input(conn, task_id, video_path):
+            return None
+        if not _adopt(task_id, audio_path, source=video_path):
+            convert_to_wav(ffmpeg.input(video_path), audio_path)
+        metrics.add_bytes(os.path.getsize(audio_path), stage='extract_audio')
+        task_store.complete_stage(conn, task_id, 'extract_audio', path=audio_path,
+                                  status='PROCESSING', audio_path=audio_path)
         return audio_path
     except Exception as e:
-        c = conn.cursor()
-        c.execute("UPDATE DownloadTasks SET status = ?, updated_at = ? WHERE id = ?",
-                  ('FAILED', datetime.now(), task_id))
-        conn.commit()
+        task_store.mark_failed(conn, task_id)
         raise e
 
 
-# 生成字幕
+# 转写一个音频文件，返回 whisper 的结果
+# 调度器已经在转写进程池中按任务并行，这里默认逐块转写，不再嵌套一层进程池
+def transcribe_audio(audio_path, model_name=WHISPER_MODEL, progress=None, chunk_workers=1):
+    import ffmpeg
+
+    duration = float(ffmpeg.probe(audio_path)['format'].get('duration', 0))
+    if duration >= CHUNKED_TRANSCRIBE_MIN_SECONDS:
+        from chunked_transcribe import transcribe_chunked
+
+        # 长音频在静音处分块，逐块写检查点，崩溃后只转写剩下的块
+        return transcribe_chunked(audio_path, model_name, workers=chunk_workers, progress=progress)
+    # 每个 worker 进程只加载一次模型
+    model = whisper_models.get_model(model_name)
+    return model.transcribe(audio_path)
+
+
+# 把转写结果写成与音频同名的 .srt 文件，逐条写入，不在内存中拼出整份字幕
+def write_srt(result, audio_path):
+    srt_path = os.path.splitext(audio_path)[0] + '.srt'
+    write_chunks(srt_path, iter_srt(result['segments']))
+    return srt_path
+
+
+# 生成字幕；上游音频已失效、任务被退回下载阶段时返回 None
 def generate_subtitles(task_id, audio_path, conn):
-    model = whisper.load_model("base")
-    result = model.transcribe(audio_path)
-    srt_content = convert_to_srt(result)  # 假设有此函数将结果转为SRT格式
-    srt_path = audio_path.replace('.mp3', '.srt')
-    with open(srt_path, 'w') as f:
-        f.write(srt_content)
-    c = conn.cursor()
-    c.execute("UPDATE DownloadTasks SET srt_path = ?, updated_at = ? WHERE id = ?",
-              (srt_path, datetime.now(), task_id))
-    conn.commit()
-    return srt_path, result['text']
+    srt_path = os.path.splitext(audio_path)[0] + '.srt'
+    if _resume(conn, task_id, 'transcribe', path=srt_path, status='TRANSCRIBED', srt_path=srt_path):
+        return srt_path, srt_to_text(srt_path)
+    if not _verify_input(conn, task_id, audio_path):
+        return None
+    if _adopt(task_id, srt_path, source=audio_path):
+        segments, text = None, srt_to_text(srt_path)
+    else:
+        result = transcribe_audio(audio_path)
+        srt_path = write_srt(result, audio_path)
+        segments, text = result['segments'], result['text']
+    task_store.complete_stage(conn, task_id, 'transcribe', path=srt_path, status='TRANSCRIBED', srt_path=srt_path)
+    if os.path.isdir(os.path.splitext(audio_path)[0] + '.chunks'):
+        from chunked_transcribe import clear_checkpoints
+
+        clear_checkpoints(audio_path)
+    if SEARCH_ENABLED:
+        import search_index
+
+        # 阶段已记录完成：打开索引、读取字幕或收录失败都只记录警告，不能把任务标记为失败
+        search_index.index_quietly(_index_segments, conn, task_id, srt_path, segments)
+    return srt_path, text
+
+
+def _index_segments(conn, task_id, srt_path, segments=None):
+    import search_index
+
+    if segments is None:
+        with open(srt_path, 'r', encoding='utf-8') as f:
+            segments = list(iter_srt_segments(f))
+    return search_index.get_index().add_task_segments(task_store.get_task(conn, task_id), segments, srt_path)
 
 
 # 生成总结
 def summarize_content(task_id, text, conn):
-    response = openai.ChatCompletion.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "Summarize the following video content."},
-            {"role": "user", "content": text}
-        ]
-    )
-    summary = response.choices[0].message.content
-    c = conn.cursor()
-    c.execute("UPDATE DownloadTasks SET summary = ?, status = ?, updated_at = ? WHERE id = ?",
-              (summary, 'DONE', datetime.now(), task_id))
-    conn.commit()
+    from summarizer import get_summarizer
+
+    task = task_store.get_task(conn, task_id)
+    if task['summary'] and _resume(conn, task_id, 'summarize', content=task['summary'], status='DONE'):
+        return task['summary']
+    # 长文本分块并发摘要后再合并，已完成的块有缓存，重启后不会重复调用模型
+    summary = get_summarizer().summarize(text)
+    task_store.complete_stage(conn, task_id, 'summarize', content=summary, summary=summary, status='DONE')
+    if SEARCH_ENABLED and summary:
+        import search_index
+
+        search_index.index_quietly(lambda: search_index.get_index().add_task_summary(
+            task_store.get_task(conn, task_id), summary))
     return summary
 
 
-# 转换结果为SRT格式（伪代码）
+# 转换结果为SRT格式
 def convert_to_srt(result):
-    srt_lines = []
-    for i, segment in enumerate(result['segments']):
-        start = segment['start']
-        end = segment['end']
-        text = segment['text']
-        srt_lines.append(f"{i + 1}")
-        srt_lines.append(f"{format_time(start)} --> {format_time(end)}")
-        srt_lines.append(f"{text}\n")
-    return "\n".join(srt_lines)
+    return "".join(iter_srt(result['segments']))
+
+
+# 逐行产出SRT文件中的字幕文本
+def iter_srt_text(srt_path):
+    with open(srt_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.isdigit() or '-->' in line:
+                continue
+            yield line
+
 
+# 从SRT文件中取出纯文本，供总结阶段使用
+def srt_to_text(srt_path):
+    return " ".join(iter_srt_text(srt_path))
 
-def format_time(seconds):
-    ms = int((seconds % 1) * 1000)
-    seconds = int(seconds)
-    h, m, s = seconds // 3600, (seconds // 60) % 60, seconds % 60
-    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+def _load_task(conn, task_id):
+    task = task_store.get_task(conn, task_id)
+    return task['youtube_url'], task['video_path'], task['audio_path'], task['srt_path']
+
+
+# 各阶段的任务函数：在 worker 中执行，每次使用独立的数据库连接
+def run_download(task_id, db_path, keep_video=YOUTUBE_KEEP_VIDEO):
+    conn = connect_db(db_path)
+    try:
+        url, _, _, _ = _load_task(conn, task_id)
+        if keep_video:
+            return download_video(task_id, url, conn)
+        return download_audio(task_id, url, conn)
+    finally:
+        conn.close()
+
+
+def run_extract(task_id, db_path):
+    conn = connect_db(db_path)
+    try:
+        _, video_path, _, _ = _load_task(conn, task_id)
+        return extract_audio(task_id, video_path, conn)
+    finally:
+        conn.close()
+
+
+def run_transcribe(task_id, db_path):
+    conn = connect_db(db_path)
+    try:
+        _, _, audio_path, _ = _load_task(conn, task_id)
+        result = generate_subtitles(task_id, audio_path, conn)
+        return result[0] if result else None
+    except Exception:
+        task_store.mark_failed(conn, task_id)
+        raise
+    finally:
+        conn.close()
+
+
+def run_summarize(task_id, db_path):
+    conn = connect_db(db_path)
+    try:
+        _, _, _, srt_path = _load_task(conn, task_id)
+        if not _verify_input(conn, task_id, srt_path):
+            return None
+        return summarize_content(task_id, srt_to_text(srt_path), conn)
+    except Exception:
+        task_store.mark_failed(conn, task_id)
+        raise
+    finally:
+        conn.close()
+
+
+# 构建按阶段划分的调度器：
+# 下载（I/O 密集，线程池）-> ffmpeg 提取音频（子进程，线程池）-> whisper 转写（CPU 密集，进程池）-> 总结（网络，线程池）
+# 默认的音频模式下，下载阶段直接产出 wav，任务跳过提取音频阶段
+def build_scheduler(db_path=YOUTUBE_DB_PATH, download_workers=DOWNLOAD_WORKERS, ffmpeg_workers=FFMPEG_WORKERS,
+                    transcribe_workers=TRANSCRIBE_WORKERS, summarize_workers=SUMMARIZE_WORKERS,
+                    keep_video=YOUTUBE_KEEP_VIDEO):
+    # 转写进程启动时预加载模型，空闲超时后释放
+    transcribe_pool = partial(
+        ProcessPoolExecutor, transcribe_workers, initializer=whisper_models.init_worker,
+        initargs=((WHISPER_MODEL,) if WHISPER_PRELOAD else (), WHISPER_IDLE_TIMEOUT))
+    stages = [
+        Stage('download', 'PENDING', 'DOWNLOADING', partial(run_download, keep_video=keep_video),
+              partial(ThreadPoolExecutor, download_workers, thread_name_prefix='download'), download_workers),
+        Stage('extract_audio', 'COMPLETED', 'EXTRACTING', run_extract,
+              partial(ThreadPoolExecutor, ffmpeg_workers, thread_name_prefix='ffmpeg'), ffmpeg_workers),
+        Stage('transcribe', 'PROCESSING', 'TRANSCRIBING', run_transcribe,
+              transcribe_pool, transcribe_workers),
+        Stage('summarize', 'TRANSCRIBED', 'SUMMARIZING', run_summarize,
+              partial(ThreadPoolExecutor, summarize_workers, thread_name_prefix='summarize'), summarize_workers),
+    ]
+    return StageScheduler(db_path, stages, connect_db, poll_interval=SCHEDULER_POLL_INTERVAL)
 
 
 # 主任务调度循环
-def task_scheduler(conn):
-    while True:
-        c = conn.cursor()
-        c.execute(
-            "SELECT id, youtube_url, status, video_path, audio_path, srt_path FROM DownloadTasks WHERE status NOT IN ('FAILED', 'DONE')")
-        tasks = c.fetchall()
-        for task in tasks:
-            task_id, url, status, video_path, audio_path, srt_path = task
-            if status == 'PENDING':
-                print(f"Starting download for task {task_id}")
-                download_video(task_id, url, conn)
-            elif status == 'COMPLETED':
-                print(f"Extracting audio for task {task_id}")
-                extract_audio(task_id, video_path, conn)
-            elif status == 'PROCESSING' and audio_path and not srt_path:
-                print(f"Generating subtitles for task {task_id}")
-                srt_path, text = generate_subtitles(task_id, audio_path, conn)
-                summarize_content(task_id, text, conn)
-        time.sleep(10)  # 每10秒检查一次
+def task_scheduler(conn=None, stop_when_idle=False, keep_video=YOUTUBE_KEEP_VIDEO):
+    if conn is not None:
+        conn.close()
+    build_scheduler(keep_video=keep_video).run(stop_when_idle=stop_when_idle)
 
 
 if __name__ == "__main__":
+    metrics.serve()
     conn = init_db()
     # 示例：创建任务
     youtube_url = input("请输入YouTube视频链接: ")
     task_id = create_task(conn, youtube_url)
     print(f"任务创建成功，ID: {task_id}")
+    conn.close()
     # 启动任务调度
-    task_scheduler(conn)
+    try:
+        task_scheduler()
+    finally:
+        metrics.export()